@@ -0,0 +1,92 @@
+"""
+Measures quiz picks per second from the in-memory question index, uniform
+and adaptive (by difficulty), with many quiz sessions played concurrently.
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_adaptive --sizes 10k,1M --threads 1,8,32
+"""
+import argparse
+import random
+import threading
+import time
+
+from flaskr.quiz import QuestionIndex, target_difficulty
+from .common import CATEGORIES, parse_sizes
+
+QUESTIONS_PER_SESSION = 20
+
+
+def build_index(size, seed=0):
+    rng = random.Random(seed)
+    index = QuestionIndex(ttl=None)
+    index.load_rows((question_id, rng.randint(1, len(CATEGORIES)),
+                     rng.randint(1, 5))
+                    for question_id in range(1, size + 1))
+
+    return index
+
+
+def play_sessions(index, adaptive, deadline, counts):
+    """Plays quiz sessions back to back until the deadline"""
+    picks = 0
+
+    while time.perf_counter() < deadline:
+        category = random.choice([None] + list(range(1, len(CATEGORIES) + 1)))
+        # Players answer right more often than not, and less so as the
+        # questions get harder
+        skill = random.uniform(0.5, 0.95)
+        played, difficulties, results = [], [], []
+
+        for _ in range(QUESTIONS_PER_SESSION):
+            target = target_difficulty(difficulties, results) \
+                if adaptive else None
+            picked = index.pick_many(category, set(played), 1, target)
+            if not picked:
+                break
+
+            question_id = picked[0]
+
+            difficulty = index.difficulty(question_id)
+            played.append(question_id)
+            difficulties.append(difficulty)
+            results.append(random.random() < skill - difficulty * 0.05)
+            picks += 1
+
+    counts.append(picks)
+
+
+def run(index, adaptive, threads, duration):
+    counts = []
+    deadline = time.perf_counter() + duration
+    workers = [threading.Thread(target=play_sessions,
+                                args=(index, adaptive, deadline, counts))
+               for _ in range(threads)]
+
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return round(sum(counts) / duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='10k,1M', type=parse_sizes)
+    parser.add_argument('--threads', default='1,8,32')
+    parser.add_argument('--duration', default=2.0, type=float)
+    args = parser.parse_args()
+
+    print('{:>10} {:>8} {:>14} {:>14}'.format(
+        'questions', 'threads', 'uniform/s', 'adaptive/s'))
+    for size in args.sizes:
+        index = build_index(size)
+        for threads in map(int, args.threads.split(',')):
+            print('{:>10} {:>8} {:>14} {:>14}'.format(
+                size, threads, run(index, False, threads, args.duration),
+                run(index, True, threads, args.duration)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Compares concurrency and throughput of the Flask app (threaded WSGI
+server) and the async ASGI app (flaskr/asgi.py served by uvicorn) on the
+same database.
+
+Run from the backend folder (needs uvicorn and aiosqlite, or asyncpg with
+--database-url pointing at Postgres):
+
+    python -m benchmarks.bench_async --size 10k --clients 8,64,256
+"""
+import argparse
+import logging
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+
+from .common import seed_database, http_load, parse_sizes
+
+SCENARIOS = {
+    'questions': ('GET', lambda: ('/questions', None)),
+    'category_questions': ('GET', lambda: (
+        '/categories/{}/questions'.format(random.randint(1, 6)), None)),
+    'search': ('POST', lambda: (
+        '/questions/search', {'searchTerm': 'kalomi'})),
+    'quiz': ('POST', lambda: ('/quizzes', {
+        'previous_questions': [],
+        'quiz_category': {'id': random.randint(0, 6), 'type': ''}
+    })),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve_sync(database_url):
+    from werkzeug.serving import make_server
+    from flaskr import create_app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url})
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server.port, server.shutdown
+
+
+def serve_async(database_url):
+    import uvicorn
+    from flaskr.asgi import create_asgi_app
+
+    port = free_port()
+    config = uvicorn.Config(create_asgi_app(database_url), host='127.0.0.1',
+                            port=port, log_level='error', lifespan='on')
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+
+    return port, stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', default='10k', type=parse_sizes)
+    parser.add_argument('--clients', default='8,64,256',
+                        type=lambda value: [int(v) for v in value.split(',')])
+    parser.add_argument('--duration', default=5.0, type=float)
+    parser.add_argument('--database-url', default=None,
+                        help='an already seeded database, SQLite by default')
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if database_url is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='trivia-bench-'),
+                            'trivia.db')
+        seed_database(path, args.size[0])
+        database_url = 'sqlite:///' + path
+
+    print('{:>6} {:<20} {:>8} {:>10} {:>10} {:>10}'.format(
+        'mode', 'scenario', 'clients', 'p50 ms', 'p99 ms', 'rps'))
+    for mode, serve in (('sync', serve_sync), ('async', serve_async)):
+        port, stop = serve(database_url)
+        for name, (method, make_request) in SCENARIOS.items():
+            for clients in args.clients:
+                result = http_load('127.0.0.1', port, method, make_request,
+                                   clients, args.duration)
+                print('{:>6} {:<20} {:>8} {:>10} {:>10} {:>10}'.format(
+                    mode, name, clients, result['p50_ms'], result['p99_ms'],
+                    result['throughput_rps']))
+        stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Measures POST /quizzes latency while every question of a category is
+deleted: by one DELETE statement run inline, as a request handler would,
+and by the background job of DELETE /categories/<id>/questions, which
+deletes in batches and pauses between them. Also reports how long the
+DELETE request itself takes.
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_jobs --size 100000 --pause-ms 0,10
+"""
+import argparse
+import threading
+import time
+
+from models import db, Question
+from .common import benchmark_app, summarize
+
+CATEGORY = 1
+
+
+def quiz_latencies(app, stop):
+    client = app.test_client()
+    timings = []
+
+    while not stop.is_set():
+        start = time.perf_counter()
+        res = client.post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': CATEGORY % 6 + 1, 'type': ''}})
+        timings.append((time.perf_counter() - start) * 1000)
+        assert res.status_code == 200, res.data
+
+    return timings
+
+
+def delete_inline(app):
+    # Returns how long the request would have been held
+    start = time.perf_counter()
+    with app.app_context():
+        Question.query.filter(Question.category == CATEGORY) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+
+    return time.perf_counter() - start
+
+
+def delete_with_job(app):
+    client = app.test_client()
+    start = time.perf_counter()
+    res = client.delete('/categories/{}/questions'.format(CATEGORY))
+    request = time.perf_counter() - start
+    assert res.status_code == 202, res.data
+
+    job_id = res.get_json()['job']['id']
+    app.extensions['job_queue'].get(job_id).wait()
+
+    return request
+
+
+def run(size, delete, **config):
+    app = benchmark_app(size, **config)
+    stop = threading.Event()
+    results = {}
+
+    def traffic():
+        results['timings'] = quiz_latencies(app, stop)
+
+    # Load the quiz index first
+    app.test_client().post('/quizzes', json={'previous_questions': []})
+    thread = threading.Thread(target=traffic)
+    thread.start()
+    time.sleep(0.2)
+
+    start = time.perf_counter()
+    request = delete(app) if delete is not None else time.sleep(1)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    thread.join()
+
+    result = summarize(results['timings'])
+    if delete is not None:
+        result['request_ms'] = round(request * 1000, 1)
+        result['delete_s'] = round(elapsed, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', default=100000, type=int)
+    parser.add_argument('--batch-size', default=500, type=int)
+    parser.add_argument('--pause-ms', default='0,10')
+    args = parser.parse_args()
+
+    modes = [('no delete', None, {}), ('inline', delete_inline, {})]
+    for pause in args.pause_ms.split(','):
+        modes.append(('job, {} ms pause'.format(pause), delete_with_job, {
+            'JOB_BATCH_SIZE': args.batch_size,
+            'JOB_BATCH_PAUSE_MS': float(pause)}))
+
+    print('{:<20} {:>12} {:>12} {:>12} {:>10}'.format(
+        'mode', 'quiz p50 ms', 'quiz p99 ms', 'request ms', 'delete s'))
+    for name, delete, config in modes:
+        result = run(args.size, delete, **config)
+        print('{:<20} {:>12} {:>12} {:>12} {:>10}'.format(
+            name, result['p50_ms'], result['p99_ms'],
+            result.get('request_ms', '-'), result.get('delete_s', '-')))
+
+
+if __name__ == '__main__':
+    main()
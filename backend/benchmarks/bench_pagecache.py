@@ -0,0 +1,74 @@
+"""
+Measures question listing latency with the page cache turned off and on,
+and its hit rate, for a skewed mix of page reads and question writes.
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_pagecache --sizes 10k,100k --write-ratio 0.01
+"""
+import argparse
+import random
+
+from .common import CATEGORIES, benchmark_app, measure, summarize, \
+    parse_sizes
+
+NEW_QUESTION = {
+    'question': 'Which benchmark added this question?',
+    'answer': 'The page cache one',
+    'difficulty': 2,
+    'category': 1
+}
+
+
+def listing_url(size, rng):
+    # Most readers stay on the first pages of a listing
+    pages = max(1, size // 10)
+    page = rng.randint(1, min(pages, 5)) if rng.random() < 0.8 \
+        else rng.randint(1, pages)
+
+    if rng.random() < 0.5:
+        return '/questions?page={}'.format(page)
+
+    return '/categories/{}/questions?page={}'.format(
+        rng.randint(1, len(CATEGORIES)),
+        max(1, page // (2 * len(CATEGORIES))))
+
+
+def run(app, size, write_ratio, iterations, seed=0):
+    rng = random.Random(seed)
+    client = app.test_client()
+
+    def request():
+        if rng.random() < write_ratio:
+            res = client.post('/questions', json=NEW_QUESTION)
+            assert res.status_code == 201, res.data
+        else:
+            res = client.get(listing_url(size, rng))
+            assert res.status_code == 200, res.data
+
+    result = summarize(measure(request, iterations))
+    result['hit_rate'] = client.get('/stats/cache').get_json().get('hit_rate')
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='10k,100k', type=parse_sizes)
+    parser.add_argument('--write-ratio', default=0.01, type=float)
+    parser.add_argument('--iterations', default=2000, type=int)
+    args = parser.parse_args()
+
+    print('{:>10} {:>8} {:>10} {:>10} {:>10}'.format(
+        'questions', 'cache', 'p50 ms', 'p99 ms', 'hit rate'))
+    for size in args.sizes:
+        for max_bytes in (0, 8 * 1024 * 1024):
+            app = benchmark_app(size, PAGE_CACHE_MAX_BYTES=max_bytes)
+            result = run(app, size, args.write_ratio, args.iterations)
+            print('{:>10} {:>8} {:>10} {:>10} {:>10}'.format(
+                size, 'on' if max_bytes else 'off', result['p50_ms'],
+                result['p99_ms'], result['hit_rate'] or '-'))
+
+
+if __name__ == '__main__':
+    main()
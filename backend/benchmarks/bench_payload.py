@@ -0,0 +1,55 @@
+"""
+Measures the bytes sent for a page of GET /questions, and the time it
+takes to build it, with and without compression and payload slimming.
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_payload --size 10k
+"""
+import argparse
+
+from flaskr.compress import brotli
+from .common import benchmark_app, measure, summarize, parse_sizes
+
+
+def variants(categories_etag):
+    yield 'full', '/questions', None
+    yield 'fields=question,category,difficulty', \
+        '/questions?fields=question,category,difficulty', None
+    yield 'categories_etag', \
+        '/questions?categories_etag=' + categories_etag, None
+    yield 'full, gzip', '/questions', 'gzip'
+    if brotli is not None:
+        yield 'full, br', '/questions', 'br'
+    yield 'slim, gzip', \
+        '/questions?fields=question,category,difficulty', 'gzip'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', default='10k', type=parse_sizes)
+    parser.add_argument('--iterations', default=300, type=int)
+    args = parser.parse_args()
+
+    app = benchmark_app(args.size[0])
+    client = app.test_client()
+    etag = client.get('/categories').headers['ETag'].strip('"')
+
+    print('{:<42} {:>8} {:>10} {:>10}'.format(
+        'variant', 'bytes', 'p50 ms', 'p99 ms'))
+    for name, url, encoding in variants(etag):
+        headers = {'Accept-Encoding': encoding} if encoding else {}
+
+        def fetch():
+            res = client.get(url, headers=headers)
+            assert res.status_code == 200, res.data
+            return res
+
+        size = len(fetch().data)
+        result = summarize(measure(fetch, args.iterations))
+        print('{:<42} {:>8} {:>10} {:>10}'.format(
+            name, size, result['p50_ms'], result['p99_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Measures POST /quizzes latency as the question bank grows, and the time
+to fetch the questions of a whole game one round at a time or in one
+batch (count).
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_quiz --sizes 1k,10k,100k,1M
+"""
+import argparse
+import random
+
+from .common import benchmark_app, measure, summarize, parse_sizes
+
+QUESTIONS_PER_GAME = 5
+
+
+def run(size, iterations):
+    app = benchmark_app(size)
+    client = app.test_client()
+
+    def play():
+        body = {
+            'previous_questions': random.sample(range(1, size + 1), 5),
+            'quiz_category': {'id': random.randint(0, 6), 'type': ''}
+        }
+        res = client.post('/quizzes', json=body)
+        assert res.status_code == 200, res.data
+
+    def play_game(batch):
+        previous_questions = []
+        category = {'id': random.randint(0, 6), 'type': ''}
+
+        while len(previous_questions) < QUESTIONS_PER_GAME:
+            body = {'previous_questions': previous_questions,
+                    'quiz_category': category}
+            if batch:
+                body['count'] = QUESTIONS_PER_GAME
+            data = client.post('/quizzes', json=body).get_json()
+            questions = data['questions'] if batch else [data['question']]
+            previous_questions += [question['id'] for question in questions]
+
+    # The first call loads the question index
+    warmup = measure(play, 1)[0]
+    result = summarize(measure(play, iterations))
+    result['index_load_ms'] = round(warmup, 3)
+    result['game_ms'] = summarize(
+        measure(lambda: play_game(False), iterations // 5))['p50_ms']
+    result['batched_game_ms'] = summarize(
+        measure(lambda: play_game(True), iterations // 5))['p50_ms']
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1k,10k,100k,1M', type=parse_sizes)
+    parser.add_argument('--iterations', default=500, type=int)
+    args = parser.parse_args()
+
+    print('{:>10} {:>10} {:>10} {:>15} {:>10} {:>16}'.format(
+        'questions', 'p50 ms', 'p99 ms', 'index load ms', 'game ms',
+        'batched game ms'))
+    for size in args.sizes:
+        result = run(size, args.iterations)
+        print('{:>10} {:>10} {:>10} {:>15} {:>10} {:>16}'.format(
+            size, result['p50_ms'], result['p99_ms'], result['index_load_ms'],
+            result['game_ms'], result['batched_game_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Measures the cost of one round of a synchronized quiz: pushed to a room
+of players (one draw, encoded once, fanned out) against every player
+polling POST /quizzes on their own.
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_rooms --players 100,1000
+"""
+import argparse
+import time
+
+from flaskr.rooms import Room
+from .common import benchmark_app
+
+ROUNDS = 5
+
+
+def room_round_ms(app, players):
+    with app.app_context():
+        room = Room(None, ROUNDS)
+        subscribers = [room.subscribe() for _ in range(players)]
+
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            room.next_round()
+            # What the players' streams write out
+            for events in subscribers:
+                events.get_nowait()
+        elapsed = time.perf_counter() - start
+
+    return round(elapsed * 1000 / ROUNDS, 3)
+
+
+def polling_round_ms(app, players):
+    client = app.test_client()
+
+    start = time.perf_counter()
+    for _ in range(players):
+        res = client.post('/quizzes', json={'previous_questions': [],
+                                            'quiz_category': None})
+        assert res.status_code == 200, res.data
+    elapsed = time.perf_counter() - start
+
+    return round(elapsed * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', default=10000, type=int)
+    parser.add_argument('--players', default='100,1000')
+    args = parser.parse_args()
+
+    app = benchmark_app(args.size)
+    # Load the question index before timing anything
+    polling_round_ms(app, 1)
+
+    print('{:>8} {:>16} {:>16}'.format('players', 'room round ms',
+                                       'polling round ms'))
+    for players in map(int, args.players.split(',')):
+        print('{:>8} {:>16} {:>16}'.format(
+            players, room_round_ms(app, players),
+            polling_round_ms(app, players)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Measures POST /quizzes/answers throughput as batches of scorecards grow,
+scored in the worker and on the process pool. A third of the answers are
+right, a third have a typo and a third are wrong.
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_scoring --scorecards 100,1000,5000
+"""
+import argparse
+import random
+import time
+
+from models import db, Question
+from .common import benchmark_app
+
+ANSWERS_PER_SCORECARD = 10
+
+
+def misspell(answer, rng):
+    position = rng.randrange(len(answer))
+    return answer[:position] + answer[position + 1:]
+
+
+def make_batch(correct_answers, scorecards, rng):
+    question_ids = list(correct_answers)
+    submissions = []
+    for scorecard in range(scorecards):
+        answers = []
+        for _ in range(ANSWERS_PER_SCORECARD):
+            question_id = rng.choice(question_ids)
+            answer = correct_answers[question_id]
+            kind = rng.randrange(3)
+            if kind == 1:
+                answer = misspell(answer, rng)
+            elif kind == 2:
+                answer = 'No idea'
+            answers.append({'question_id': question_id, 'answer': answer})
+        submissions.append({'id': scorecard, 'answers': answers})
+
+    return {'submissions': submissions}
+
+
+def run(app, batch):
+    client = app.test_client()
+
+    start = time.perf_counter()
+    res = client.post('/quizzes/answers', json=batch)
+    elapsed = time.perf_counter() - start
+    assert res.status_code == 200, res.data
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', default=10000, type=int)
+    parser.add_argument('--scorecards', default='100,1000,5000')
+    parser.add_argument('--workers', default=4, type=int)
+    args = parser.parse_args()
+
+    app = benchmark_app(args.size, SCORING_POOL_THRESHOLD=0)
+    with app.app_context():
+        correct_answers = dict(db.session.query(Question.id, Question.answer))
+    rng = random.Random(0)
+
+    print('{:>11} {:<11} {:>10} {:>14}'.format('scorecards', 'mode', 'ms',
+                                               'answers/s'))
+    for scorecards in map(int, args.scorecards.split(',')):
+        batch = make_batch(correct_answers, scorecards, rng)
+        answers = scorecards * ANSWERS_PER_SCORECARD
+
+        for mode, threshold in (('in-process', 0), ('pool', 1)):
+            app.config.update(SCORING_POOL_THRESHOLD=threshold,
+                              SCORING_WORKERS=args.workers)
+            # Load the answers and start the pool before timing
+            run(app, batch)
+            elapsed = run(app, batch)
+            print('{:>11} {:<11} {:>10} {:>14}'.format(
+                scorecards, mode, round(elapsed * 1000, 1),
+                int(answers / elapsed)))
+
+
+if __name__ == '__main__':
+    main()
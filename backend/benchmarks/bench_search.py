@@ -0,0 +1,52 @@
+"""
+Compares POST /questions/search through the database (ILIKE) and through
+the in-memory search index.
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_search --sizes 1k,10k,100k
+"""
+import argparse
+import random
+
+from .common import NAMES, benchmark_app, measure, summarize, parse_sizes
+
+# Mostly selective terms, plus a few that match many questions
+TERMS = NAMES[:200] + ['river', 'question 12', 'zzz']
+
+
+def run(size, mode, iterations):
+    app = benchmark_app(size, SEARCH_MODE=mode)
+    client = app.test_client()
+
+    def search():
+        res = client.post('/questions/search',
+                          json={'searchTerm': random.choice(TERMS)})
+        assert res.status_code == 200, res.data
+
+    # The first call loads the search index in index mode
+    warmup = measure(search, 1)[0]
+    result = summarize(measure(search, iterations))
+    result['first_request_ms'] = round(warmup, 3)
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1k,10k,100k', type=parse_sizes)
+    parser.add_argument('--iterations', default=200, type=int)
+    args = parser.parse_args()
+
+    print('{:>10} {:>10} {:>10} {:>10} {:>18}'.format(
+        'questions', 'mode', 'p50 ms', 'p99 ms', 'first request ms'))
+    for size in args.sizes:
+        for mode in ('database', 'index'):
+            result = run(size, mode, args.iterations)
+            print('{:>10} {:>10} {:>10} {:>10} {:>18}'.format(
+                size, mode, result['p50_ms'], result['p99_ms'],
+                result['first_request_ms']))
+
+
+if __name__ == '__main__':
+    main()
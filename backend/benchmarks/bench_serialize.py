@@ -0,0 +1,74 @@
+"""
+Compares the per-row cost of serializing question listings from full ORM
+objects (Question.format() and jsonify) and from projected column rows
+(format_question_row and json_response).
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_serialize --rows 10000
+"""
+import argparse
+import time
+import tracemalloc
+from flask import jsonify
+
+from models import db, Question, QUESTION_COLUMNS, format_question_row
+from flaskr.serialize import json_response, orjson
+from .common import benchmark_app
+
+
+def orm_listing(rows):
+    questions = Question.query.order_by(Question.id).limit(rows).all()
+    return jsonify({
+        'questions': [question.format() for question in questions],
+        'total_questions': rows
+    }).get_data()
+
+
+def projected_listing(rows):
+    questions = db.session.query(*QUESTION_COLUMNS) \
+        .order_by(Question.id).limit(rows).all()
+    return json_response({
+        'questions': [format_question_row(row) for row in questions],
+        'total_questions': rows
+    }).get_data()
+
+
+def profile(fn, rows, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = fn(rows)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    fn(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return body, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', default=10000, type=int)
+    parser.add_argument('--repeat', default=5, type=int)
+    args = parser.parse_args()
+
+    app = benchmark_app(args.rows)
+    print('orjson installed:', orjson is not None)
+    print('{:>12} {:>14} {:>18}'.format('path', 'us per row', 'peak bytes/row'))
+
+    with app.test_request_context():
+        bodies = []
+        for name, fn in (('orm', orm_listing), ('projected', projected_listing)):
+            body, elapsed, peak = profile(fn, args.rows, args.repeat)
+            bodies.append(body)
+            print('{:>12} {:>14.2f} {:>18.0f}'.format(
+                name, elapsed / args.rows * 1e6, peak / args.rows))
+            db.session.remove()
+
+        print('identical output:', bodies[0] == bodies[1])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Measures how long a fresh worker takes to start: importing the app,
+create_app, and the first and second requests, each run in a new process.
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_startup --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from .common import seed_database
+
+# Runs in the fresh process, and prints its timings as JSON
+WORKER = '''
+import json, sys, time
+start = time.perf_counter()
+import flaskr
+imported = time.perf_counter()
+app = flaskr.create_app(json.loads(sys.argv[1]))
+created = time.perf_counter()
+client = app.test_client()
+assert client.get('/questions').status_code == 200
+first = time.perf_counter()
+assert client.get('/questions?page=2').status_code == 200
+second = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (first - created) * 1000,
+    'second_request_ms': (second - first) * 1000,
+}))
+'''
+
+COLUMNS = ('import_ms', 'create_app_ms', 'first_request_ms',
+           'second_request_ms')
+
+
+def start_worker(config):
+    output = subprocess.run(
+        [sys.executable, '-c', WORKER, json.dumps(config)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        check=True, capture_output=True, text=True).stdout
+
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', default=10000, type=int)
+    parser.add_argument('--runs', default=10, type=int)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix='trivia-bench-'),
+                        'trivia.db')
+    seed_database(path, args.size)
+    database = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path}
+
+    print('{:<16}'.format('mode') +
+          ''.join('{:>20}'.format(column) for column in COLUMNS))
+    for name, config in (('init-db', database),
+                         ('DB_CREATE_ALL', dict(database, DB_CREATE_ALL=True))):
+        runs = [start_worker(config) for _ in range(args.runs)]
+        print('{:<16}'.format(name) + ''.join(
+            '{:>20}'.format(round(statistics.median(
+                run[column] for run in runs), 2)) for column in COLUMNS))
+
+
+if __name__ == '__main__':
+    main()
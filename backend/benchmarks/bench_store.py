@@ -0,0 +1,96 @@
+"""
+Measures read latency with the question store turned off and on, and how
+long the store takes to load from the database and from a snapshot file.
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_store --sizes 10k,100k
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from flaskr import create_app
+from flaskr.store import QuestionStore, write_snapshot
+from models import db, Question, QUESTION_COLUMNS
+from .common import CATEGORIES, WORDS, benchmark_app, measure, summarize, \
+    parse_sizes
+
+
+def requests(size, rng):
+    pages = max(1, size // 10)
+
+    yield 'listing', lambda client: client.get(
+        '/questions?page={}'.format(rng.randint(1, pages)))
+    yield 'category', lambda client: client.get(
+        '/categories/{}/questions?page={}'.format(
+            rng.randint(1, len(CATEGORIES)),
+            rng.randint(1, max(1, pages // len(CATEGORIES)))))
+    yield 'search', lambda client: client.post(
+        '/questions/search', json={'searchTerm': rng.choice(WORDS)})
+    yield 'quiz', lambda client: client.post('/quizzes', json={
+        'previous_questions': [],
+        'quiz_category': {'id': rng.randint(1, len(CATEGORIES))}})
+
+
+def load_ms(app, snapshot):
+    with app.app_context():
+        start = time.perf_counter()
+        rows = db.session.query(*QUESTION_COLUMNS).order_by(Question.id) \
+            .yield_per(10000)
+        QuestionStore.from_rows(rows)
+        database = time.perf_counter() - start
+
+    start = time.perf_counter()
+    QuestionStore.open(snapshot)
+    mapped = time.perf_counter() - start
+
+    return round(database * 1000, 3), round(mapped * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='10k,100k')
+    parser.add_argument('--iterations', default=200, type=int)
+    args = parser.parse_args()
+
+    print('{:>8} {:<10} {:>16} {:>16}'.format('size', 'request',
+                                              'database p50 ms',
+                                              'store p50 ms'))
+    for size in parse_sizes(args.sizes):
+        directory = tempfile.mkdtemp(prefix='trivia-bench-')
+        # The page cache would hide the cost of building a page
+        app = benchmark_app(size, directory, PAGE_CACHE_MAX_BYTES=0)
+        snapshot = os.path.join(directory, 'questions.snapshot')
+        with app.app_context():
+            write_snapshot(snapshot)
+
+        database = {'SQLALCHEMY_DATABASE_URI':
+                    app.config['SQLALCHEMY_DATABASE_URI'],
+                    'PAGE_CACHE_MAX_BYTES': 0}
+        clients = {
+            'database': app.test_client(),
+            'store': create_app(dict(database, QUESTION_STORE=True,
+                                     QUESTION_STORE_SNAPSHOT=snapshot))
+            .test_client(),
+        }
+
+        for request, send in requests(size, random.Random(0)):
+            latencies = []
+            for name in ('database', 'store'):
+                client = clients[name]
+                assert send(client).status_code == 200
+                latencies.append(summarize(measure(
+                    lambda: send(client), args.iterations))['p50_ms'])
+            print('{:>8} {:<10} {:>16} {:>16}'.format(size, request,
+                                                      *latencies))
+
+        database, mapped = load_ms(app, snapshot)
+        print('{:>8} load from the database {} ms, from the snapshot {} ms'
+              .format(size, database, mapped))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Measures worker peak RSS against result count for a search that matches
+every question: the results built and encoded at once, against the same
+results streamed (?stream=true) through a server-side cursor. Each run
+is made in a fresh process.
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_stream --counts 1k,10k,100k
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from .common import seed_database, parse_sizes
+
+# Every synthetic question starts with "Question"
+SEARCH = {'searchTerm': 'question'}
+
+
+def run(path, count, mode, results):
+    from flaskr import create_app, format_questions
+    from flaskr.search import search_selection
+    from flaskr.serialize import json_response
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+                      'STREAM_MAX_PAGE_SIZE': count})
+    client = app.test_client()
+    # Warm up the app before measuring
+    client.post('/questions/search', json=SEARCH)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if mode == 'buffered':
+        with app.test_request_context():
+            rows = search_selection(SEARCH['searchTerm'], ranked=False) \
+                .limit(count).all()
+            size = len(json_response({
+                'questions': format_questions(rows),
+                'total_questions': len(rows),
+            }).get_data())
+    else:
+        res = client.post('/questions/search?stream=true&per_page={}'
+                          .format(count), json=SEARCH, buffered=False)
+        size = sum(len(chunk) for chunk in res.response)
+        res.close()
+    elapsed = time.perf_counter() - start
+
+    results.put({
+        'bytes': size,
+        'ms': round(elapsed * 1000, 1),
+        'rss_growth_mb': round((resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss - before) / 1024, 1),
+    })
+
+
+def run_isolated(path, count, mode):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=run, args=(path, count, mode, results))
+    process.start()
+    result = results.get()
+    process.join()
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--counts', default='1k,10k,100k')
+    args = parser.parse_args()
+
+    counts = parse_sizes(args.counts)
+    path = os.path.join(tempfile.mkdtemp(prefix='trivia-bench-'),
+                        'trivia.db')
+    seed_database(path, max(counts))
+
+    print('{:>8} {:<10} {:>12} {:>10} {:>16}'.format(
+        'results', 'mode', 'bytes', 'ms', 'RSS growth MiB'))
+    for count in counts:
+        for mode in ('buffered', 'streamed'):
+            result = run_isolated(path, count, mode)
+            print('{:>8} {:<10} {:>12} {:>10} {:>16}'.format(
+                count, mode, result['bytes'], result['ms'],
+                result['rss_growth_mb']))
+
+
+if __name__ == '__main__':
+    main()
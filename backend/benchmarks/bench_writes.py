@@ -0,0 +1,67 @@
+"""
+Measures POST /questions throughput and the number of commits it takes,
+with concurrent writers, one commit per question against coalesced ones.
+
+Run from the backend folder:
+
+    python -m benchmarks.bench_writes --threads 1,8,32
+"""
+import argparse
+import threading
+import time
+
+from .common import benchmark_app
+
+NEW_QUESTION = {
+    'question': 'Which benchmark added this question?',
+    'answer': 'The writes one',
+    'difficulty': 2,
+    'category': 1
+}
+
+VARIANTS = (
+    ('one commit per question', {'WRITE_BATCH_SIZE': 1}),
+    ('group commit', {}),
+    ('group commit, 5 ms window', {'WRITE_BATCH_WINDOW_MS': 5}),
+)
+
+
+def run(app, threads, writes):
+    def post():
+        client = app.test_client()
+        for _ in range(writes):
+            res = client.post('/questions', json=NEW_QUESTION)
+            assert res.status_code == 201, res.data
+
+    workers = [threading.Thread(target=post) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    return round(threads * writes / elapsed), \
+        app.extensions['write_coalescer'].batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', default=10000, type=int)
+    parser.add_argument('--threads', default='1,8,32')
+    parser.add_argument('--writes', default=50, type=int,
+                        help='questions posted by each thread')
+    args = parser.parse_args()
+
+    print('{:<28} {:>8} {:>10} {:>10}'.format(
+        'variant', 'threads', 'writes/s', 'commits'))
+    for threads in map(int, args.threads.split(',')):
+        for name, config in VARIANTS:
+            app = benchmark_app(args.size, **config)
+            writes_per_second, commits = run(app, threads, args.writes)
+            print('{:<28} {:>8} {:>10} {:>10}'.format(
+                name, threads, writes_per_second, commits))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import http.client
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from flaskr import create_app
+from models import db, upgrade_schema
+
+CATEGORIES = ['Science', 'Art', 'Geography',
+              'History', 'Entertainment', 'Sports']
+
+WORDS = ['title', 'river', 'painting', 'king', 'planet', 'movie', 'team',
+         'city', 'author', 'element', 'war', 'ocean', 'song', 'empire',
+         'league', 'theory', 'mountain', 'novel', 'actor', 'festival']
+
+# Made up names so that question texts are about as varied as real ones
+SYLLABLES = ['ka', 'lo', 'mi', 'ren', 'tu', 'sa', 'vel', 'dor', 'qui', 'zan',
+             'po', 'lia', 'nex', 'bra', 'fen']
+NAMES = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+
+
+def seed_database(path, size, seed=0):
+    """
+    Creates a SQLite trivia database at path holding `size` synthetic
+    questions spread over the six categories
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+    with app.app_context():
+        db.create_all()
+
+    rng = random.Random(seed)
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        'INSERT INTO categories (id, type) VALUES (?, ?)',
+        [(i + 1, name) for i, name in enumerate(CATEGORIES)])
+
+    def rows():
+        for i in range(1, size + 1):
+            words = rng.sample(WORDS, 3)
+            names = rng.sample(NAMES, 3)
+            yield (
+                i,
+                'Question {} about the {} of {}?'.format(
+                    i, ' '.join(words), ' and '.join(names)),
+                'Answer {} {}'.format(i, names[0].title()),
+                str(rng.randint(1, len(CATEGORIES))),
+                rng.randint(1, 5),
+            )
+
+    connection.executemany(
+        'INSERT INTO questions (id, question, answer, category, difficulty) '
+        'VALUES (?, ?, ?, ?, ?)', rows())
+    connection.commit()
+    connection.close()
+
+    # Count the seeded questions, as flask init-db would
+    with app.app_context():
+        upgrade_schema()
+        db.session.remove()
+        db.engine.dispose()
+
+
+def benchmark_app(size, directory=None, **config):
+    """Seeds a temporary database of `size` questions and returns an app"""
+    directory = directory or tempfile.mkdtemp(prefix='trivia-bench-')
+    path = os.path.join(directory, 'trivia-{}.db'.format(size))
+    seed_database(path, size)
+
+    config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    return create_app(config)
+
+
+def measure(fn, iterations):
+    """Runs fn `iterations` times and returns latencies in milliseconds"""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return timings
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p99_ms': round(timings[int(len(timings) * 0.99) - 1], 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+    }
+
+
+def parse_sizes(value):
+    return [int(size.replace('k', '000').replace('M', '000000'))
+            for size in value.split(',')]
+
+
+def http_load(host, port, method, make_request, clients, duration):
+    """
+    Sends requests from `clients` concurrent keep-alive connections for
+    `duration` seconds. make_request returns the url and JSON body of one
+    request.
+    """
+    timings = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        connection = http.client.HTTPConnection(host, port)
+        local = []
+        while time.perf_counter() < deadline:
+            url, body = make_request()
+            headers = {'Content-Type': 'application/json'}
+            data = json.dumps(body) if body is not None else None
+            start = time.perf_counter()
+            connection.request(method, url, body=data, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            local.append((time.perf_counter() - start) * 1000)
+            if response.status >= 500:
+                errors.append(response.status)
+        with lock:
+            timings.extend(local)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=client) for _ in range(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    result = summarize(timings)
+    result['clients'] = clients
+    result['requests'] = len(timings)
+    result['errors'] = len(errors)
+    result['throughput_rps'] = round(len(timings) / elapsed, 1)
+
+    return result
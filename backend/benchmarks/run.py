@@ -0,0 +1,306 @@
+"""
+Benchmarks every trivia endpoint against seeded SQLite databases.
+
+Each endpoint is driven through the Flask test client in a fresh process
+(so its peak RSS can be reported on its own), then the read endpoints are
+load tested over HTTP by concurrent clients. Results go to a JSON file.
+
+Run from the backend folder:
+
+    python -m benchmarks.run --sizes 1k,100k,1M --output bench_results.json
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+
+from .common import seed_database, measure, summarize, parse_sizes, \
+    http_load
+
+NEW_QUESTION = {
+    'question': 'What is the name of the president of Nigeria?',
+    'answer': 'Gen. Muhammad Buhari',
+    'difficulty': 1,
+    'category': 4
+}
+
+
+def scenarios(size):
+    """
+    Returns {name: (method, rule, request factory, iterations factor)}.
+    The request factory is given the test client (None over HTTP) and
+    returns the url and body of one request.
+    """
+    deleted = iter(range(size, 0, -1))
+    bulk_body = '\n'.join(json.dumps(NEW_QUESTION) for _ in range(100))
+    sessions = []
+
+    def session_next(client):
+        if not sessions:
+            res = client.post('/quizzes/sessions', json={'size': 1000})
+            sessions.append(res.get_json()['session_id'])
+
+        return '/quizzes/sessions/{}/next'.format(sessions[0]), None
+
+    rooms = []
+
+    def room_url(client, path):
+        if not rooms:
+            res = client.post('/quizzes/rooms', json={'rounds': 50})
+            rooms.append(res.get_json()['room_id'])
+
+        return '/quizzes/rooms/{}{}'.format(rooms[0], path)
+
+    finished_rooms = []
+
+    def room_events(client):
+        # The stream of a finished room ends after its last event, so that
+        # the request can be timed like the others
+        if not finished_rooms:
+            res = client.post('/quizzes/rooms', json={'rounds': 1})
+            room_id = res.get_json()['room_id']
+            for _ in range(2):
+                client.post('/quizzes/rooms/{}/next'.format(room_id))
+            finished_rooms.append(room_id)
+
+        return '/quizzes/rooms/{}/events'.format(finished_rooms[0]), None
+
+    jobs = []
+
+    def job_url(client):
+        if not jobs:
+            res = client.post('/jobs', json={'kind': 'recount'})
+            jobs.append(res.get_json()['job']['id'])
+
+        return '/jobs/{}'.format(jobs[0]), None
+
+    def previous_questions():
+        return random.sample(range(1, size + 1), min(size, 5))
+
+    return {
+        'categories': ('GET', '/categories',
+                       lambda client: ('/categories', None), 1),
+        'category_stats': ('GET', '/categories/stats',
+                           lambda client: ('/categories/stats', None), 1),
+        'questions_first_page': ('GET', '/questions',
+                                 lambda client: ('/questions', None), 1),
+        'questions_deep_page': ('GET', '/questions', lambda client: (
+            '/questions?page={}'.format(size // 10), None), 1),
+        'questions_after_id': ('GET', '/questions', lambda client: (
+            '/questions?after_id={}'.format(size - 15), None), 1),
+        'category_questions': (
+            'GET', '/categories/<int:category_id>/questions',
+            lambda client: ('/categories/{}/questions'.format(
+                random.randint(1, 6)), None), 1),
+        'search': ('POST', '/questions/search', lambda client: (
+            '/questions/search',
+            {'searchTerm': random.choice(['river', 'kalomi', 'zzz'])}), 1),
+        'search_stream': ('POST', '/questions/search', lambda client: (
+            '/questions/search?stream=true&per_page=1000',
+            {'searchTerm': 'river'}), 0.2),
+        'category_questions_stream': (
+            'GET', '/categories/<int:category_id>/questions',
+            lambda client: ('/categories/{}/questions?stream=true'
+                            '&per_page=1000'.format(random.randint(1, 6)),
+                            None), 0.2),
+        'quiz': ('POST', '/quizzes', lambda client: ('/quizzes', {
+            'previous_questions': previous_questions(),
+            'quiz_category': {'id': random.randint(0, 6), 'type': ''}
+        }), 1),
+        'quiz_batch': ('POST', '/quizzes', lambda client: ('/quizzes', {
+            'previous_questions': previous_questions(),
+            'quiz_category': {'id': random.randint(0, 6), 'type': ''},
+            'count': 10
+        }), 1),
+        'quiz_answers': ('POST', '/quizzes/answers', lambda client: (
+            '/quizzes/answers', {'submissions': [{'answers': [
+                {'question_id': question_id, 'answer': 'Answer'}
+                for question_id in previous_questions()]}
+                for _ in range(10)]}), 1),
+        'quiz_session': ('POST', '/quizzes/sessions', lambda client: (
+            '/quizzes/sessions', {'size': 10}), 1),
+        'quiz_session_next': ('POST', '/quizzes/sessions/<session_id>/next',
+                              session_next, 1),
+        'quiz_room': ('POST', '/quizzes/rooms', lambda client: (
+            '/quizzes/rooms', {'rounds': 5}), 1),
+        'quiz_room_state': ('GET', '/quizzes/rooms/<room_id>',
+                            lambda client: (room_url(client, ''), None), 1),
+        'quiz_room_next': ('POST', '/quizzes/rooms/<room_id>/next',
+                           lambda client: (room_url(client, '/next'), None),
+                           1),
+        'quiz_room_answer': ('POST', '/quizzes/rooms/<room_id>/answers',
+                             lambda client: (room_url(client, '/answers'), {
+                                 'player': str(random.random()),
+                                 'round': 1, 'answer': 'Answer'}), 1),
+        'quiz_room_events': ('GET', '/quizzes/rooms/<room_id>/events',
+                             room_events, 1),
+        'recount_job': ('POST', '/jobs', lambda client: (
+            '/jobs', {'kind': 'recount'}), 0.1),
+        'job_status': ('GET', '/jobs/<job_id>', job_url, 1),
+        'delete_category_questions': (
+            'DELETE', '/categories/<int:category_id>/questions',
+            lambda client: ('/categories/6/questions', None), 0.1),
+        'add_question': ('POST', '/questions',
+                         lambda client: ('/questions', NEW_QUESTION), 1),
+        'delete_question': ('DELETE', '/questions/<int:question_id>',
+                            lambda client: (
+                                '/questions/{}'.format(next(deleted)), None),
+                            1),
+        'bulk_import_100': ('POST', '/questions/bulk', lambda client: (
+            '/questions/bulk', bulk_body), 0.1),
+        'export': ('GET', '/questions/export',
+                   lambda client: ('/questions/export', None), 0.01),
+        'pool_stats': ('GET', '/stats/pool',
+                       lambda client: ('/stats/pool', None), 1),
+        'cache_stats': ('GET', '/stats/cache',
+                        lambda client: ('/stats/cache', None), 1),
+    }
+
+
+def create_benchmark_app(path):
+    from flaskr import create_app
+
+    return create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+
+
+def send(client, method, url, body):
+    if isinstance(body, str):
+        return client.open(url, method=method, data=body,
+                           content_type='application/x-ndjson')
+
+    return client.open(url, method=method, json=body)
+
+
+def run_scenario(path, size, name, iterations, results):
+    """Runs one scenario in the current process and reports to results"""
+    app = create_benchmark_app(path)
+    client = app.test_client()
+    method, _, make_request, factor = scenarios(size)[name]
+    iterations = max(int(iterations * factor), 3)
+
+    def call():
+        url, body = make_request(client)
+        res = send(client, method, url, body)
+        assert res.status_code < 500, res.data
+        res.get_data()
+
+    # Warm up caches and indexes before measuring
+    call()
+    start = time.perf_counter()
+    timings = measure(call, iterations)
+    elapsed = time.perf_counter() - start
+
+    result = summarize(timings)
+    result['requests'] = iterations
+    result['throughput_rps'] = round(iterations / elapsed, 1)
+    result['peak_rss_kb'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss
+    results.put(result)
+
+
+def run_isolated(path, size, name, iterations):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=run_scenario,
+                              args=(path, size, name, iterations, results))
+    process.start()
+    result = results.get()
+    process.join()
+
+    return result
+
+
+def load_test(path, size, name, clients, duration):
+    """Drives one read scenario over HTTP with concurrent keep-alive clients"""
+    from werkzeug.serving import make_server
+
+    # Keep the per-request access log out of the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = create_benchmark_app(path)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    method, _, make_request, _ = scenarios(size)[name]
+    result = http_load('127.0.0.1', server.port, method,
+                       lambda: make_request(None), clients, duration)
+    server.shutdown()
+
+    return result
+
+
+def uncovered_routes(path, size):
+    """Lists the app routes no scenario exercises"""
+    app = create_benchmark_app(path)
+    covered = {(method, rule)
+               for method, rule, _, _ in scenarios(size).values()}
+    routes = {(method, rule.rule) for rule in app.url_map.iter_rules()
+              for method in rule.methods - {'HEAD', 'OPTIONS'}
+              if rule.endpoint != 'static'}
+
+    return sorted(routes - covered)
+
+
+LOAD_TEST_SCENARIOS = ('categories', 'questions_first_page',
+                       'category_questions', 'search', 'quiz')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1k,100k', type=parse_sizes)
+    parser.add_argument('--iterations', default=200, type=int)
+    parser.add_argument('--clients', default=8, type=int)
+    parser.add_argument('--duration', default=5.0, type=float)
+    parser.add_argument('--only', default=None,
+                        help='comma separated scenario names')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='trivia-bench-')
+    report = {'sizes': {}}
+
+    for size in args.sizes:
+        path = os.path.join(directory, 'trivia-{}.db'.format(size))
+        names = args.only.split(',') if args.only else list(scenarios(size))
+        report['sizes'][size] = {'endpoints': {}, 'load': {}}
+
+        for name in names:
+            # Every scenario starts from a freshly seeded database
+            seed_database(path, size)
+            result = run_isolated(path, size, name, args.iterations)
+            report['sizes'][size]['endpoints'][name] = result
+            print('{:>8} {:<22} p50 {:>9} ms  p99 {:>9} ms  {:>8} rps  '
+                  '{:>7} MB'.format(size, name, result['p50_ms'],
+                                    result['p99_ms'],
+                                    result['throughput_rps'],
+                                    result['peak_rss_kb'] // 1024))
+
+        seed_database(path, size)
+        for name in LOAD_TEST_SCENARIOS:
+            if name not in names:
+                continue
+            result = load_test(path, size, name, args.clients, args.duration)
+            report['sizes'][size]['load'][name] = result
+            print('{:>8} {:<22} p50 {:>9} ms  p99 {:>9} ms  {:>8} rps  '
+                  '(HTTP, {} clients)'.format(size, name, result['p50_ms'],
+                                              result['p99_ms'],
+                                              result['throughput_rps'],
+                                              args.clients))
+
+    report['uncovered_routes'] = uncovered_routes(path, args.sizes[-1])
+    if report['uncovered_routes']:
+        print('Routes without a scenario:', report['uncovered_routes'])
+
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print('Results written to', args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,273 @@
 import os
-from flask import Flask, request, abort, jsonify
+import functools
+import itertools
+import click
+from flask import Flask, request, abort, jsonify, make_response, \
+    stream_with_context, g, current_app, url_for
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
 
-from models import setup_db, Question, Category
+from models import setup_db, init_db, pool_stats, config_value, \
+    database_path, db, Question, QuestionStat, QUESTION_COLUMNS, \
+    format_question_row, question_total
+from .quiz import draw_quiz_questions, deal_quiz_deck, load_question_row, \
+    quiz_difficulty
+from .sessions import get_session_store
+from .store import get_question_store, write_snapshot
+from .rooms import get_room_registry, stream_events
+from .scoring import score_submissions
+from .jobs import get_job_queue, delete_category_questions, MAINTENANCE_JOBS
+from .search import get_search_index, search_selection, fetch_questions
+from .writes import get_write_coalescer, idempotent, rate_limited
+from .cache import get_category_cache, get_page_cache, ALL_QUESTIONS, \
+    category_listing
+from .bulk import read_rows, import_questions, export_questions
+from .metrics import init_metrics, serialize_timer
+from .compress import init_compression
+from .serialize import json_response, list_items, listing_head, \
+    listing_tail
 
 QUESTIONS_PER_PAGE = 10
 
+# Page size of streamed listings (?stream=true) when ?per_page= is not
+# given. It is capped at STREAM_MAX_PAGE_SIZE (default 1000)
+STREAM_PAGE_SIZE = 100
+
+# Rows fetched from the server-side cursor, encoded and written out at a
+# time
+STREAM_BATCH_SIZE = 500
+
+# The question fields listings can be slimmed down to with ?fields=
+QUESTION_FIELDS = {'answer', 'category', 'difficulty', 'id', 'question'}
+
+# Set on clients that just wrote, so their reads stay on the primary until
+# the replicas have caught up
+PRIMARY_COOKIE = 'trivia_primary'
+
+
+def read_only(view):
+    # Let the queries of the view go to a read replica, if any are set up
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = PRIMARY_COOKIE not in request.cookies
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def paginate_questions(request, selection):
+    # Fetch only the requested page of the selection from the database.
+    # Keyset pagination (?after_id=) is used when supplied, otherwise the
+    # page number is turned into an OFFSET
+    after_id = request.args.get('after_id', None, type=int)
+
+    if after_id is not None:
+        selection = selection.filter(Question.id > after_id)
+    else:
+        page = request.args.get('page', 1, type=int)
+
+        if page < 1:
+            return []
+
+        selection = selection.offset((page - 1) * QUESTIONS_PER_PAGE)
+
+    return selection.limit(QUESTIONS_PER_PAGE).all()
+
+
+def paginate_store(request, store, category_id=None):
+    # The same pages as paginate_questions, read from the question store
+    after_id = request.args.get('after_id', None, type=int)
+
+    if after_id is not None:
+        return store.page(category_id, after_id=after_id,
+                          limit=QUESTIONS_PER_PAGE)
 
-def paginate_questions(request, questions):
-    # Calculate the start and the end of the questions based on the page
     page = request.args.get('page', 1, type=int)
+
+    if page < 1:
+        return []
+
+    return store.page(category_id, (page - 1) * QUESTIONS_PER_PAGE,
+                      QUESTIONS_PER_PAGE)
+
+
+def paginate_ids(request, question_ids):
+    # Slice the requested page out of a list of already ranked ids
+    page = request.args.get('page', 1, type=int)
+
+    if page < 1:
+        return []
+
     start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
+    return question_ids[start:start + QUESTIONS_PER_PAGE]
+
+
+def streaming_requested(request):
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def stream_page(request, selection, fields=None, **extra):
+    # Stream a page of the selection as JSON, reading it through a
+    # server-side cursor so that memory stays flat whatever the page size.
+    # Pages are keyset pages (?after_id=, ?per_page=) and end with the
+    # cursor of the next one, null on the last page
+    per_page = request.args.get('per_page', STREAM_PAGE_SIZE, type=int)
+    after_id = request.args.get('after_id', 0, type=int)
+
+    if per_page < 1:
+        abort(400)
+
+    per_page = min(per_page, config_value(
+        current_app.config, 'STREAM_MAX_PAGE_SIZE', default=1000))
+    # One row more than the page tells whether there is a next page
+    rows = iter(selection.filter(Question.id > after_id).order_by(None)
+                .order_by(Question.id).limit(per_page + 1)
+                .yield_per(STREAM_BATCH_SIZE))
 
-    return questions[start:end]
+    def generate():
+        # Rows are encoded and written out a batch at a time
+        yield listing_head(extra)
+        batches = iter(lambda: list(itertools.islice(rows, STREAM_BATCH_SIZE)),
+                       [])
+        separator = b''
+        written = 0
+        last_id = next_id = None
 
+        for batch in batches:
+            if written + len(batch) > per_page:
+                # The row past the end of the page
+                batch.pop()
+                next_id = batch[-1][0] if batch else last_id
 
-def format_category(categories):
-    category_list = [category.format() for category in categories]
-    formatted_categories = {cat['id']: cat['type'] for cat in category_list}
+            if batch:
+                yield separator + list_items(format_questions(batch, fields))
+                separator = b','
+                written += len(batch)
+                last_id = batch[-1][0]
 
-    return formatted_categories
+        yield listing_tail(next_id)
+
+    return current_app.response_class(
+        stream_with_context(generate()),
+        mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+def job_accepted(job):
+    # 202 pointing at the status of a queued job
+    response = jsonify({'status': True, 'job': job.format()})
+    response.status_code = 202
+    response.headers['Location'] = url_for('get_job', job_id=job.id)
+
+    return response
+
+
+def cached_page(listing, render, fields=None, variant=''):
+    # Serve a page of a listing from the page cache. render() returns the
+    # encoded body, or None when there is no such page. Keyset pages
+    # (?after_id=) are not cached, and clients reading their own writes
+    # skip the cache, which replicas that lag behind may have filled
+    cache = get_page_cache()
+
+    if cache is None or 'after_id' in request.args or \
+            PRIMARY_COOKIE in request.cookies:
+        body = render()
+    else:
+        body = cache.get(listing, 'page={}&per_page={}&fields={}{}'.format(
+            request.args.get('page', 1, type=int), QUESTIONS_PER_PAGE,
+            ','.join(sorted(fields)) if fields is not None else '',
+            variant), render)
+
+    if body is None:
+        abort(404)
+
+    return current_app.response_class(
+        body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+def count_questions(selection):
+    # Let the database count the rows instead of loading them
+    return selection.order_by(None).count()
+
+
+def requested_fields(request, extra=()):
+    # The fields listed in ?fields=, None when all of them are wanted. The
+    # id is always kept, clients need it to page and delete
+    fields = request.args.get('fields')
+
+    if fields is None:
+        return None
+
+    fields = {field.strip() for field in fields.split(',') if field.strip()}
+    if not fields <= QUESTION_FIELDS.union(extra):
+        abort(400)
+
+    return fields | {'id'}
+
+
+def format_questions(rows, fields=None):
+    # Format question rows fetched with QUESTION_COLUMNS, keeping only the
+    # given fields
+    with serialize_timer():
+        if fields is None:
+            return [format_question_row(row) for row in rows]
+
+        return [{key: value for key, value in format_question_row(row).items()
+                 if key in fields} for row in rows]
+
+
+def conditional_response(response):
+    # Add a strong ETag and turn the response into a 304 when it matches
+    # the client's If-None-Match
+    response.add_etag()
+
+    return response.make_conditional(request)
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path))
+
+    # Opt-in latency and SQL query instrumentation served at /metrics
+    if config_value(app.config, 'METRICS_ENABLED', bool, False):
+        init_metrics(app)
+
+    # Negotiated gzip/brotli compression of the larger responses
+    init_compression(app)
+
+    # Map the question snapshot now, before the workers are forked, so
+    # that they share its pages. It does not touch the database
+    snapshot = config_value(app.config, 'QUESTION_STORE_SNAPSHOT', str)
+    if config_value(app.config, 'QUESTION_STORE', bool, False) and \
+            snapshot and os.path.exists(snapshot):
+        with app.app_context():
+            get_question_store()
 
     """
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
     """
     cors = CORS(app, resources={r"*": {"origins": "*"}})
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the database tables and indexes."""
+        init_db()
+        click.echo('Initialized the database.')
+
+    @app.cli.command('snapshot-questions')
+    @click.argument('path', required=False)
+    def snapshot_questions_command(path):
+        """Write the questions to a snapshot file for the question store."""
+        path = path or app.config.get('QUESTION_STORE_SNAPSHOT',
+                                      os.getenv('QUESTION_STORE_SNAPSHOT'))
+        if not path:
+            raise click.UsageError(
+                'Give a path or set QUESTION_STORE_SNAPSHOT')
+
+        count = write_snapshot(path)
+        click.echo('Wrote {} questions to {}.'.format(count, path))
     """
     @TODO: Use the after_request decorator to set Access-Control-Allow
     """
@@ -46,6 +280,23 @@ def create_app(test_config=None):
             "Access-Control-Allow-Methods", "GET,PUT,POST,DELETE,OPTIONS"
         )
 
+        # Read your own writes: keep a client that wrote on the primary, and
+        # off page caches that only this worker invalidated
+        if db.session.registry.has() and db.session().wrote:
+            windows = []
+            if 'db_replicas' in app.extensions:
+                windows.append(config_value(app.config, 'DB_REPLICA_LAG',
+                                            default=10))
+            page_cache = get_page_cache()
+            if page_cache is not None and page_cache.backend is None:
+                windows.append(page_cache.ttl)
+
+            if windows:
+                # Pages that never expire call for a session cookie
+                response.set_cookie(
+                    PRIMARY_COOKIE, '1', httponly=True,
+                    max_age=None if None in windows else max(windows))
+
         return response
 
     """
@@ -54,17 +305,24 @@ def create_app(test_config=None):
     for all available categories.
     """
     @app.route('/categories')
+    @read_only
     def get_categories():
         try:
-            categories = Category.query.all()
-            formatted_categories = format_category(categories)
-
-            return jsonify({
-                'categories': formatted_categories
-            })
+            categories, etag = get_category_cache().get()
         except:
             abort(404)
 
+        # Skip the payload when the client already holds these categories
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = jsonify({
+                'categories': categories
+            })
+
+        response.set_etag(etag)
+        return response
+
     """
     @TODO:
     Create an endpoint to handle GET requests for questions,
@@ -78,22 +336,43 @@ def create_app(test_config=None):
     Clicking on the page numbers should update the questions.
     """
     @app.route('/questions')
+    @read_only
     def get_questions():
-        questions = Question.query.all()
-        formatted_questions = [question.format() for question in questions]
-        paginated_questions = paginate_questions(request, formatted_questions)
+        fields = requested_fields(request, extra={'categories'})
 
-        if len(paginated_questions) == 0:
-            abort(404)
+        # Leave the categories out when they were not asked for, or when
+        # the client already holds them (the ETag of GET /categories)
+        categories, etag = get_category_cache().get()
+        include_categories = (fields is None or 'categories' in fields) and \
+            request.args.get('categories_etag') != etag
 
-        categories = Category.query.all()
-        formatted_categories = format_category(categories)
+        def render():
+            store = get_question_store()
+            if store is not None:
+                questions = paginate_store(request, store)
+                total_questions = store.count()
+            else:
+                selection = db.session.query(*QUESTION_COLUMNS).order_by(
+                    Question.id)
+                questions = paginate_questions(request, selection)
+                total_questions = db.session.execute(
+                    question_total()).scalar()
 
-        return jsonify({
-            'questions': paginated_questions,
-            'total_questions': len(formatted_questions),
-            'categories': formatted_categories,
-        })
+            if len(questions) == 0:
+                return None
+
+            response = {
+                'questions': format_questions(questions, fields),
+                'total_questions': total_questions,
+            }
+            if include_categories:
+                response['categories'] = categories
+
+            return json_response(response).get_data()
+
+        return conditional_response(cached_page(
+            ALL_QUESTIONS, render, fields,
+            '&categories={:d}'.format(include_categories)))
 
     """
     @TODO:
@@ -103,6 +382,7 @@ def create_app(test_config=None):
     This removal will persist in the database and when you refresh the page.
     """
     @app.route('/questions/<int:question_id>', methods=['DELETE'])
+    @rate_limited
     def delete_question(question_id):
         question = Question.query.get(question_id)
 
@@ -130,6 +410,8 @@ def create_app(test_config=None):
     of the questions list in the "List" tab.
     """
     @app.route('/questions', methods=['POST'])
+    @rate_limited
+    @idempotent
     def add_question():
         question = request.json['question']
         answer = request.json['answer']
@@ -143,6 +425,23 @@ def create_app(test_config=None):
                 'message': 'All fields are required'
             }), 400
 
+        try:
+            difficulty = int(difficulty)
+            category = int(category)
+        except (TypeError, ValueError):
+            abort(400)
+
+        if not 1 <= difficulty <= 5:
+            abort(400)
+
+        categories, _ = get_category_cache().get()
+
+        if category not in categories:
+            return jsonify({
+                'status': False,
+                'message': 'Unknown category selected'
+            }), 400
+
         new_question = Question(
             question=question,
             answer=answer,
@@ -150,26 +449,58 @@ def create_app(test_config=None):
             category=category
         )
 
-        new_question.insert()
+        # Concurrent posts are committed together
+        question_id = get_write_coalescer().insert(new_question)
 
         return jsonify({
             'status': True,
             'message': 'Question added successfully.',
+            'question_id': question_id
         }), 201
 
+    """
+    Bulk import and export of questions, streamed as JSON Lines
+    (one question per line) or CSV with a header row.
+    """
+    @app.route('/questions/bulk', methods=['POST'])
+    @rate_limited
+    def bulk_add_questions():
+        categories, _ = get_category_cache().get()
+
+        rows = read_rows(request.stream, request.content_type or '')
+        inserted, error_count, errors = import_questions(
+            rows, categories,
+            batch_size=app.config.get('BULK_BATCH_SIZE', 1000))
+
+        return jsonify({
+            'status': error_count == 0,
+            'inserted': inserted,
+            'error_count': error_count,
+            'errors': errors
+        }), 201 if inserted else 400
+
+    @app.route('/questions/export')
+    @read_only
+    def export_all_questions():
+        return app.response_class(stream_with_context(export_questions()),
+                                  mimetype='application/x-ndjson')
+
     """
     @TODO:
     Create a POST endpoint to get questions based on a search term.
     It should return any questions for whom the search term
     is a substring of the question.
+    Results are ranked and paginated (every 10 questions).
 
     TEST: Search by any phrase. The questions list will update to include
     only question that include that string within their question.
     Try using the word "title" to start.
     """
     @app.route('/questions/search', methods=['POST'])
+    @read_only
     def search_questions():
         try:
+            fields = requested_fields(request)
             search_term = request.json['searchTerm'].strip()
 
             if search_term is None or search_term == "":
@@ -178,15 +509,34 @@ def create_app(test_config=None):
                     'message': 'Please type something and try again',
                 }), 400
 
-            related_questions = Question.query.filter(
-                Question.question.ilike("%{}%".format(search_term.lower()))).all()
+            if streaming_requested(request):
+                # Every match, in id order instead of ranked
+                return stream_page(request, search_selection(
+                    search_term, ranked=False), fields)
 
-            formatted_questions = [question.format()
-                                   for question in related_questions]
+            store = get_question_store()
+            if store is not None:
+                # Scan the texts of the question store
+                question_ids = store.search(search_term)
+                page = paginate_ids(request, question_ids)
+                rows = store.rows(page)
+                questions = [rows[question_id] for question_id in page
+                             if question_id in rows]
+                total_questions = len(question_ids)
+            elif app.config.get('SEARCH_MODE', 'database') == 'index':
+                # Rank and page through the in-memory search index
+                question_ids = get_search_index().search(search_term)
+                questions = fetch_questions(
+                    paginate_ids(request, question_ids))
+                total_questions = len(question_ids)
+            else:
+                selection = search_selection(search_term)
+                questions = paginate_questions(request, selection)
+                total_questions = count_questions(selection)
 
-            return jsonify({
-                'questions': formatted_questions,
-                'total_questions': len(formatted_questions),
+            return json_response({
+                'questions': format_questions(questions, fields),
+                'total_questions': total_questions,
             })
         except:
             abort(400)
@@ -200,34 +550,138 @@ def create_app(test_config=None):
     category to be shown.
     """
     @app.route('/categories/<int:category_id>/questions')
+    @read_only
     def get_questions_by_category(category_id):
-        current_category = Category.query.get(category_id)
+        fields = requested_fields(request)
+        categories, _ = get_category_cache().get()
 
         # Handle when an invalid category is selected
-        if current_category == None:
+        if category_id not in categories:
+            return jsonify({
+                'status': False,
+                'message': 'Unknown category selected'
+            }), 400
+
+        if streaming_requested(request):
+            selection = db.session.query(*QUESTION_COLUMNS).filter(
+                Question.category == category_id)
+            return stream_page(
+                request, selection, fields,
+                current_category=categories[category_id],
+                total_questions=db.session.execute(
+                    question_total(category_id)).scalar())
+
+        def render():
+            store = get_question_store()
+            if store is not None:
+                questions = paginate_store(request, store, category_id)
+                total_questions = store.count(category_id)
+            else:
+                # Fetch the questions based on the category selected
+                selection = db.session.query(*QUESTION_COLUMNS).filter(
+                    Question.category == category_id).order_by(Question.id)
+                questions = paginate_questions(request, selection)
+                total_questions = db.session.execute(
+                    question_total(category_id)).scalar()
+
+            # Handle when the category selected has no questions
+            if len(questions) == 0:
+                return None
+
+            return json_response({
+                'questions': format_questions(questions, fields),
+                'total_questions': total_questions,
+                'current_category': categories[category_id]
+            }).get_data()
+
+        return cached_page(category_listing(category_id), render, fields)
+
+    """
+    Deletes every question of a category in the background, in batches,
+    and answers right away with the job to follow at GET /jobs/<job_id>.
+    """
+    @app.route('/categories/<int:category_id>/questions', methods=['DELETE'])
+    @rate_limited
+    def delete_questions_by_category(category_id):
+        categories, _ = get_category_cache().get()
+
+        if category_id not in categories:
             return jsonify({
                 'status': False,
                 'message': 'Unknown category selected'
             }), 400
 
-        # Format the current category
-        current_category = current_category.format()
+        return job_accepted(get_job_queue().submit(
+            'delete_category_questions', delete_category_questions,
+            category_id))
+
+    """
+    Background jobs: maintenance started on demand, and the status of any
+    job of this worker.
+    """
+    @app.route('/jobs', methods=['POST'])
+    def create_job():
+        body = request.get_json(silent=True) or {}
+        kind = body.get('kind')
+
+        if not isinstance(kind, str) or kind not in MAINTENANCE_JOBS:
+            abort(400)
+
+        return job_accepted(
+            get_job_queue().submit(kind, MAINTENANCE_JOBS[kind]))
 
-        # Fetch the questions based on the category selected
-        questions = Question.query.filter_by(
-            category=category_id).all()
-        formatted_questions = [question.format() for question in questions]
-        paginated_questions = paginate_questions(request, formatted_questions)
+    @app.route('/jobs/<job_id>')
+    def get_job(job_id):
+        job = get_job_queue().get(job_id)
 
-        # Handle when the category selected has no questions
-        if len(paginated_questions) == 0:
+        if job is None:
             abort(404)
 
-        return jsonify({
-            'questions': paginated_questions,
-            'total_questions': len(formatted_questions),
-            'current_category': current_category['type']
-        })
+        return jsonify(job.format())
+
+    """
+    Question counts per category and difficulty, read from the maintained
+    question_stats table.
+    """
+    @app.route('/categories/stats')
+    @read_only
+    def get_category_stats():
+        categories, _ = get_category_cache().get()
+        stats = {category_id: {'type': category_type, 'total_questions': 0,
+                               'difficulties': {}}
+                 for category_id, category_type in categories.items()}
+        difficulties = {}
+        total_questions = 0
+
+        for stat in QuestionStat.query.filter(QuestionStat.count > 0):
+            total_questions += stat.count
+            difficulties[stat.difficulty] = \
+                difficulties.get(stat.difficulty, 0) + stat.count
+
+            # Questions without a category only count towards the totals
+            if stat.category in stats:
+                category = stats[stat.category]
+                category['total_questions'] += stat.count
+                category['difficulties'][stat.difficulty] = stat.count
+
+        return conditional_response(json_response({
+            'categories': stats,
+            'difficulties': difficulties,
+            'total_questions': total_questions,
+        }))
+
+    """
+    Hit and miss counts of the question page cache, to tune its size
+    (PAGE_CACHE_MAX_BYTES) and time to live (PAGE_CACHE_TTL).
+    """
+    @app.route('/stats/cache')
+    def get_cache_stats():
+        cache = get_page_cache()
+
+        if cache is None:
+            return jsonify({'enabled': False})
+
+        return jsonify(dict(cache.stats(), enabled=True))
 
     """
     @TODO:
@@ -241,6 +695,7 @@ def create_app(test_config=None):
     and shown whether they were correct or not.
     """
     @app.route('/quizzes', methods=['POST'])
+    @read_only
     def get_quiz_question():
         body = request.get_json()
 
@@ -251,34 +706,270 @@ def create_app(test_config=None):
             if previous_questions is None:
                 abort(404)
 
-            # Fetch all the questions if category is not specified
+            # Draw from all the questions if category is not specified
             if quiz_category == None or quiz_category['id'] == 0:
-                questions = Question.query.all()
+                category_id = None
             else:
-                # Fetch questions based on category
-                questions = Question.query.filter_by(
-                    category=quiz_category['id']).all()
+                category_id = int(quiz_category['id'])
+
+            # Adaptive quizzes aim at a difficulty set by the player's
+            # recent answers
+            difficulty = None
+            if body.get('adaptive', False):
+                recent_results = body.get('recent_results', [])
+                if not all(isinstance(result, bool)
+                           for result in recent_results):
+                    abort(400)
+                difficulty = quiz_difficulty(previous_questions,
+                                             recent_results)
 
-            # Filter out the previous_questions
-            available_questions = filter(
-                lambda q: q.id not in previous_questions, questions)
-            available_questions = list(available_questions)
+            # Choose random questions that are not among the previous_questions:
+            # one, or up to `count` for clients prefetching the next rounds
+            count = body.get('count', None)
+            if count is not None and not 1 <= int(count) <= config_value(
+                    app.config, 'QUIZ_MAX_COUNT', default=50):
+                abort(400)
 
-            if len(available_questions) == 0:
+            random_questions = draw_quiz_questions(
+                category_id, previous_questions, int(count or 1), difficulty)
+
+            if len(random_questions) == 0:
                 return jsonify({
                     'status': False,
                     'message': 'No questions available'
                 })
 
-            # Choose a random question from the available questions
-            random_question = random.choice(available_questions)
+            if count is None:
+                response = {
+                    'question': format_question_row(random_questions[0])}
+            else:
+                response = {'questions': format_questions(random_questions)}
+            if difficulty is not None:
+                response['target_difficulty'] = difficulty
+
+            return json_response(response)
+        except:
+            abort(400)
+
+    """
+    Scores quiz scorecards on the server, many at once, against the stored
+    answers. Answers are compared once normalized, and a few typos are
+    allowed (ANSWER_FUZZINESS).
+    """
+    @app.route('/quizzes/answers', methods=['POST'])
+    @read_only
+    def score_quiz_answers():
+        body = request.get_json(silent=True) or {}
+        submissions = body.get('submissions')
+
+        if not isinstance(submissions, list) or len(submissions) == 0:
+            abort(400)
+
+        try:
+            scorecards = [[(answer['question_id'], answer['answer'])
+                           for answer in submission['answers']]
+                          for submission in submissions]
+        except (KeyError, TypeError):
+            abort(400)
+
+        if not all(type(question_id) is int and answer is not None
+                   for scorecard in scorecards
+                   for question_id, answer in scorecard):
+            abort(400)
+
+        if sum(map(len, scorecards)) > config_value(
+                app.config, 'ANSWERS_MAX_BATCH', default=100000):
+            return jsonify({
+                'status': False,
+                'message': 'Too many answers in one batch'
+            }), 400
+
+        scored = []
+        for submission, results in zip(submissions,
+                                       score_submissions(scorecards)):
+            scorecard = {
+                'results': results,
+                'score': results.count(True),
+                # Questions that no longer exist are not counted
+                'total': len(results) - results.count(None),
+            }
+            if 'id' in submission:
+                scorecard['id'] = submission['id']
+            scored.append(scorecard)
+
+        return json_response({'submissions': scored})
+
+    """
+    Quiz sessions keep the shuffled deck of a quiz on the server, so the
+    client does not have to send the previous questions on every round.
+    """
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        body = request.get_json(silent=True) or {}
+        max_questions = app.config.get('QUIZ_SESSION_MAX_QUESTIONS', 1000)
+
+        try:
+            quiz_category = body.get('quiz_category', None)
+            size = int(body.get('size', max_questions))
+
+            if quiz_category == None or quiz_category['id'] == 0:
+                category_id = None
+            else:
+                category_id = int(quiz_category['id'])
+        except:
+            abort(400)
+
+        if size < 1:
+            abort(400)
+
+        deck = deal_quiz_deck(category_id, min(size, max_questions))
 
+        if len(deck) == 0:
             return jsonify({
-                'question': random_question.format()
+                'status': False,
+                'message': 'No questions available'
             })
+
+        session_id = get_session_store().create(deck)
+
+        return jsonify({
+            'status': True,
+            'session_id': session_id,
+            'total_questions': len(deck)
+        }), 201
+
+    @app.route('/quizzes/sessions/<session_id>/next', methods=['POST'])
+    def draw_session_question(session_id):
+        store = get_session_store()
+
+        try:
+            while True:
+                question_id = store.draw(session_id)
+
+                if question_id is None:
+                    return jsonify({
+                        'status': False,
+                        'message': 'No questions available'
+                    })
+
+                # Skip questions deleted since the deck was dealt
+                question = load_question_row(question_id)
+                if question is not None:
+                    break
+
+            remaining = store.remaining(session_id)
+        except KeyError:
+            abort(404)
+
+        return json_response({
+            'question': format_question_row(question),
+            'remaining_questions': remaining
+        })
+
+    """
+    Quiz rooms: one question per round for every player of the room,
+    pushed to them over Server-Sent Events.
+    """
+    @app.route('/quizzes/rooms', methods=['POST'])
+    def create_quiz_room():
+        body = request.get_json(silent=True) or {}
+
+        try:
+            quiz_category = body.get('quiz_category', None)
+            rounds = int(body.get('rounds', 5))
+
+            if quiz_category == None or quiz_category['id'] == 0:
+                category_id = None
+            else:
+                category_id = int(quiz_category['id'])
         except:
             abort(400)
 
+        if not 1 <= rounds <= config_value(app.config, 'QUIZ_MAX_COUNT',
+                                           default=50):
+            abort(400)
+
+        room_id = get_room_registry().create(category_id, rounds)
+
+        return jsonify({
+            'status': True,
+            'room_id': room_id,
+            'rounds': rounds
+        }), 201
+
+    @app.route('/quizzes/rooms/<room_id>')
+    def get_quiz_room(room_id):
+        try:
+            room = get_room_registry().get(room_id)
+        except KeyError:
+            abort(404)
+
+        return jsonify(room.state())
+
+    @app.route('/quizzes/rooms/<room_id>/events')
+    def quiz_room_events(room_id):
+        try:
+            room = get_room_registry().get(room_id)
+        except KeyError:
+            abort(404)
+
+        events = stream_events(
+            room, room.subscribe(),
+            keepalive=config_value(app.config, 'QUIZ_ROOM_KEEPALIVE',
+                                   float, 15))
+
+        return app.response_class(events, mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache',
+                                           'X-Accel-Buffering': 'no'})
+
+    @app.route('/quizzes/rooms/<room_id>/next', methods=['POST'])
+    @read_only
+    def next_quiz_room_round(room_id):
+        try:
+            room = get_room_registry().get(room_id)
+        except KeyError:
+            abort(404)
+
+        question = room.next_round()
+
+        if question is None:
+            return jsonify(dict(room.state(), status=False,
+                                message='The quiz is over'))
+
+        return json_response({
+            'status': True,
+            'round': room.round,
+            'question': question
+        })
+
+    @app.route('/quizzes/rooms/<room_id>/answers', methods=['POST'])
+    def answer_quiz_room(room_id):
+        body = request.get_json(silent=True) or {}
+        player = body.get('player')
+
+        if not isinstance(player, str) or not player or \
+                'answer' not in body or \
+                not isinstance(body.get('round'), int):
+            abort(400)
+
+        try:
+            room = get_room_registry().get(room_id)
+        except KeyError:
+            abort(404)
+
+        # Scored when the round is closed
+        if not room.answer(player, body['round'], body['answer']):
+            return jsonify({
+                'status': False,
+                'message': 'The round is over or was already answered'
+            }), 409
+
+        return jsonify({'status': True}), 202
+
+    @app.route('/stats/pool')
+    def get_pool_stats():
+        return jsonify(pool_stats())
+
     """
     @TODO:
     Create error handlers for all expected errors
@@ -316,6 +1007,17 @@ def create_app(test_config=None):
             'message': 'Unprocessable entity'
         }), 422
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        response = jsonify({
+            'status': False,
+            'error': 429,
+            'message': 'Too many requests'
+        })
+        if getattr(error, 'retry_after', None) is not None:
+            response.headers['Retry-After'] = str(error.retry_after)
+        return response, 429
+
     @app.errorhandler(500)
     def server_error(_error):
         return jsonify({
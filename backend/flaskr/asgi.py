@@ -0,0 +1,472 @@
+"""
+Async (ASGI) serving mode for the read-heavy routes:
+
+    GET  /categories
+    GET  /questions
+    GET  /categories/<id>/questions
+    POST /questions/search
+    POST /quizzes
+
+The routes answer exactly like the Flask app, but the handlers are
+coroutines using SQLAlchemy's asyncio engine, so a worker is not pinned
+while it waits on the database. It shares the tables in models.py and
+needs an async driver: asyncpg for Postgres, aiosqlite for SQLite.
+Run it with any ASGI server, for example:
+
+    uvicorn flaskr.asgi:create_asgi_app --factory --workers 4
+
+Writes still go through the Flask app.
+"""
+import json
+import re
+import time
+from urllib.parse import parse_qs
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from models import Question, Category, QUESTION_COLUMNS, format_question_row, \
+    question_total, config_value, database_path
+from . import QUESTIONS_PER_PAGE, STREAM_PAGE_SIZE, STREAM_BATCH_SIZE
+from .quiz import QuestionIndex, target_difficulty
+from .serialize import encode_json, list_items, listing_head, \
+    listing_tail
+
+ASYNC_DRIVERS = {
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+ERROR_MESSAGES = {
+    400: 'Bad request',
+    404: 'Not found',
+    405: 'Method not allowed',
+    422: 'Unprocessable entity',
+    500: 'Server error',
+}
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type, Authorization'),
+    (b'access-control-allow-methods', b'GET,PUT,POST,DELETE,OPTIONS'),
+]
+
+
+def async_database_url(url):
+    # postgresql://... -> postgresql+asyncpg://...
+    scheme, rest = url.split('://', 1)
+    scheme = ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)
+
+    return scheme + '://' + rest
+
+
+def async_engine_options(config, url):
+    if url.startswith('sqlite'):
+        return {}
+
+    options = {
+        'pool_size': config_value(config, 'DB_POOL_SIZE', default=5),
+        'max_overflow': config_value(config, 'DB_MAX_OVERFLOW', default=10),
+        'pool_timeout': config_value(config, 'DB_POOL_TIMEOUT', default=30),
+        'pool_recycle': config_value(config, 'DB_POOL_RECYCLE', default=-1),
+        'pool_pre_ping': config_value(config, 'DB_POOL_PRE_PING', bool, True),
+    }
+
+    statement_timeout = config_value(config, 'DB_STATEMENT_TIMEOUT')
+    if statement_timeout:
+        options['connect_args'] = {
+            'server_settings': {'statement_timeout': str(statement_timeout)}
+        }
+
+    return options
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(status)
+        self.status = status
+        self.payload = {
+            'status': False,
+            'error': status,
+            'message': ERROR_MESSAGES[status],
+        }
+        if message is not None:
+            self.payload = {'status': False, 'message': message}
+
+
+class Stream:
+    """A response body sent in chunks, from an async iterator of bytes"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        self.body = body
+
+    def arg(self, name, default=None, type=int):
+        # Like request.args.get(name, default, type=...) in Flask
+        try:
+            return type(self.args[name][0])
+        except (KeyError, ValueError):
+            return default
+
+    def streaming(self):
+        return self.args.get('stream', [''])[0].lower() in \
+            ('1', 'true', 'yes')
+
+    def get_json(self):
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            raise HTTPError(400)
+
+
+class AsyncTriviaApp:
+    def __init__(self, database_url=database_path, **config):
+        self.config = config
+        self.engine = create_async_engine(
+            async_database_url(database_url),
+            **async_engine_options(config, database_url))
+
+        # The index is reloaded here, not by QuestionIndex itself, because
+        # its own loader uses the Flask-SQLAlchemy session
+        self.question_index = QuestionIndex(ttl=None)
+        self.index_ttl = config.get('QUIZ_INDEX_TTL', 300)
+        self.index_loaded_at = None
+        self.categories = None
+        self.categories_loaded_at = None
+        self.categories_ttl = config.get('CATEGORIES_CACHE_TTL', 300)
+        self.similarity = None
+
+        self.routes = [
+            ('GET', re.compile(r'^/categories$'), self.get_categories),
+            ('GET', re.compile(r'^/questions$'), self.get_questions),
+            ('GET', re.compile(r'^/categories/(\d+)/questions$'),
+             self.get_questions_by_category),
+            ('POST', re.compile(r'^/questions/search$'),
+             self.search_questions),
+            ('POST', re.compile(r'^/quizzes$'), self.get_quiz_question),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        request = Request(scope, body)
+
+        try:
+            payload, status = await self.dispatch(request), 200
+        except HTTPError as error:
+            payload, status = error.payload, error.status
+        except Exception:
+            payload, status = HTTPError(500).payload, 500
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json')] +
+            CORS_HEADERS,
+        })
+
+        if isinstance(payload, Stream):
+            async for chunk in payload.chunks:
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        await send({'type': 'http.response.body', 'body': encode_json(payload)})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, request):
+        allowed = False
+
+        for method, pattern, handler in self.routes:
+            match = pattern.match(request.path)
+            if match is None:
+                continue
+            if method != request.method:
+                allowed = True
+                continue
+            return await handler(request, *match.groups())
+
+        raise HTTPError(405 if allowed else 404)
+
+    async def paginate(self, connection, selection, request):
+        after_id = request.arg('after_id')
+
+        if after_id is not None:
+            selection = selection.where(Question.id > after_id)
+        else:
+            page = request.arg('page', 1)
+            if page < 1:
+                return []
+            selection = selection.offset((page - 1) * QUESTIONS_PER_PAGE)
+
+        result = await connection.execute(selection.limit(QUESTIONS_PER_PAGE))
+        return result.all()
+
+    def stream_page(self, request, selection, **extra):
+        # Like stream_page in the Flask app, through a server-side cursor
+        # of its own connection
+        per_page = request.arg('per_page', STREAM_PAGE_SIZE)
+        if per_page < 1:
+            raise HTTPError(400)
+
+        per_page = min(per_page, config_value(
+            self.config, 'STREAM_MAX_PAGE_SIZE', default=1000))
+        selection = selection.where(Question.id > request.arg('after_id', 0)) \
+            .order_by(None).order_by(Question.id).limit(per_page + 1)
+
+        async def generate():
+            yield listing_head(extra)
+            separator = b''
+            written = 0
+            last_id = next_id = None
+
+            async with self.engine.connect() as connection:
+                result = await connection.stream(selection)
+                async for batch in result.partitions(STREAM_BATCH_SIZE):
+                    if written + len(batch) > per_page:
+                        batch.pop()
+                        next_id = batch[-1][0] if batch else last_id
+
+                    if batch:
+                        yield separator + list_items(
+                            [format_question_row(row) for row in batch])
+                        separator = b','
+                        written += len(batch)
+                        last_id = batch[-1][0]
+
+            yield listing_tail(next_id)
+
+        return Stream(generate())
+
+    async def scalar(self, connection, selection):
+        result = await connection.execute(selection)
+        return result.scalar()
+
+    async def count(self, connection, selection):
+        subquery = selection.order_by(None).subquery()
+        return await self.scalar(
+            connection, select(func.count()).select_from(subquery))
+
+    async def load_categories(self, connection):
+        expired = self.categories_ttl is not None and \
+            self.categories_loaded_at is not None and \
+            time.monotonic() - self.categories_loaded_at > self.categories_ttl
+
+        if self.categories is None or expired:
+            result = await connection.execute(select(Category.id, Category.type))
+            self.categories = dict(result.all())
+            self.categories_loaded_at = time.monotonic()
+
+        return self.categories
+
+    async def get_categories(self, request):
+        async with self.engine.connect() as connection:
+            categories = await self.load_categories(connection)
+
+        return {'categories': categories}
+
+    async def get_questions(self, request):
+        selection = select(*QUESTION_COLUMNS).order_by(Question.id)
+
+        async with self.engine.connect() as connection:
+            rows = await self.paginate(connection, selection, request)
+            if len(rows) == 0:
+                raise HTTPError(404)
+
+            total_questions = await self.scalar(connection, question_total())
+            categories = await self.load_categories(connection)
+
+        return {
+            'questions': [format_question_row(row) for row in rows],
+            'total_questions': total_questions,
+            'categories': categories,
+        }
+
+    async def get_questions_by_category(self, request, category_id):
+        category_id = int(category_id)
+        selection = select(*QUESTION_COLUMNS).where(
+            Question.category == category_id).order_by(Question.id)
+
+        async with self.engine.connect() as connection:
+            categories = await self.load_categories(connection)
+            if category_id not in categories:
+                raise HTTPError(400, 'Unknown category selected')
+
+            if request.streaming():
+                return self.stream_page(
+                    request, selection,
+                    current_category=categories[category_id],
+                    total_questions=await self.scalar(
+                        connection, question_total(category_id)))
+
+            rows = await self.paginate(connection, selection, request)
+            if len(rows) == 0:
+                raise HTTPError(404)
+
+            total_questions = await self.scalar(
+                connection, question_total(category_id))
+
+        return {
+            'questions': [format_question_row(row) for row in rows],
+            'total_questions': total_questions,
+            'current_category': categories[category_id],
+        }
+
+    async def similarity_available(self, connection):
+        if self.similarity is None:
+            self.similarity = self.engine.dialect.name == 'postgresql' and \
+                (await connection.execute(text(
+                    "SELECT count(*) FROM pg_extension "
+                    "WHERE extname = 'pg_trgm'"))).scalar() > 0
+
+        return self.similarity
+
+    async def search_questions(self, request):
+        body = request.get_json()
+
+        try:
+            search_term = body['searchTerm'].strip()
+        except (KeyError, TypeError, AttributeError):
+            raise HTTPError(400)
+
+        if search_term == '':
+            raise HTTPError(400, 'Please type something and try again')
+
+        selection = select(*QUESTION_COLUMNS).where(
+            Question.question.ilike('%{}%'.format(search_term.lower())))
+
+        if request.streaming():
+            return self.stream_page(request, selection)
+
+        async with self.engine.connect() as connection:
+            if await self.similarity_available(connection):
+                similarity = func.similarity(Question.question, search_term)
+                selection = selection.order_by(similarity.desc(), Question.id)
+            else:
+                selection = selection.order_by(Question.id)
+
+            rows = await self.paginate(connection, selection, request)
+            total_questions = await self.count(connection, selection)
+
+        return {
+            'questions': [format_question_row(row) for row in rows],
+            'total_questions': total_questions,
+        }
+
+    async def refresh_question_index(self, connection):
+        if self.index_loaded_at is not None and (
+                self.index_ttl is None or
+                time.monotonic() - self.index_loaded_at <= self.index_ttl):
+            return
+
+        result = await connection.execute(
+            select(Question.id, Question.category, Question.difficulty))
+        self.question_index.load_rows(result.all())
+        self.index_loaded_at = time.monotonic()
+
+    async def get_quiz_question(self, request):
+        body = request.get_json()
+
+        try:
+            previous_questions = body.get('previous_questions', None)
+            quiz_category = body.get('quiz_category', None)
+
+            if previous_questions is None:
+                raise HTTPError(400)
+
+            if quiz_category == None or quiz_category['id'] == 0:
+                category_id = None
+            else:
+                category_id = int(quiz_category['id'])
+
+            exclude = set(previous_questions)
+
+            adaptive = body.get('adaptive', False)
+            recent_results = body.get('recent_results', [])
+            if adaptive and (
+                    len(recent_results) > len(previous_questions) or
+                    not all(isinstance(result, bool)
+                            for result in recent_results)):
+                raise HTTPError(400)
+
+            count = body.get('count', None)
+            if count is not None and not 1 <= int(count) <= self.config.get(
+                    'QUIZ_MAX_COUNT', 50):
+                raise HTTPError(400)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            raise HTTPError(400)
+
+        async with self.engine.connect() as connection:
+            await self.refresh_question_index(connection)
+
+            difficulty = None
+            if adaptive:
+                recent = previous_questions[
+                    len(previous_questions) - len(recent_results):]
+                difficulty = target_difficulty(
+                    [self.question_index.difficulty(question_id)
+                     for question_id in recent], recent_results)
+
+            questions = []
+            while len(questions) < int(count or 1):
+                question_ids = self.question_index.pick_many(
+                    category_id, exclude, int(count or 1) - len(questions),
+                    difficulty)
+                if not question_ids:
+                    break
+
+                result = await connection.execute(
+                    select(*QUESTION_COLUMNS).where(
+                        Question.id.in_(question_ids)))
+                rows = {row.id: row for row in result}
+                for question_id in question_ids:
+                    exclude.add(question_id)
+                    if question_id in rows:
+                        questions.append(format_question_row(rows[question_id]))
+                    else:
+                        # The question was deleted since the index loaded
+                        self.question_index.remove(question_id)
+
+        if len(questions) == 0:
+            return {
+                'status': False,
+                'message': 'No questions available'
+            }
+
+        if count is None:
+            response = {'question': questions[0]}
+        else:
+            response = {'questions': questions}
+        if difficulty is not None:
+            response['target_difficulty'] = difficulty
+
+        return response
+
+
+def create_asgi_app(database_url=None, **config):
+    return AsyncTriviaApp(database_url or database_path, **config)
@@ -0,0 +1,168 @@
+import csv
+import io
+import json
+from collections import Counter
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, Question, QUESTION_COLUMNS, format_question_row, \
+    notify_question_change, adjust_question_stats, question_stats_key
+
+QUESTION_FIELDS = ('question', 'answer', 'difficulty', 'category')
+
+
+def decode_lines(stream, invalid):
+    """
+    Yields the lines of a UTF-8 body one at a time, so that a line that is
+    not valid UTF-8 only spoils its own row. Their numbers are added to
+    invalid, and they are yielded with the bad bytes replaced.
+    """
+    for line_number, line in enumerate(stream, start=1):
+        try:
+            yield line.decode('utf-8')
+        except UnicodeDecodeError:
+            invalid.add(line_number)
+            yield line.decode('utf-8', 'replace')
+
+
+def read_rows(stream, content_type):
+    """
+    Yields (line number, row) for every record of a JSON Lines or CSV
+    request body, reading it incrementally. Rows that cannot be decoded or
+    parsed are yielded as (line number, None).
+    """
+    invalid = set()
+    lines = decode_lines(stream, invalid)
+
+    if content_type.startswith('text/csv'):
+        reader = csv.DictReader(lines)
+        last_line = 0
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error:
+                # The reader does not count the lines of the rows it rejects
+                last_line = max(last_line, reader.line_num) + 1
+                yield last_line, None
+                continue
+
+            # A quoted field can span several lines
+            first_line, last_line = last_line + 1, reader.line_num
+            if not invalid.isdisjoint(range(first_line, last_line + 1)):
+                row = None
+            yield last_line, row
+
+    for line_number, line in enumerate(lines, start=1):
+        if line_number in invalid:
+            yield line_number, None
+            continue
+
+        if line.strip() == '':
+            continue
+
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def validate_row(row, categories):
+    """Returns the question to insert and an error message, one being None"""
+    if row is None:
+        return None, 'Invalid row'
+
+    missing = [field for field in QUESTION_FIELDS
+               if row.get(field) is None or str(row[field]).strip() == '']
+    if missing:
+        return None, 'Missing fields: {}'.format(', '.join(missing))
+
+    try:
+        difficulty = int(row['difficulty'])
+        category = int(row['category'])
+    except (TypeError, ValueError):
+        return None, 'Difficulty and category must be numbers'
+
+    if difficulty < 1 or difficulty > 5:
+        return None, 'Difficulty must be between 1 and 5'
+
+    if category not in categories:
+        return None, 'Unknown category'
+
+    return {
+        'question': str(row['question']).strip(),
+        'answer': str(row['answer']).strip(),
+        'difficulty': difficulty,
+        'category': category,
+    }, None
+
+
+def import_questions(rows, categories, batch_size=1000, max_errors=100):
+    """
+    Validates rows and inserts them in batched transactions. Returns the
+    number of inserted questions, the number of rejected rows and the first
+    max_errors errors as {'line': ..., 'message': ...}
+    """
+    inserted = 0
+    error_count = 0
+    errors = []
+    batch = []
+
+    def report(line_number, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < max_errors:
+            errors.append({'line': line_number, 'message': message})
+
+    def flush():
+        nonlocal inserted
+        try:
+            db.session.execute(Question.__table__.insert(),
+                               [question for _, question in batch])
+            adjust_question_stats(Counter(
+                question_stats_key(question['category'],
+                                   question['difficulty'])
+                for _, question in batch))
+            db.session.commit()
+            inserted += len(batch)
+        except SQLAlchemyError:
+            db.session.rollback()
+            for line_number, _ in batch:
+                report(line_number, 'Could not insert row')
+        batch.clear()
+
+    try:
+        for line_number, row in rows:
+            question, error = validate_row(row, categories)
+
+            if error is not None:
+                report(line_number, error)
+                continue
+
+            batch.append((line_number, question))
+            if len(batch) >= batch_size:
+                flush()
+
+        if batch:
+            flush()
+    finally:
+        if inserted:
+            # Indexes built on top of the questions reload on next use,
+            # even when the import stopped half way
+            notify_question_change('reload')
+
+    return inserted, error_count, errors
+
+
+def export_questions(batch_size=1000):
+    """
+    Yields every question as a JSON line, reading the table through a
+    server-side cursor so memory stays flat
+    """
+    rows = db.session.query(*QUESTION_COLUMNS).order_by(Question.id) \
+        .yield_per(batch_size)
+
+    for row in rows:
+        yield json.dumps(format_question_row(row)) + '\n'
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, has_app_context
+
+from models import Category, config_value, on_category_change, \
+    on_question_change
+
+
+class CategoryCache:
+    """
+    Process-level cache of the formatted categories. The version counter
+    goes up every time the cache is invalidated, and the ETag is derived
+    from the content so every worker hands out the same one.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.version = 0
+        self.loaded_at = None
+        self.categories = None
+        self.etag = None
+
+    def get(self):
+        """Returns the categories as {id: type} and their ETag"""
+        with self.lock:
+            if not self.is_stale():
+                return self.categories, self.etag
+
+        categories = {category.id: category.type
+                      for category in Category.query.all()}
+        content = json.dumps(sorted(categories.items())).encode('utf-8')
+        etag = 'categories-' + hashlib.sha1(content).hexdigest()[:20]
+
+        with self.lock:
+            if etag != self.etag:
+                self.version += 1
+            self.categories = categories
+            self.etag = etag
+            self.loaded_at = time.monotonic()
+
+        return categories, etag
+
+    def is_stale(self):
+        if self.loaded_at is None:
+            return True
+
+        return self.ttl is not None and \
+            time.monotonic() - self.loaded_at > self.ttl
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.loaded_at = None
+
+
+def get_category_cache():
+    cache = current_app.extensions.get('category_cache')
+
+    if cache is None:
+        cache = CategoryCache(
+            ttl=current_app.config.get('CATEGORIES_CACHE_TTL', 300))
+        current_app.extensions['category_cache'] = cache
+
+    return cache
+
+
+@on_category_change
+def invalidate_category_cache(action, category):
+    if not has_app_context():
+        return
+
+    cache = current_app.extensions.get('category_cache')
+    if cache is not None:
+        cache.invalidate()
+
+
+# Listing names of the page cache
+ALL_QUESTIONS = 'questions'
+ALL_LISTINGS = '*'
+
+
+def category_listing(category_id):
+    return 'category:{}'.format(category_id)
+
+
+class PageCache:
+    """
+    Cache of rendered listing pages with two tiers: an in-process LRU
+    bounded to max_bytes of payload, and an optional shared tier on a
+    Redis-like client (get, set with ex, incr) used by every worker.
+    Each listing has a generation number that is part of its keys.
+    Invalidating a listing bumps it, so its old pages are never read again
+    and age out of both tiers.
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024, ttl=60, backend=None,
+                 prefix='page-cache:'):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.backend = backend
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generations = {}
+        self.counts = {'local_hits': 0, 'shared_hits': 0, 'misses': 0,
+                       'evictions': 0, 'invalidations': 0}
+
+    def generation(self, listing):
+        if self.backend is not None:
+            return int(self.backend.get(
+                self.prefix + 'generation:' + listing) or 0)
+
+        with self.lock:
+            return self.generations.get(listing, 0)
+
+    def key(self, listing, variant):
+        return '{}{}:{}.{}:{}'.format(
+            self.prefix, listing, self.generation(ALL_LISTINGS),
+            self.generation(listing), variant)
+
+    def get(self, listing, variant, render):
+        """
+        Returns the cached body of a page of the listing. On a miss the
+        page is rendered with render() and stored, unless it returns None
+        """
+        key = self.key(listing, variant)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (self.ttl is None or
+                                      time.monotonic() - entry[1] <= self.ttl):
+                self.entries.move_to_end(key)
+                self.counts['local_hits'] += 1
+                return entry[0]
+
+        if self.backend is not None:
+            body = self.backend.get(key)
+            if body is not None:
+                self.store(key, body)
+                with self.lock:
+                    self.counts['shared_hits'] += 1
+                return body
+
+        body = render()
+        with self.lock:
+            self.counts['misses'] += 1
+
+        if body is not None:
+            self.store(key, body)
+            if self.backend is not None:
+                self.backend.set(key, body, ex=self.ttl)
+
+        return body
+
+    def store(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+
+            self.entries[key] = (body, time.monotonic())
+            self.size += len(body)
+
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.counts['evictions'] += 1
+
+    def invalidate(self, listing):
+        if self.backend is not None:
+            self.backend.incr(self.prefix + 'generation:' + listing)
+
+        with self.lock:
+            self.generations[listing] = self.generations.get(listing, 0) + 1
+            self.counts['invalidations'] += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counts['local_hits'] + \
+                self.counts['shared_hits'] + self.counts['misses']
+            hits = lookups - self.counts['misses']
+
+            return dict(self.counts, **{
+                'hit_rate': round(hits / lookups, 4) if lookups else None,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'shared': self.backend is not None,
+            })
+
+
+def get_page_cache():
+    """Returns the page cache of the app, None when it is turned off"""
+    if 'page_cache' not in current_app.extensions:
+        config = current_app.config
+        max_bytes = config_value(config, 'PAGE_CACHE_MAX_BYTES',
+                                 default=8 * 1024 * 1024)
+        current_app.extensions['page_cache'] = PageCache(
+            max_bytes=max_bytes,
+            ttl=config_value(config, 'PAGE_CACHE_TTL', default=60),
+            backend=config.get('PAGE_CACHE_BACKEND')
+        ) if max_bytes else None
+
+    return current_app.extensions['page_cache']
+
+
+def invalidate_pages(listings):
+    if not has_app_context():
+        return
+
+    cache = current_app.extensions.get('page_cache')
+    if cache is not None:
+        for listing in listings:
+            cache.invalidate(listing)
+
+
+@on_question_change
+def invalidate_question_pages(action, question):
+    # An insert or delete changes the pages and totals of the question
+    # listing and of its category listing only
+    if action in ('insert', 'delete'):
+        listings = [ALL_QUESTIONS]
+        if question.category is not None:
+            listings.append(category_listing(int(question.category)))
+        invalidate_pages(listings)
+    else:
+        invalidate_pages([ALL_LISTINGS])
+
+
+@on_category_change
+def invalidate_category_pages(action, category):
+    # The question listing carries the categories map
+    invalidate_pages([ALL_QUESTIONS, category_listing(category.id)])
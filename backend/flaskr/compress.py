@@ -0,0 +1,79 @@
+import gzip
+from flask import request
+
+from models import config_value
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson')
+
+# Fast settings: the responses are built per request, not precompressed
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def compressible(response):
+    mimetype = response.mimetype or ''
+
+    return mimetype in COMPRESSIBLE_MIMETYPES or mimetype.startswith('text/')
+
+
+def choose_encoding(accept_encodings):
+    # Honour the client's q-values, preferring brotli on a tie
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return accept_encodings.best_match(encodings)
+
+
+def compress_response(response, accept_encodings, min_size):
+    """
+    Compresses the body of response with the best encoding the client
+    accepts, when it is at least min_size bytes long
+    """
+    if response.status_code not in (200, 201) or \
+            response.direct_passthrough or response.is_streamed or \
+            'Content-Encoding' in response.headers or \
+            not compressible(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None or response.content_length is None or \
+            response.content_length < min_size:
+        return response
+
+    data = response.get_data()
+    if encoding == 'br':
+        data = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+
+    # The compressed bytes differ from the ones the strong ETag was made
+    # for, but they represent the same content
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+def init_compression(app):
+    """
+    Compresses JSON and text responses of at least COMPRESS_MIN_SIZE bytes
+    (default 500) with brotli, when installed, or gzip, as negotiated with
+    Accept-Encoding. Set COMPRESS_ENABLED to false to leave it to a proxy
+    """
+    if not config_value(app.config, 'COMPRESS_ENABLED', bool, True):
+        return
+
+    min_size = config_value(app.config, 'COMPRESS_MIN_SIZE', default=500)
+
+    @app.after_request
+    def compress(response):
+        return compress_response(response, request.accept_encodings, min_size)
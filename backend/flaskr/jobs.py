@@ -0,0 +1,209 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+from flask import current_app
+
+from models import db, Question, config_value, notify_question_change, \
+    adjust_question_stats, question_stats_key, rebuild_question_stats, \
+    question_total
+from .sessions import new_session_id
+from .store import get_question_store
+
+logger = logging.getLogger(__name__)
+
+queue_lock = threading.Lock()
+
+
+class Job:
+    """A task run in the background, and how far it got"""
+
+    def __init__(self, kind, task, args):
+        self.id = new_session_id()
+        self.kind = kind
+        self.task = task
+        self.args = args
+        self.status = 'queued'
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.finished = threading.Event()
+
+    def wait(self, timeout=None):
+        """Waits for the job to finish, returns False on timeout"""
+        return self.finished.wait(timeout)
+
+    def format(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': {'done': self.done, 'total': self.total},
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    In-process background jobs, run in the app context by at most `workers`
+    threads, so that heavy maintenance never takes more than that many of
+    the worker's connections and CPU. Other jobs wait their turn in order.
+    Finished jobs are kept `ttl` seconds for their status to be read.
+    """
+
+    def __init__(self, app, workers=1, ttl=3600):
+        self.app = app
+        self.workers = workers
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.pending = queue.SimpleQueue()
+        # job id -> job, oldest first
+        self.jobs = OrderedDict()
+        self.threads = []
+
+    def evict_finished(self, now):
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished_at is not None and
+                   now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def submit(self, kind, task, *args):
+        """Queues task(job, *args) and returns its job"""
+        job = Job(kind, task, args)
+
+        with self.lock:
+            self.evict_finished(time.time())
+            self.jobs[job.id] = job
+
+            # Threads are started as jobs come in
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, daemon=True,
+                                          name='trivia-jobs')
+                self.threads.append(thread)
+                thread.start()
+
+        self.pending.put(job)
+        return job
+
+    def get(self, job_id):
+        """Returns the job, None for unknown or expired ones"""
+        with self.lock:
+            self.evict_finished(time.time())
+            return self.jobs.get(job_id)
+
+    def work(self):
+        while True:
+            job = self.pending.get()
+            job.status = 'running'
+            job.started_at = time.time()
+
+            try:
+                with self.app.app_context():
+                    job.result = job.task(job, *job.args)
+                job.status = 'succeeded'
+            except Exception as error:
+                logger.exception('Job %s (%s) failed', job.id, job.kind)
+                job.status = 'failed'
+                job.error = str(error)
+            finally:
+                job.finished_at = time.time()
+                job.finished.set()
+
+
+def get_job_queue():
+    with queue_lock:
+        if 'job_queue' not in current_app.extensions:
+            config = current_app.config
+            current_app.extensions['job_queue'] = JobQueue(
+                current_app._get_current_object(),
+                workers=config_value(config, 'JOB_WORKERS', default=1),
+                ttl=config_value(config, 'JOB_TTL', default=3600))
+
+    return current_app.extensions['job_queue']
+
+
+def delete_category_questions(job, category_id):
+    """
+    Deletes the questions of the category JOB_BATCH_SIZE at a time, each
+    batch in its own transaction with its question counts, and sleeps
+    JOB_BATCH_PAUSE_MS between batches to leave room for live requests
+    """
+    config = current_app.config
+    batch_size = config_value(config, 'JOB_BATCH_SIZE', default=500)
+    pause = config_value(config, 'JOB_BATCH_PAUSE_MS', float, 10) / 1000
+
+    job.total = db.session.execute(question_total(category_id)).scalar()
+    deleted = 0
+
+    while True:
+        rows = db.session.query(Question.id, Question.difficulty).filter(
+            Question.category == category_id).order_by(Question.id) \
+            .limit(batch_size).all()
+        if not rows:
+            break
+
+        db.session.query(Question).filter(
+            Question.id.in_([row.id for row in rows])) \
+            .delete(synchronize_session=False)
+        counts = Counter(question_stats_key(category_id, row.difficulty)
+                         for row in rows)
+        adjust_question_stats({key: -count for key, count in counts.items()})
+        db.session.commit()
+
+        deleted += len(rows)
+        job.done = deleted
+        # Questions added meanwhile are deleted as well
+        job.total = max(job.total or 0, deleted)
+
+        if pause:
+            time.sleep(pause)
+
+    if deleted:
+        # Indexes, caches and the question store reload on next use
+        notify_question_change('reload')
+
+    return {'deleted': deleted}
+
+
+def reindex(job):
+    """Rebuilds the in-memory structures this worker has loaded"""
+    notify_question_change('reload')
+    extensions = current_app.extensions
+
+    rebuilt = []
+    for name in ('quiz_index', 'search_index'):
+        if name in extensions:
+            extensions[name].load()
+            rebuilt.append(name)
+            job.done = len(rebuilt)
+
+    if get_question_store() is not None:
+        rebuilt.append('question_store')
+        job.done = len(rebuilt)
+
+    return {'rebuilt': rebuilt}
+
+
+def recount(job):
+    """Recounts the questions per category and difficulty"""
+    rebuild_question_stats()
+    db.session.commit()
+
+    return {'total_questions': db.session.execute(question_total()).scalar()}
+
+
+# The jobs that can be started with POST /jobs
+MAINTENANCE_JOBS = {
+    'reindex': reindex,
+    'recount': recount,
+}
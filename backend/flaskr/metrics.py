@@ -0,0 +1,189 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from flask.json import JSONEncoder
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import config_value
+
+# Histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Per-endpoint request metrics, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.queries = {}
+        self.db_time = {}
+        self.serialize_time = {}
+        self.n_plus_one = {}
+
+    def observe(self, endpoint, method, status, latency, queries, db_time,
+                serialize_time, n_plus_one):
+        labels = (endpoint, method)
+
+        with self.lock:
+            key = labels + (status,)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(
+                labels, Histogram(LATENCY_BUCKETS)).observe(latency)
+            self.queries.setdefault(
+                labels, Histogram(QUERY_COUNT_BUCKETS)).observe(queries)
+            self.db_time[labels] = self.db_time.get(labels, 0) + db_time
+            self.serialize_time[labels] = \
+                self.serialize_time.get(labels, 0) + serialize_time
+            if n_plus_one:
+                self.n_plus_one[labels] = self.n_plus_one.get(labels, 0) + 1
+
+    def render(self):
+        lines = []
+
+        def labels(values, names=('endpoint', 'method', 'status')):
+            return ','.join('{}="{}"'.format(name, value)
+                            for name, value in zip(names, values))
+
+        def counter(name, help, values):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} counter'.format(name))
+            for key, value in sorted(values.items()):
+                lines.append('{}{{{}}} {}'.format(name, labels(key), value))
+
+        def histogram(name, help, values):
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} histogram'.format(name))
+            for key, hist in sorted(values.items()):
+                cumulative = 0
+                for bound, count in zip(hist.buckets + ('+Inf',), hist.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                        name, labels(key), bound, cumulative))
+                lines.append('{}_sum{{{}}} {}'.format(
+                    name, labels(key), hist.sum))
+                lines.append('{}_count{{{}}} {}'.format(
+                    name, labels(key), hist.count))
+
+        with self.lock:
+            counter('trivia_requests_total',
+                    'Requests handled.', self.requests)
+            histogram('trivia_request_duration_seconds',
+                      'Request latency.', self.latency)
+            histogram('trivia_request_db_queries',
+                      'SQL queries run per request.', self.queries)
+            counter('trivia_request_db_seconds_total',
+                    'Time spent running SQL queries.', self.db_time)
+            counter('trivia_request_serialize_seconds_total',
+                    'Time spent formatting and encoding responses.',
+                    self.serialize_time)
+            counter('trivia_n_plus_one_suspects_total',
+                    'Requests that ran more queries than the threshold.',
+                    self.n_plus_one)
+
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def serialize_timer():
+    """Adds the time spent in the block to the request's serialization time"""
+    if not has_request_context() or 'metrics_start' not in g:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.metrics_serialize_time += time.perf_counter() - start
+
+
+class TimedJSONEncoder(JSONEncoder):
+    def encode(self, o):
+        with serialize_timer():
+            return super().encode(o)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context,
+                      executemany):
+    if has_request_context() and 'metrics_start' in g:
+        conn.info.setdefault('metrics_query_start', []).append(
+            time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context,
+                     executemany):
+    starts = conn.info.get('metrics_query_start')
+
+    if not starts or not has_request_context() or 'metrics_start' not in g:
+        return
+
+    g.metrics_queries += 1
+    g.metrics_db_time += time.perf_counter() - starts.pop()
+
+
+def init_metrics(app):
+    """
+    Records per-endpoint latency, SQL query counts and time, and
+    serialization time for every request, and serves them at /metrics
+    """
+    metrics = Metrics()
+    app.extensions['metrics'] = metrics
+    app.json_encoder = TimedJSONEncoder
+    threshold = config_value(app.config, 'METRICS_QUERY_THRESHOLD',
+                             default=10)
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_time = 0.0
+        g.metrics_serialize_time = 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'metrics_start' not in g:
+            return response
+
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        n_plus_one = threshold is not None and g.metrics_queries > threshold
+
+        if n_plus_one:
+            app.logger.warning(
+                'Possible N+1 queries: %s %s ran %d SQL queries',
+                request.method, request.path, g.metrics_queries)
+
+        metrics.observe(endpoint, request.method, response.status_code,
+                        time.perf_counter() - g.metrics_start,
+                        g.metrics_queries, g.metrics_db_time,
+                        g.metrics_serialize_time, n_plus_one)
+
+        return response
+
+    @app.route('/metrics')
+    def get_metrics():
+        return app.response_class(
+            metrics.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    return metrics
@@ -0,0 +1,354 @@
+import random
+import threading
+import time
+from flask import current_app, has_app_context
+
+from models import db, Question, QUESTION_COLUMNS, on_question_change
+from .store import get_question_store
+
+# How many random draws to try before falling back to scanning the
+# remaining ids of a bucket in memory
+MAX_DRAW_ATTEMPTS = 32
+
+# Bucket key for the quiz played across all the categories
+ALL_CATEGORIES = None
+
+DIFFICULTIES = range(1, 6)
+
+# Adaptive quizzes start in the middle and look at this many of the most
+# recent answers to decide whether to step the difficulty up or down
+START_DIFFICULTY = 3
+ADAPTIVE_WINDOW = 5
+STEP_UP_ACCURACY = 0.8
+STEP_DOWN_ACCURACY = 0.5
+
+
+def as_int(value):
+    # Questions detached from a deleted category have no category
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# For each target difficulty, the target first and then the easier and
+# harder levels around it
+NEAREST_DIFFICULTIES = {
+    target: sorted(DIFFICULTIES, key=lambda difficulty: (
+        abs(difficulty - target), difficulty))
+    for target in DIFFICULTIES
+}
+
+
+def target_difficulty(difficulties, results):
+    """
+    Returns the difficulty to aim for after the questions of the given
+    difficulties were answered with the given results (oldest first):
+    one level above the last question after mostly right answers, one
+    level below after mostly wrong ones
+    """
+    recent = list(zip(difficulties, results))[-ADAPTIVE_WINDOW:]
+    recent = [(difficulty, correct) for difficulty, correct in recent
+              if difficulty is not None]
+
+    if not recent:
+        return START_DIFFICULTY
+
+    level = recent[-1][0]
+    accuracy = sum(1 for _, correct in recent if correct) / len(recent)
+
+    if accuracy >= STEP_UP_ACCURACY:
+        level += 1
+    elif accuracy < STEP_DOWN_ACCURACY:
+        level -= 1
+
+    return min(max(level, DIFFICULTIES[0]), DIFFICULTIES[-1])
+
+
+class IdBucket:
+    """A list of question ids supporting O(1) add, remove and random pick"""
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, question_id):
+        if question_id in self.positions:
+            return
+
+        self.positions[question_id] = len(self.ids)
+        self.ids.append(question_id)
+
+    def remove(self, question_id):
+        position = self.positions.pop(question_id, None)
+
+        if position is None:
+            return
+
+        # Move the last id into the freed slot so the list stays dense
+        last_id = self.ids.pop()
+        if last_id != question_id:
+            self.ids[position] = last_id
+            self.positions[last_id] = position
+
+    def pick_many(self, exclude, count):
+        """Picks up to count distinct random ids that are not in exclude"""
+        size = len(self.ids)
+        picked = []
+        chosen = set()
+
+        for _ in range(MAX_DRAW_ATTEMPTS * count if size else 0):
+            question_id = self.ids[random.randrange(size)]
+            if question_id not in exclude and question_id not in chosen:
+                chosen.add(question_id)
+                picked.append(question_id)
+                if len(picked) == count:
+                    return picked
+
+        # Most of the bucket has already been played
+        remaining = [qid for qid in self.ids
+                     if qid not in exclude and qid not in chosen]
+
+        return picked + random.sample(
+            remaining, min(count - len(picked), len(remaining)))
+
+
+class QuestionIndex:
+    """
+    In-memory index of question ids per category, and per category and
+    difficulty, used to draw quiz questions without scanning the questions
+    table. It is loaded on first use, kept up to date by question inserts
+    and deletes, and reloaded after `ttl` seconds to pick up changes made
+    by other processes.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.buckets = {}
+        self.levels = {}
+        self.questions = {}
+
+    def load(self):
+        store = get_question_store()
+        if store is not None:
+            self.load_rows(store.index_rows())
+            return
+
+        self.load_rows(db.session.query(
+            Question.id, Question.category, Question.difficulty
+        ).yield_per(10000))
+
+    def load_rows(self, rows):
+        """Replaces the index with (question id, category, difficulty) rows"""
+        buckets = {ALL_CATEGORIES: IdBucket()}
+        levels = {}
+        questions = {}
+
+        for question_id, category, difficulty in rows:
+            add_to_buckets(buckets, levels, questions, question_id,
+                           category, difficulty)
+
+        with self.lock:
+            self.buckets = buckets
+            self.levels = levels
+            self.questions = questions
+            self.loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+    def is_stale(self):
+        if self.loaded_at is None:
+            return True
+
+        return self.ttl is not None and \
+            time.monotonic() - self.loaded_at > self.ttl
+
+    def add(self, question_id, category, difficulty):
+        with self.lock:
+            if self.loaded_at is None:
+                return
+
+            add_to_buckets(self.buckets, self.levels, self.questions,
+                           question_id, category, difficulty)
+
+    def remove(self, question_id):
+        with self.lock:
+            if self.loaded_at is None or question_id not in self.questions:
+                return
+
+            category, difficulty = self.questions.pop(question_id)
+            for key in bucket_keys(category):
+                self.buckets[key].remove(question_id)
+                if (key, difficulty) in self.levels:
+                    self.levels[key, difficulty].remove(question_id)
+
+    def difficulty(self, question_id):
+        """Returns the difficulty of an indexed question, None if unknown"""
+        if self.is_stale():
+            self.load()
+
+        question = self.questions.get(question_id)
+        return question[1] if question is not None else None
+
+    def pick_many(self, category, exclude, count, difficulty=None):
+        """
+        Picks up to count distinct questions of the category in one pass.
+        With a difficulty, they come from that difficulty first, then from
+        the closest difficulties that still have unplayed questions
+        """
+        if self.is_stale():
+            self.load()
+
+        with self.lock:
+            if difficulty is None:
+                bucket = self.buckets.get(category)
+                return bucket.pick_many(exclude, count) if bucket else []
+
+            # Difficulty buckets do not overlap, so no id is picked twice
+            picked = []
+            for level in NEAREST_DIFFICULTIES[difficulty]:
+                bucket = self.levels.get((category, level))
+                if bucket is not None:
+                    picked += bucket.pick_many(exclude, count - len(picked))
+                if len(picked) == count:
+                    break
+
+            return picked
+
+    def sample(self, category, size):
+        if self.is_stale():
+            self.load()
+
+        with self.lock:
+            bucket = self.buckets.get(category)
+            if bucket is None:
+                return []
+
+            return random.sample(bucket.ids, min(size, len(bucket)))
+
+
+def bucket_keys(category):
+    # Questions without a category are only played across all categories
+    if category is None:
+        return (ALL_CATEGORIES,)
+
+    return (ALL_CATEGORIES, category)
+
+
+def add_to_buckets(buckets, levels, questions, question_id, category,
+                   difficulty):
+    category = as_int(category)
+    difficulty = as_int(difficulty)
+    questions[question_id] = (category, difficulty)
+
+    for key in bucket_keys(category):
+        buckets.setdefault(key, IdBucket()).add(question_id)
+        if difficulty is not None:
+            levels.setdefault((key, difficulty), IdBucket()).add(question_id)
+
+
+def get_question_index():
+    index = current_app.extensions.get('quiz_index')
+
+    if index is None:
+        index = QuestionIndex(ttl=current_app.config.get('QUIZ_INDEX_TTL', 300))
+        current_app.extensions['quiz_index'] = index
+
+    return index
+
+
+@on_question_change
+def update_question_index(action, question):
+    if not has_app_context():
+        return
+
+    index = current_app.extensions.get('quiz_index')
+    if index is None:
+        return
+
+    if action == 'insert':
+        index.add(question.id, question.category, question.difficulty)
+    elif action == 'update':
+        index.remove(question.id)
+        index.add(question.id, question.category, question.difficulty)
+    elif action == 'delete':
+        index.remove(question.id)
+    else:
+        index.invalidate()
+
+
+def load_question_row(question_id):
+    """Returns the QUESTION_COLUMNS row of the question, None if it is gone"""
+    store = get_question_store()
+    if store is not None:
+        return store.get(question_id)
+
+    return db.session.query(*QUESTION_COLUMNS).filter(
+        Question.id == question_id).first()
+
+
+def load_question_rows(question_ids):
+    """Returns {id: QUESTION_COLUMNS row} of the questions that still exist"""
+    store = get_question_store()
+    if store is not None:
+        return store.rows(question_ids)
+
+    return {row.id: row for row in db.session.query(*QUESTION_COLUMNS)
+            .filter(Question.id.in_(question_ids))}
+
+
+def quiz_difficulty(previous_questions, recent_results):
+    """
+    Returns the difficulty an adaptive quiz should aim for, given whether
+    the last len(recent_results) previous questions were answered right
+    """
+    if len(recent_results) > len(previous_questions):
+        raise ValueError('More results than previous questions')
+
+    index = get_question_index()
+    recent = previous_questions[len(previous_questions) - len(recent_results):]
+
+    return target_difficulty([index.difficulty(question_id)
+                              for question_id in recent], recent_results)
+
+
+def draw_quiz_questions(category_id, previous_questions, count,
+                        difficulty=None):
+    """
+    Returns the rows of up to count random questions of the category (all
+    the categories when category_id is None) that are not in
+    previous_questions, fetched in one query. With a difficulty, they are
+    drawn from that difficulty or the nearest ones with questions left
+    """
+    index = get_question_index()
+    exclude = set(previous_questions)
+    questions = []
+
+    while len(questions) < count:
+        question_ids = index.pick_many(category_id, exclude,
+                                       count - len(questions), difficulty)
+        if not question_ids:
+            break
+
+        rows = load_question_rows(question_ids)
+        for question_id in question_ids:
+            exclude.add(question_id)
+            if question_id in rows:
+                questions.append(rows[question_id])
+            else:
+                # Deleted by another process since the index loaded
+                index.remove(question_id)
+
+    return questions
+
+
+def deal_quiz_deck(category_id, size):
+    """Returns up to `size` shuffled question ids of the category"""
+    return get_question_index().sample(category_id, size)
@@ -0,0 +1,208 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+from models import format_question_row, config_value
+from .quiz import draw_quiz_questions
+from .scoring import normalize_answer, check_answer, answer_fuzziness
+from .serialize import encode_json
+from .sessions import new_session_id
+
+# Sent to idle streams so proxies do not close them
+KEEPALIVE = b': keepalive\n\n'
+
+# Sent first, so the response starts right away, with the reconnection
+# delay for the browser in milliseconds
+RETRY = b'retry: 3000\n\n'
+
+
+def encode_event(name, payload):
+    """Encodes a Server-Sent Event once, to be sent to every player"""
+    return b'event: ' + name.encode('ascii') + b'\ndata: ' + \
+        encode_json(payload) + b'\n'
+
+
+class Room:
+    """
+    A quiz played by many players at once. Every round, one question is
+    drawn for the whole room and its event is encoded once and put on the
+    queue of every connected player. Answers are collected as they come in
+    and scored when the round is closed.
+    """
+
+    def __init__(self, category_id, rounds):
+        self.category_id = category_id
+        self.rounds = rounds
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.round = 0
+        self.question = None
+        self.event = None
+        self.previous_questions = []
+        self.answers = {}
+        self.scores = {}
+        self.finished = False
+
+    def subscribe(self):
+        """Returns the queue of events of a new player"""
+        events = queue.SimpleQueue()
+
+        with self.lock:
+            # Players joining mid-round get the current question
+            if self.event is not None:
+                events.put(self.event)
+            if self.finished:
+                events.put(None)
+            else:
+                self.subscribers.add(events)
+
+        return events
+
+    def unsubscribe(self, events):
+        with self.lock:
+            self.subscribers.discard(events)
+
+    def broadcast(self, event):
+        for events in self.subscribers:
+            events.put(event)
+
+    def answer(self, player, round, answer):
+        """Records the player's first answer to the round, False if late"""
+        with self.lock:
+            if round != self.round or self.question is None or \
+                    player in self.answers:
+                return False
+
+            self.answers[player] = answer
+            return True
+
+    def next_round(self):
+        """
+        Scores the current round and starts the next one. Returns the
+        question of the new round, None when the quiz is over
+        """
+        with self.lock:
+            if self.question is not None:
+                self.broadcast(encode_event('results', self.score_round()))
+
+            questions = draw_quiz_questions(
+                self.category_id, self.previous_questions, 1) \
+                if self.round < self.rounds and not self.finished else []
+
+            if not questions:
+                self.finished = True
+                self.question = None
+                self.event = encode_event('end', {'scores': self.scores})
+                self.broadcast(self.event)
+                self.broadcast(None)
+                self.subscribers.clear()
+                return None
+
+            self.round += 1
+            self.question = questions[0]
+            self.previous_questions.append(self.question.id)
+            self.answers = {}
+
+            # The players only get to see the answer with the results
+            question = format_question_row(self.question)
+            del question['answer']
+            self.event = encode_event('question', {
+                'round': self.round, 'question': question})
+            self.broadcast(self.event)
+
+            return question
+
+    def score_round(self):
+        correct_answer = normalize_answer(self.question.answer)
+        fuzziness = answer_fuzziness()
+        results = {player: check_answer(normalize_answer(answer),
+                                        correct_answer, fuzziness)
+                   for player, answer in self.answers.items()}
+
+        for player, correct in results.items():
+            self.scores[player] = self.scores.get(player, 0) + int(correct)
+
+        return {
+            'round': self.round,
+            'answer': self.question.answer,
+            'results': results,
+            'scores': self.scores,
+        }
+
+    def state(self):
+        with self.lock:
+            return {
+                'round': self.round,
+                'rounds': self.rounds,
+                'players': len(self.subscribers),
+                'scores': dict(self.scores),
+                'finished': self.finished,
+            }
+
+
+class RoomRegistry:
+    """In-process quiz rooms, expiring `ttl` seconds after their last use"""
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # room id -> [room, expires at], least recently used first
+        self.rooms = OrderedDict()
+
+    def evict_expired(self, now):
+        while self.rooms:
+            room_id, (room, expires_at) = next(iter(self.rooms.items()))
+            if expires_at > now:
+                break
+            del self.rooms[room_id]
+
+    def create(self, category_id, rounds):
+        room_id = new_session_id()
+        now = time.monotonic()
+
+        with self.lock:
+            self.evict_expired(now)
+            self.rooms[room_id] = [Room(category_id, rounds), now + self.ttl]
+
+        return room_id
+
+    def get(self, room_id):
+        """Returns the room, raising KeyError for unknown or expired ones"""
+        now = time.monotonic()
+
+        with self.lock:
+            self.evict_expired(now)
+            entry = self.rooms[room_id]
+            entry[1] = now + self.ttl
+            self.rooms.move_to_end(room_id)
+
+            return entry[0]
+
+
+def get_room_registry():
+    if 'quiz_rooms' not in current_app.extensions:
+        current_app.extensions['quiz_rooms'] = RoomRegistry(
+            ttl=config_value(current_app.config, 'QUIZ_ROOM_TTL',
+                             default=3600))
+
+    return current_app.extensions['quiz_rooms']
+
+
+def stream_events(room, events, keepalive=15):
+    """Yields the events of a player until the quiz is over"""
+    try:
+        yield RETRY
+        while True:
+            try:
+                event = events.get(timeout=keepalive)
+            except queue.Empty:
+                yield KEEPALIVE
+                continue
+
+            if event is None:
+                return
+            yield event
+    finally:
+        room.unsubscribe(events)
@@ -0,0 +1,248 @@
+import itertools
+import multiprocessing
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, has_app_context
+
+from models import config_value, on_question_change
+from .quiz import load_question_rows
+
+# Dropped from the start of answers before they are compared
+ARTICLES = {'a', 'an', 'the'}
+
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+# Answers shorter than this, once normalized, must match exactly
+MIN_FUZZY_LENGTH = 4
+
+# Answers sent to a pool process at a time
+SCORING_CHUNK_SIZE = 2000
+
+# Question ids looked up in one query
+LOAD_BATCH_SIZE = 500
+
+pool_lock = threading.Lock()
+
+
+def normalize_answer(answer):
+    """
+    Lowercases the answer and strips its accents, punctuation and leading
+    article, so that "The Beatles!" and "beatles" compare equal
+    """
+    text = unicodedata.normalize('NFKD', str(answer).lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    words = PUNCTUATION.sub(' ', text).split()
+
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+
+    return ' '.join(words)
+
+
+def edit_distance(a, b, limit):
+    """
+    Returns the Levenshtein distance between a and b, or limit + 1 as soon
+    as it is known to be over limit. Only the band of cells within limit
+    of the diagonal is computed
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    # A typo leaves most of the answer alone: skip what both share
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and \
+            a[-end - 1] == b[-end - 1]:
+        end += 1
+    a = a[start:len(a) - end]
+    b = b[start:len(b) - end]
+
+    over = limit + 1
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i, char in enumerate(a, start=1):
+        low = max(1, i - limit)
+        high = min(len(b), i + limit)
+        current = [over] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+
+        for j in range(low, high + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (char != b[j - 1]))
+
+        if min(current[low - 1:high + 1]) > limit:
+            return over
+        previous = current
+
+    return min(previous[-1], over)
+
+
+def check_answer(given, expected, fuzziness):
+    """
+    Whether the normalized answer given matches the normalized expected
+    one, allowing one typo per 1 / fuzziness characters
+    """
+    if given == expected:
+        return True
+
+    if len(expected) < MIN_FUZZY_LENGTH:
+        return False
+
+    edits = int(len(expected) * fuzziness)
+    return edits > 0 and edit_distance(given, expected, edits) <= edits
+
+
+def score_answers(answers, expected, fuzziness):
+    """
+    Scores (question id, answer) pairs against the normalized answers in
+    expected. Returns True or False for each pair, None when the question
+    is unknown. Runs in the pool processes as well
+    """
+    results = []
+    for question_id, answer in answers:
+        correct_answer = expected.get(question_id)
+        results.append(None if correct_answer is None else check_answer(
+            normalize_answer(answer), correct_answer, fuzziness))
+
+    return results
+
+
+class AnswerKey:
+    """
+    Normalized answers by question id, loaded on first use. The least
+    recently used are dropped beyond max_size, and all of them after `ttl`
+    seconds to pick up answers changed by other workers
+    """
+
+    def __init__(self, max_size=100000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.answers = OrderedDict()
+        self.cleared_at = time.monotonic()
+
+    def get_many(self, question_ids):
+        """Returns {question id: normalized answer} of the existing ones"""
+        found = {}
+        missing = []
+
+        with self.lock:
+            if self.ttl is not None and \
+                    time.monotonic() - self.cleared_at > self.ttl:
+                self.answers.clear()
+                self.cleared_at = time.monotonic()
+
+            for question_id in question_ids:
+                if question_id in self.answers:
+                    self.answers.move_to_end(question_id)
+                    found[question_id] = self.answers[question_id]
+                else:
+                    missing.append(question_id)
+
+        loaded = {}
+        for start in range(0, len(missing), LOAD_BATCH_SIZE):
+            rows = load_question_rows(missing[start:start + LOAD_BATCH_SIZE])
+            loaded.update((question_id, normalize_answer(row.answer or ''))
+                          for question_id, row in rows.items())
+
+        with self.lock:
+            self.answers.update(loaded)
+            while len(self.answers) > self.max_size:
+                self.answers.popitem(last=False)
+
+        found.update(loaded)
+        return found
+
+    def discard(self, question_id):
+        with self.lock:
+            self.answers.pop(question_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.answers.clear()
+
+
+def get_answer_key():
+    if 'answer_key' not in current_app.extensions:
+        current_app.extensions['answer_key'] = AnswerKey(
+            max_size=config_value(current_app.config, 'ANSWER_CACHE_SIZE',
+                                  default=100000),
+            ttl=config_value(current_app.config, 'ANSWER_CACHE_TTL',
+                             default=300))
+
+    return current_app.extensions['answer_key']
+
+
+def answer_fuzziness():
+    return config_value(current_app.config, 'ANSWER_FUZZINESS', float, 0.2)
+
+
+def get_scoring_pool(workers):
+    """
+    Returns the process pool of the app, started on first use. Its
+    processes are spawned, not forked, so they do not inherit the
+    worker's threads and connections
+    """
+    with pool_lock:
+        if 'scoring_pool' not in current_app.extensions:
+            current_app.extensions['scoring_pool'] = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'))
+
+    return current_app.extensions['scoring_pool']
+
+
+def score_submissions(submissions):
+    """
+    Scores lists of (question id, answer) pairs, one list per scorecard,
+    and returns their results in the same shape. Batches of at least
+    SCORING_POOL_THRESHOLD answers are split over a pool of SCORING_WORKERS
+    processes, when there is more than one
+    """
+    answers = list(itertools.chain.from_iterable(submissions))
+    expected = get_answer_key().get_many(
+        {question_id for question_id, _ in answers})
+    fuzziness = answer_fuzziness()
+
+    config = current_app.config
+    threshold = config_value(config, 'SCORING_POOL_THRESHOLD', default=5000)
+    workers = config_value(config, 'SCORING_WORKERS',
+                           default=os.cpu_count() or 1)
+    if threshold and workers > 1 and len(answers) >= threshold:
+        chunks = [answers[start:start + SCORING_CHUNK_SIZE]
+                  for start in range(0, len(answers), SCORING_CHUNK_SIZE)]
+        # Each process only gets the answers of its own chunk
+        keys = [{question_id: expected[question_id]
+                 for question_id, _ in chunk if question_id in expected}
+                for chunk in chunks]
+        results = list(itertools.chain.from_iterable(
+            get_scoring_pool(workers).map(score_answers, chunks, keys,
+                                   itertools.repeat(fuzziness))))
+    else:
+        results = score_answers(answers, expected, fuzziness)
+
+    results = iter(results)
+    return [list(itertools.islice(results, len(submission)))
+            for submission in submissions]
+
+
+@on_question_change
+def update_answer_key(action, question):
+    if not has_app_context():
+        return
+
+    answer_key = current_app.extensions.get('answer_key')
+    if answer_key is None:
+        return
+
+    if action in ('update', 'delete'):
+        answer_key.discard(question.id)
+    elif action == 'reload':
+        answer_key.clear()
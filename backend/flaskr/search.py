@@ -0,0 +1,184 @@
+import threading
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import text
+
+from models import db, Question, QUESTION_COLUMNS, on_question_change
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def rank(text, term):
+    # Whole word matches first, then word prefixes, then any substring
+    best = 2
+    start = text.find(term)
+
+    while start != -1:
+        if start == 0 or not text[start - 1].isalnum():
+            end = start + len(term)
+            if end == len(text) or not text[end].isalnum():
+                return 0
+            best = 1
+        start = text.find(term, start + 1)
+
+    return best
+
+
+class SearchIndex:
+    """
+    In-memory trigram index over the question text, for deployments without
+    a database-side text index (SQLite, tests). A term matches the same
+    questions as `question ILIKE '%term%'`: candidates are the questions
+    holding every trigram of the term, then the substring is checked.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.texts = {}
+        self.postings = {}
+
+    def load(self):
+        texts = {}
+        postings = {}
+
+        rows = db.session.query(Question.id, Question.question).yield_per(10000)
+        for question_id, question in rows:
+            text = (question or '').lower()
+            texts[question_id] = text
+            for trigram in trigrams(text):
+                postings.setdefault(trigram, set()).add(question_id)
+
+        with self.lock:
+            self.texts = texts
+            self.postings = postings
+            self.loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+    def is_stale(self):
+        if self.loaded_at is None:
+            return True
+
+        return self.ttl is not None and \
+            time.monotonic() - self.loaded_at > self.ttl
+
+    def add(self, question_id, question):
+        with self.lock:
+            if self.loaded_at is None:
+                return
+
+            text = (question or '').lower()
+            self.texts[question_id] = text
+            for trigram in trigrams(text):
+                self.postings.setdefault(trigram, set()).add(question_id)
+
+    def remove(self, question_id):
+        with self.lock:
+            if self.loaded_at is None or question_id not in self.texts:
+                return
+
+            text = self.texts.pop(question_id)
+            for trigram in trigrams(text):
+                posting = self.postings.get(trigram)
+                if posting is not None:
+                    posting.discard(question_id)
+                    if len(posting) == 0:
+                        del self.postings[trigram]
+
+    def search(self, term):
+        """Returns the ids of the questions matching term, best match first"""
+        if self.is_stale():
+            self.load()
+
+        term = term.lower()
+
+        with self.lock:
+            if len(term) < 3:
+                candidates = self.texts.keys()
+            else:
+                postings = sorted((self.postings.get(trigram, set())
+                                   for trigram in trigrams(term)), key=len)
+                candidates = set.intersection(*postings)
+
+            matches = [(rank(self.texts[question_id], term), question_id)
+                       for question_id in candidates
+                       if term in self.texts[question_id]]
+
+        matches.sort()
+        return [question_id for _, question_id in matches]
+
+
+def get_search_index():
+    index = current_app.extensions.get('search_index')
+
+    if index is None:
+        index = SearchIndex(ttl=current_app.config.get('SEARCH_INDEX_TTL', 300))
+        current_app.extensions['search_index'] = index
+
+    return index
+
+
+@on_question_change
+def update_search_index(action, question):
+    if not has_app_context():
+        return
+
+    index = current_app.extensions.get('search_index')
+    if index is None:
+        return
+
+    if action == 'insert':
+        index.add(question.id, question.question)
+    elif action == 'update':
+        index.remove(question.id)
+        index.add(question.id, question.question)
+    elif action == 'delete':
+        index.remove(question.id)
+    else:
+        index.invalidate()
+
+
+def similarity_available():
+    available = current_app.extensions.get('search_similarity')
+
+    if available is None:
+        available = db.engine.dialect.name == 'postgresql' and \
+            db.session.execute(text(
+                "SELECT count(*) FROM pg_extension WHERE extname = 'pg_trgm'"
+            )).scalar() > 0
+        current_app.extensions['search_similarity'] = available
+
+    return available
+
+
+def search_selection(search_term, ranked=True):
+    """
+    Returns a query of the rows of the questions whose text contains
+    search_term, ranked by trigram similarity when the Postgres pg_trgm
+    extension is installed (see models.init_db) and by id otherwise, or
+    when ranked is False
+    """
+    selection = db.session.query(*QUESTION_COLUMNS).filter(
+        Question.question.ilike('%{}%'.format(search_term.lower())))
+
+    if ranked and similarity_available():
+        similarity = db.func.similarity(Question.question, search_term)
+        return selection.order_by(similarity.desc(), Question.id)
+
+    return selection.order_by(Question.id)
+
+
+def fetch_questions(question_ids):
+    """Loads the question rows of question_ids, keeping their order"""
+    rows = db.session.query(*QUESTION_COLUMNS).filter(
+        Question.id.in_(question_ids)).all()
+    questions = {row[0]: row for row in rows}
+
+    return [questions[question_id] for question_id in question_ids
+            if question_id in questions]
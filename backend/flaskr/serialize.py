@@ -0,0 +1,97 @@
+import json
+import re
+from flask import current_app, jsonify
+
+from .metrics import serialize_timer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# json.dumps(ensure_ascii=True) escapes DEL as well, although it is ASCII
+NON_ASCII = re.compile('[^\x00-\x7e]')
+
+
+def escape_non_ascii(text):
+    # Escape like json.dumps(ensure_ascii=True), with surrogate pairs
+    # for characters outside the basic multilingual plane
+    def escape(match):
+        units = match.group().encode('utf-16-be')
+        return ''.join('\\u{:04x}'.format(int.from_bytes(units[i:i + 2], 'big'))
+                       for i in range(0, len(units), 2))
+
+    return NON_ASCII.sub(escape, text)
+
+
+def sort_keys(value):
+    """
+    Sorts dict keys the way json.dumps(sort_keys=True) does, turning
+    non-string keys into strings after sorting. Lists are left as they are:
+    the question dicts inside them come from format_question_row, which
+    already builds its keys in order.
+    """
+    if isinstance(value, dict):
+        return {key if isinstance(key, str) else str(key): sort_keys(item)
+                for key, item in sorted(value.items())}
+
+    return value
+
+
+def encode_json(payload, ensure_ascii=True):
+    """
+    Encodes payload exactly like jsonify() with the default config: sorted
+    keys, compact separators and a trailing newline
+    """
+    if orjson is None:
+        return (json.dumps(payload, sort_keys=True, separators=(',', ':'),
+                           ensure_ascii=ensure_ascii) + '\n').encode('utf-8')
+
+    body = orjson.dumps(sort_keys(payload), option=orjson.OPT_APPEND_NEWLINE)
+
+    if ensure_ascii and (not body.isascii() or b'\x7f' in body):
+        body = escape_non_ascii(body.decode('utf-8')).encode('ascii')
+
+    return body
+
+
+def list_items(items):
+    """Encodes the items of a list, without its brackets"""
+    return encode_json(items)[1:-2]
+
+
+def listing_head(fields):
+    """
+    The opening of a streamed listing: its other fields, and the start of
+    its questions list
+    """
+    head = b'{'
+    for key, value in sorted(fields.items()):
+        head += encode_json({key: value})[1:-2] + b','
+
+    return head + b'"questions":['
+
+
+def listing_tail(next_id):
+    """The end of a streamed listing, with the cursor of its next page"""
+    return b'],"next":' + encode_json(next_id)[:-1] + b'}\n'
+
+
+def json_response(payload, status=200):
+    """
+    Returns the same bytes as jsonify(payload), encoded with orjson when it
+    is installed and the app uses the default compact, sorted output
+    """
+    app = current_app
+
+    if orjson is None or not app.config['JSON_SORT_KEYS'] or \
+            app.config['JSONIFY_PRETTYPRINT_REGULAR'] or app.debug:
+        response = jsonify(payload)
+        response.status_code = status
+        return response
+
+    with serialize_timer():
+        body = encode_json(payload, app.config['JSON_AS_ASCII'])
+
+    return app.response_class(body, status=status,
+                              mimetype=app.config['JSONIFY_MIMETYPE'])
@@ -0,0 +1,213 @@
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from flask import current_app
+
+# Question ids in a deck are stored as C ints
+DECK_TYPECODE = 'i'
+DECK_ITEM_SIZE = array(DECK_TYPECODE).itemsize
+
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+
+class LocalSessionStore:
+    """
+    In-process quiz session store. Each session holds a pre-shuffled deck
+    of question ids and the position of the next question to draw. Sessions
+    expire `ttl` seconds after they were last used.
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # session id -> [deck, position, expires at], least recently used first
+        self.sessions = OrderedDict()
+
+    def evict_expired(self, now):
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session[2] > now:
+                break
+            del self.sessions[session_id]
+
+    def create(self, question_ids):
+        session_id = new_session_id()
+        now = time.monotonic()
+
+        with self.lock:
+            self.evict_expired(now)
+            self.sessions[session_id] = [
+                array(DECK_TYPECODE, question_ids), 0, now + self.ttl]
+
+        return session_id
+
+    def draw(self, session_id):
+        """
+        Returns the next question id of the session, None when the deck is
+        exhausted. Raises KeyError for unknown or expired sessions.
+        """
+        now = time.monotonic()
+
+        with self.lock:
+            self.evict_expired(now)
+            session = self.sessions[session_id]
+            self.sessions.move_to_end(session_id)
+            session[2] = now + self.ttl
+
+            deck, position = session[0], session[1]
+            if position >= len(deck):
+                return None
+
+            session[1] = position + 1
+            return deck[position]
+
+    def remaining(self, session_id):
+        with self.lock:
+            deck, position, _ = self.sessions[session_id]
+            return len(deck) - position
+
+    def delete(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+
+class InMemoryKeyValue:
+    """
+    A local stand-in for a Redis client implementing the few commands used
+    by KeyValueSessionStore, with the same argument conventions
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+        self.expires = {}
+
+    def _alive(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+        return key in self.data
+
+    def get(self, key):
+        with self.lock:
+            return self.data[key] if self._alive(key) else None
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self.data[key] = value
+            if ex is None:
+                self.expires.pop(key, None)
+            else:
+                self.expires[key] = time.monotonic() + ex
+
+        return True
+
+    def delete(self, *keys):
+        with self.lock:
+            deleted = 0
+            for key in keys:
+                if self._alive(key):
+                    deleted += 1
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+
+        return deleted
+
+    def expire(self, key, seconds):
+        with self.lock:
+            if not self._alive(key):
+                return False
+            self.expires[key] = time.monotonic() + seconds
+
+        return True
+
+    def incr(self, key, amount=1):
+        with self.lock:
+            value = int(self.data[key]) + amount if self._alive(key) else amount
+            self.data[key] = value
+
+        return value
+
+    def strlen(self, key):
+        with self.lock:
+            return len(self.data[key]) if self._alive(key) else 0
+
+    def getrange(self, key, start, end):
+        # Like Redis, end is inclusive
+        with self.lock:
+            if not self._alive(key):
+                return b''
+            return self.data[key][start:end + 1]
+
+
+class KeyValueSessionStore:
+    """
+    Quiz session store on top of a Redis-like client (get, set, delete,
+    expire, incr, strlen and getrange), so sessions can be shared between
+    workers. Each draw reads a single id out of the deck with GETRANGE.
+    """
+
+    def __init__(self, client, ttl=3600, prefix='quiz-session:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def keys(self, session_id):
+        return (self.prefix + session_id + ':deck',
+                self.prefix + session_id + ':position')
+
+    def create(self, question_ids):
+        session_id = new_session_id()
+        deck_key, position_key = self.keys(session_id)
+
+        deck = array(DECK_TYPECODE, question_ids).tobytes()
+        self.client.set(deck_key, deck, ex=self.ttl)
+        self.client.set(position_key, 0, ex=self.ttl)
+
+        return session_id
+
+    def draw(self, session_id):
+        deck_key, position_key = self.keys(session_id)
+
+        if not self.client.expire(deck_key, self.ttl):
+            raise KeyError(session_id)
+
+        position = self.client.incr(position_key) - 1
+        self.client.expire(position_key, self.ttl)
+
+        start = position * DECK_ITEM_SIZE
+        item = self.client.getrange(deck_key, start, start + DECK_ITEM_SIZE - 1)
+        if len(item) < DECK_ITEM_SIZE:
+            return None
+
+        return array(DECK_TYPECODE, item)[0]
+
+    def remaining(self, session_id):
+        deck_key, position_key = self.keys(session_id)
+
+        size = self.client.strlen(deck_key)
+        if size == 0:
+            raise KeyError(session_id)
+
+        position = int(self.client.get(position_key) or 0)
+        return max(size // DECK_ITEM_SIZE - position, 0)
+
+    def delete(self, session_id):
+        self.client.delete(*self.keys(session_id))
+
+
+def get_session_store():
+    store = current_app.config.get('QUIZ_SESSION_STORE')
+
+    if store is None:
+        store = LocalSessionStore(
+            ttl=current_app.config.get('QUIZ_SESSION_TTL', 3600))
+        current_app.config['QUIZ_SESSION_STORE'] = store
+
+    return store
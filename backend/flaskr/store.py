@@ -0,0 +1,566 @@
+import bisect
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import namedtuple
+from flask import current_app, has_app_context
+
+from models import db, Question, QUESTION_COLUMNS, config_value, \
+    on_question_change
+from .search import rank
+
+QuestionRow = namedtuple('QuestionRow',
+                         ['id', 'question', 'answer', 'category',
+                          'difficulty'])
+
+SNAPSHOT_MAGIC = b'TRIVIAQ2'
+
+# The column sections of a store and their array typecodes. Categories and
+# difficulties are stored as 0 when missing
+ARRAYS = {
+    'ids': 'q',
+    'categories': 'q',
+    'difficulties': 'q',
+    'question_offsets': 'q',
+    'answer_offsets': 'q',
+    'lower_offsets': 'q',
+    'category_ids': 'q',
+}
+
+# UTF-8 texts, one after the other, split by the offsets above
+TEXTS = {
+    'questions': 'question_offsets',
+    'answers': 'answer_offsets',
+    'lowers': 'lower_offsets',
+}
+
+# Local changes kept to replay over a newer snapshot, before giving up and
+# reloading from the database
+MAX_CHANGES = 10000
+
+
+def category_key(category):
+    try:
+        return int(category)
+    except (TypeError, ValueError):
+        return 0
+
+
+def build_sections(rows):
+    """
+    Returns the sections and the category bounds of a store holding the
+    (id, question, answer, category, difficulty) rows, sorted by id
+    """
+    sections = {name: array(typecode) for name, typecode in ARRAYS.items()}
+    texts = {name: bytearray() for name in TEXTS}
+    for offsets in TEXTS.values():
+        sections[offsets].append(0)
+
+    for question_id, question, answer, category, difficulty in rows:
+        sections['ids'].append(question_id)
+        sections['categories'].append(category_key(category))
+        sections['difficulties'].append(difficulty or 0)
+
+        question = question or ''
+        for name, text in (('questions', question),
+                           ('answers', answer or ''),
+                           ('lowers', question.lower())):
+            texts[name] += text.encode('utf-8')
+            sections[TEXTS[name]].append(len(texts[name]))
+
+    # The ids of each category, in id order, one category after the other
+    categories = sections['categories']
+    order = sorted(range(len(categories)), key=categories.__getitem__)
+    bounds = {}
+    for position, row in enumerate(order):
+        sections['category_ids'].append(sections['ids'][row])
+        bounds.setdefault(categories[row], [position, position])[1] = \
+            position + 1
+
+    sections.update((name, bytes(text)) for name, text in texts.items())
+
+    return sections, bounds
+
+
+def write_snapshot(path, batch_size=10000):
+    """
+    Writes every question to a snapshot file at path, that QuestionStore
+    can map into memory. The file is replaced atomically
+    """
+    rows = db.session.query(*QUESTION_COLUMNS).order_by(Question.id) \
+        .yield_per(batch_size)
+    sections, bounds = build_sections(rows)
+
+    layout = {}
+    position = 0
+    for name, section in sections.items():
+        size = len(memoryview(section).cast('B'))
+        layout[name] = [position, size]
+        position += size + (-size % 8)
+
+    header = json.dumps({
+        'created_at': time.time(),
+        'byteorder': sys.byteorder,
+        'bounds': {str(category): bound
+                   for category, bound in bounds.items()},
+        'sections': layout,
+    }).encode('utf-8')
+    start = len(SNAPSHOT_MAGIC) + 8 + len(header)
+    start += -start % 8
+
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as snapshot:
+        snapshot.write(SNAPSHOT_MAGIC)
+        snapshot.write(len(header).to_bytes(8, 'little'))
+        snapshot.write(header)
+        for name, section in sections.items():
+            snapshot.seek(start + layout[name][0])
+            snapshot.write(section)
+        snapshot.truncate(start + position)
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(temporary, path)
+
+    return len(sections['ids'])
+
+
+class QuestionStore:
+    """
+    Read-only copy of the questions table in a few flat columns: arrays of
+    ids, category ids and difficulties, and the texts packed in UTF-8
+    blobs. Loaded from a snapshot file, the columns stay in the mapped
+    file and forked workers share its pages. Without a snapshot, each
+    worker loads its own copy from the database on first use.
+
+    Inserts and deletes are applied in place. The first one copies the
+    small per-row columns; the text blobs are never copied, new texts are
+    kept on the side.
+    """
+
+    def __init__(self, sections, bounds, created_at=None, mapping=None):
+        self.created_at = created_at or time.time()
+        self.lock = threading.RLock()
+        # Keeps the snapshot file mapped for as long as the store lives
+        self.mapping = mapping
+        self.sections = sections
+
+        self.ids = sections['ids']
+        self.categories = sections['categories']
+        self.difficulties = sections['difficulties']
+        self.by_category = {category: sections['category_ids'][start:end]
+                            for category, (start, end) in bounds.items()}
+
+        # The texts loaded with the store, by slot
+        self.base_ids = self.ids
+        self.base_count = len(self.ids)
+        self.deleted_slots = set()
+        # Texts of the questions added since, slots from base_count on
+        self.extra = []
+        # Text slot of each row, None while rows and slots still match
+        self.slots = None
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls(*build_sections(rows))
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as snapshot:
+            mapping = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if mapping[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError('{} is not a question snapshot'.format(path))
+
+        length = int.from_bytes(mapping[8:16], 'little')
+        header = json.loads(mapping[16:16 + length])
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('{} was written on another platform'.format(path))
+
+        start = 16 + length
+        start += -start % 8
+        view = memoryview(mapping)
+        sections = {}
+        for name, (offset, size) in header['sections'].items():
+            if name in ARRAYS:
+                section = view[start + offset:start + offset + size]
+                sections[name] = section.cast(ARRAYS[name])
+            else:
+                # Texts are searched with mmap.find, from their offset
+                sections[name] = start + offset
+
+        bounds = {int(category): bound
+                  for category, bound in header['bounds'].items()}
+
+        return cls(sections, bounds, created_at=header['created_at'],
+                   mapping=mapping)
+
+    def blob(self, name):
+        """Returns the buffer holding the texts and where they start in it"""
+        section = self.sections[name]
+        if isinstance(section, int):
+            return self.mapping, section
+
+        return section, 0
+
+    def text(self, name, slot):
+        offsets = self.sections[TEXTS[name]]
+        blob, start = self.blob(name)
+
+        return blob[start + offsets[slot]:start + offsets[slot + 1]] \
+            .decode('utf-8')
+
+    def row(self, position):
+        slot = self.slots[position] if self.slots is not None else position
+
+        if slot < self.base_count:
+            question = self.text('questions', slot)
+            answer = self.text('answers', slot)
+        else:
+            _, question, answer, _ = self.extra[slot - self.base_count]
+
+        return QuestionRow(self.ids[position], question, answer,
+                           self.categories[position] or None,
+                           self.difficulties[position] or None)
+
+    def position(self, question_id):
+        position = bisect.bisect_left(self.ids, question_id)
+
+        if position < len(self.ids) and self.ids[position] == question_id:
+            return position
+
+        return None
+
+    def get(self, question_id):
+        """Returns the row of the question, None if there is no such one"""
+        with self.lock:
+            position = self.position(question_id)
+
+            return self.row(position) if position is not None else None
+
+    def rows(self, question_ids):
+        """Returns {id: row} of the questions that exist"""
+        with self.lock:
+            positions = ((question_id, self.position(question_id))
+                         for question_id in question_ids)
+
+            return {question_id: self.row(position)
+                    for question_id, position in positions
+                    if position is not None}
+
+    def index_rows(self):
+        """Returns the (id, category, difficulty) of every question"""
+        with self.lock:
+            return [(question_id, category or None, difficulty or None)
+                    for question_id, category, difficulty in
+                    zip(self.ids, self.categories, self.difficulties)]
+
+    def count(self, category_id=None):
+        if category_id is None:
+            return len(self.ids)
+
+        return len(self.by_category.get(category_id, ()))
+
+    def page(self, category_id=None, offset=0, limit=10, after_id=None):
+        """
+        Returns the rows of a page of the questions, in id order: `limit`
+        rows from `offset`, or after the question `after_id`
+        """
+        with self.lock:
+            ids = self.ids if category_id is None else \
+                self.by_category.get(category_id, ())
+            if after_id is not None:
+                offset = bisect.bisect_right(ids, after_id)
+
+            page = ids[offset:offset + limit]
+            if category_id is None:
+                return [self.row(position) for position in
+                        range(offset, offset + len(page))]
+
+            return [self.row(self.position(question_id))
+                    for question_id in page]
+
+    def search(self, term):
+        """
+        Returns the ids of the questions whose text contains term, best
+        match first, ranked like the in-memory search index
+        """
+        term = term.lower()
+        needle = term.encode('utf-8')
+        matches = []
+
+        with self.lock:
+            blob, start = self.blob('lowers')
+            offsets = self.sections['lower_offsets']
+            end = start + offsets[-1]
+
+            found = blob.find(needle, start, end)
+            while found != -1:
+                slot = bisect.bisect_right(offsets, found - start) - 1
+                text_end = start + offsets[slot + 1]
+
+                # Skip matches running over the end of a text
+                if found + len(needle) <= text_end and \
+                        slot not in self.deleted_slots:
+                    matches.append((rank(self.text('lowers', slot), term),
+                                    self.base_ids[slot]))
+
+                found = blob.find(needle, text_end, end)
+
+            for extra in self.extra:
+                if extra is not None and term in extra[3]:
+                    matches.append((rank(extra[3], term), extra[0]))
+
+        matches.sort()
+        return [question_id for _, question_id in matches]
+
+    def detach(self):
+        # Copy the per-row columns out of the snapshot before changing them
+        if self.slots is not None:
+            return
+
+        def copy(section, typecode):
+            copied = array(typecode)
+            copied.frombytes(memoryview(section).cast('B'))
+            return copied
+
+        self.ids = copy(self.ids, 'q')
+        self.categories = copy(self.categories, 'q')
+        self.difficulties = copy(self.difficulties, 'q')
+        self.by_category = {category: copy(ids, 'q')
+                            for category, ids in self.by_category.items()}
+        self.slots = array('q', range(len(self.ids)))
+
+    def add(self, question_id, question, answer, category, difficulty):
+        """Adds the question, replacing the row of the same id if any"""
+        category = category_key(category)
+        difficulty = difficulty or 0
+        # Fails here, before any column is changed, on values the columns
+        # cannot hold
+        array('q', (question_id, category, difficulty))
+
+        with self.lock:
+            self.detach()
+            self.remove(question_id)
+
+            question = question or ''
+            self.extra.append((question_id, question, answer or '',
+                               question.lower()))
+            position = bisect.bisect_left(self.ids, question_id)
+
+            self.ids.insert(position, question_id)
+            self.categories.insert(position, category)
+            self.difficulties.insert(position, difficulty)
+            self.slots.insert(position,
+                              self.base_count + len(self.extra) - 1)
+
+            ids = self.by_category.setdefault(category, array('q'))
+            ids.insert(bisect.bisect_left(ids, question_id), question_id)
+
+    def remove(self, question_id):
+        with self.lock:
+            self.detach()
+            position = self.position(question_id)
+            if position is None:
+                return
+
+            slot = self.slots.pop(position)
+            if slot < self.base_count:
+                self.deleted_slots.add(slot)
+            else:
+                self.extra[slot - self.base_count] = None
+
+            self.ids.pop(position)
+            self.difficulties.pop(position)
+            ids = self.by_category[self.categories.pop(position)]
+            ids.pop(bisect.bisect_left(ids, question_id))
+
+
+class QuestionBank:
+    """
+    Keeps the QuestionStore of the app loaded. With a snapshot file it is
+    mapped from the file, and hot reloaded when the file is replaced (its
+    modification time is checked every `check_interval` seconds). Without
+    one it is loaded from the database. Either way it is reloaded after
+    `ttl` seconds to pick up changes made by other workers.
+    """
+
+    def __init__(self, snapshot=None, ttl=300, check_interval=5):
+        self.snapshot = snapshot
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        # Held by the thread building the next store
+        self.loading = threading.Lock()
+        self.store = None
+        self.loaded_at = None
+        self.checked_at = None
+        self.snapshot_mtime = None
+        self.from_database = False
+        # Bumped on invalidation, so that a store built meanwhile is dropped
+        self.generation = 0
+        # Local changes since the store was loaded, as (time, action, row)
+        self.changes = []
+        # Local changes made while a store is built from the database
+        self.building = None
+
+    def get(self):
+        with self.lock:
+            store = self.store
+            if store is not None and not self.due():
+                return store
+
+        # One thread builds the next store while the others keep reading
+        # the current one. Without a store, they wait for it
+        if not self.loading.acquire(blocking=store is None):
+            return store
+
+        try:
+            with self.lock:
+                if self.store is not None and self.store is not store:
+                    # Built by another thread meanwhile
+                    return self.store
+
+            return self.load()
+        finally:
+            self.loading.release()
+
+    def due(self):
+        # Whether the store should be reloaded, called with the lock held
+        now = time.monotonic()
+
+        if self.ttl is not None and now - self.loaded_at > self.ttl:
+            return True
+
+        if self.snapshot and now - self.checked_at >= self.check_interval:
+            self.checked_at = now
+            return self.snapshot_changed()
+
+        return False
+
+    def snapshot_changed(self):
+        try:
+            return os.stat(self.snapshot).st_mtime != self.snapshot_mtime
+        except OSError:
+            return False
+
+    def load(self):
+        """
+        Builds a new store and swaps it in. It is built without holding the
+        lock, the local changes made meanwhile are applied to it after
+        """
+        with self.lock:
+            generation = self.generation
+            # After an invalidation, stay on the database until the snapshot
+            # is written again
+            from_snapshot = bool(self.snapshot) and \
+                os.path.exists(self.snapshot) and \
+                (not self.from_database or self.snapshot_changed())
+            if from_snapshot:
+                mtime = os.stat(self.snapshot).st_mtime
+            self.building = []
+
+        try:
+            if from_snapshot:
+                store = QuestionStore.open(self.snapshot)
+            else:
+                rows = db.session.query(*QUESTION_COLUMNS) \
+                    .order_by(Question.id).yield_per(10000)
+                store = QuestionStore.from_rows(rows)
+        except Exception:
+            with self.lock:
+                self.building = None
+            raise
+
+        with self.lock:
+            building, self.building = self.building, None
+            if generation != self.generation:
+                # Invalidated while it was built: serve it to this request
+                # only
+                return store
+
+            if from_snapshot:
+                self.snapshot_mtime = mtime
+                self.from_database = False
+                # Replay the local changes the snapshot does not have yet
+                self.changes = [change for change in self.changes
+                                if change[0] > store.created_at]
+                changes = self.changes
+            else:
+                self.changes = []
+                changes = building
+
+            for _, action, row in changes:
+                apply_change(store, action, row)
+
+            self.store = store
+            self.loaded_at = self.checked_at = time.monotonic()
+
+        return store
+
+    def apply(self, action, row):
+        with self.lock:
+            if self.building is not None:
+                self.building.append((time.time(), action, row))
+
+            if self.snapshot:
+                self.changes.append((time.time(), action, row))
+                if len(self.changes) > MAX_CHANGES:
+                    self.invalidate()
+                    return
+
+            if self.store is not None:
+                apply_change(self.store, action, row)
+
+    def invalidate(self):
+        # Changes the snapshot cannot catch up with: read the database
+        self.store = None
+        self.from_database = True
+        self.changes = []
+        self.generation += 1
+
+
+def apply_change(store, action, row):
+    if action == 'delete':
+        store.remove(row.id)
+    else:
+        store.add(*row)
+
+
+def get_question_store():
+    """Returns the question store of the app, None when it is not enabled"""
+    bank = current_app.extensions.get('question_bank')
+
+    if bank is None:
+        config = current_app.config
+        if not config_value(config, 'QUESTION_STORE', bool, False):
+            return None
+
+        bank = current_app.extensions['question_bank'] = QuestionBank(
+            snapshot=config_value(config, 'QUESTION_STORE_SNAPSHOT', str),
+            ttl=config_value(config, 'QUESTION_STORE_TTL', default=300),
+            check_interval=config_value(
+                config, 'QUESTION_STORE_CHECK_INTERVAL', float, 5))
+
+    return bank.get()
+
+
+@on_question_change
+def update_question_store(action, question):
+    if not has_app_context():
+        return
+
+    bank = current_app.extensions.get('question_bank')
+    if bank is None:
+        return
+
+    if action in ('insert', 'update', 'delete'):
+        bank.apply(action, QuestionRow(
+            question.id, question.question, question.answer,
+            question.category, question.difficulty))
+    else:
+        with bank.lock:
+            bank.invalidate()
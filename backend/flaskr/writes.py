@@ -0,0 +1,294 @@
+import functools
+import hashlib
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from flask import current_app, request, abort, make_response
+from werkzeug.exceptions import TooManyRequests
+
+from models import db, config_value, notify_question_change, \
+    adjust_question_stats, question_stats_key
+
+
+class PendingWrite:
+    def __init__(self, question):
+        self.question = question
+        self.question_id = None
+        self.error = None
+        self.done = False
+
+
+class WriteCoalescer:
+    """
+    Group commit for POST /questions. The first request to arrive becomes
+    the leader and commits every question queued by then in a single
+    transaction, while the requests that arrive during that commit wait to
+    be committed in the next one. The leader can linger for `window`
+    seconds to let a batch fill up.
+    """
+
+    def __init__(self, window=0.0, max_batch=100):
+        self.window = window
+        self.max_batch = max_batch
+        self.condition = threading.Condition()
+        self.pending = []
+        self.committing = False
+        self.batches = 0
+        self.writes = 0
+
+    def insert(self, question):
+        """Commits question and returns its id, raising if it failed"""
+        entry = PendingWrite(question)
+
+        with self.condition:
+            self.pending.append(entry)
+            while self.committing and not entry.done:
+                self.condition.wait()
+
+            if not entry.done:
+                self.committing = True
+
+        if not entry.done:
+            self.lead(entry)
+
+        # Keep this request's reads on the primary, as for its own writes
+        db.session().wrote = True
+
+        if entry.error is not None:
+            raise entry.error
+
+        return entry.question_id
+
+    def lead(self, entry):
+        try:
+            if self.window:
+                time.sleep(self.window)
+
+            while not entry.done:
+                with self.condition:
+                    batch = self.pending[:self.max_batch]
+                    del self.pending[:self.max_batch]
+
+                try:
+                    self.commit(batch)
+                except Exception as error:
+                    # Do not leave the other requests of the batch waiting
+                    for pending in batch:
+                        if not pending.done:
+                            pending.error = error
+                    self.finish(batch)
+                    raise
+        finally:
+            with self.condition:
+                self.committing = False
+                self.condition.notify_all()
+
+    def commit(self, batch):
+        questions = [pending.question for pending in batch]
+
+        try:
+            db.session.add_all(questions)
+            adjust_question_stats(Counter(
+                question_stats_key(question.category, question.difficulty)
+                for question in questions))
+            db.session.flush()
+            question_ids = [question.id for question in questions]
+            db.session.commit()
+        except Exception as error:
+            # Whatever went wrong, leave the session usable for the retries
+            db.session.rollback()
+            if len(batch) == 1:
+                batch[0].error = error
+                self.finish(batch)
+            else:
+                # Do not fail the whole batch for one bad question
+                for pending in batch:
+                    self.commit([pending])
+            return
+
+        for pending, question_id in zip(batch, question_ids):
+            pending.question_id = question_id
+            notify_question_change('insert', pending.question)
+
+        self.batches += 1
+        self.writes += len(batch)
+        self.finish(batch)
+
+    def finish(self, batch):
+        with self.condition:
+            for pending in batch:
+                pending.done = True
+            self.condition.notify_all()
+
+
+def get_write_coalescer():
+    if 'write_coalescer' not in current_app.extensions:
+        config = current_app.config
+        current_app.extensions['write_coalescer'] = WriteCoalescer(
+            window=config_value(config, 'WRITE_BATCH_WINDOW_MS',
+                                default=0) / 1000,
+            max_batch=config_value(config, 'WRITE_BATCH_SIZE', default=100))
+
+    return current_app.extensions['write_coalescer']
+
+
+class IdempotencyStore:
+    """
+    Responses of the requests made with an Idempotency-Key, kept for `ttl`
+    seconds. A retry of a request that is still being processed waits for
+    it instead of running again.
+    """
+
+    def __init__(self, ttl=24 * 60 * 60):
+        self.ttl = ttl
+        self.condition = threading.Condition()
+        self.entries = OrderedDict()
+
+    def begin(self, key, fingerprint):
+        """
+        Returns None when the caller should process the request, or the
+        stored (fingerprint, response) of a previous one
+        """
+        with self.condition:
+            self.expire()
+
+            while True:
+                entry = self.entries.get(key)
+                if entry is None:
+                    self.entries[key] = (fingerprint, None, time.monotonic())
+                    return None
+                if entry[1] is not None or entry[0] != fingerprint:
+                    return entry[:2]
+
+                self.condition.wait()
+
+    def finish(self, key, response):
+        """Stores the response, or forgets the key when response is None"""
+        with self.condition:
+            if response is None:
+                self.entries.pop(key, None)
+            else:
+                fingerprint, _, _ = self.entries[key]
+                self.entries[key] = (fingerprint, response, time.monotonic())
+                self.entries.move_to_end(key)
+            self.condition.notify_all()
+
+    def expire(self):
+        # Entries are in the order they were stored, oldest first
+        now = time.monotonic()
+        while self.entries:
+            _, response, stored_at = next(iter(self.entries.values()))
+            if response is None or now - stored_at <= self.ttl:
+                break
+            self.entries.popitem(last=False)
+
+
+def idempotent(view):
+    # Replay the stored response of a request made again with the same
+    # Idempotency-Key and body, instead of running it twice
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+
+        store = current_app.extensions.setdefault(
+            'idempotency_store', IdempotencyStore(ttl=config_value(
+                current_app.config, 'IDEMPOTENCY_TTL', default=24 * 60 * 60)))
+        key = (request.method, request.path, key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        stored = store.begin(key, fingerprint)
+        if stored is not None:
+            if stored[0] != fingerprint:
+                abort(422)
+
+            status, body = stored[1]
+            response = current_app.response_class(
+                body, status=status, mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        response = None
+        try:
+            response = make_response(view(*args, **kwargs))
+        finally:
+            # Server errors are not stored, so the client can retry them
+            store.finish(key, None if response is None or
+                         response.status_code >= 500 else
+                         (response.status_code, response.get_data()))
+
+        return response
+
+    return wrapper
+
+
+class TokenBucketLimiter:
+    """
+    Allows each client `rate` requests per second on average, and bursts of
+    up to `burst` requests
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def acquire(self, client):
+        """Returns 0 when the request is allowed, or the seconds to wait"""
+        now = time.monotonic()
+
+        with self.lock:
+            tokens, updated = self.buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+            if tokens >= 1:
+                self.buckets[client] = (tokens - 1, now)
+                wait = 0
+            else:
+                self.buckets[client] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+
+            if len(self.buckets) > self.max_clients:
+                self.prune(now)
+
+        return wait
+
+    def prune(self, now):
+        # Buckets that have filled up again are the same as missing ones
+        full = [client for client, (tokens, updated) in self.buckets.items()
+                if tokens + (now - updated) * self.rate >= self.burst]
+        for client in full:
+            del self.buckets[client]
+
+
+def rate_limited(view):
+    # Limit each client to WRITE_RATE_LIMIT requests per second (bursts of
+    # WRITE_RATE_BURST), to protect the primary during spikes. Off unless
+    # WRITE_RATE_LIMIT is set
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        limiter = get_rate_limiter()
+
+        if limiter is not None:
+            wait = limiter.acquire(request.remote_addr)
+            if wait:
+                raise TooManyRequests(retry_after=math.ceil(wait))
+
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def get_rate_limiter():
+    if 'rate_limiter' not in current_app.extensions:
+        config = current_app.config
+        rate = config_value(config, 'WRITE_RATE_LIMIT', float, 0)
+        current_app.extensions['rate_limiter'] = TokenBucketLimiter(
+            rate, config_value(config, 'WRITE_RATE_BURST', float,
+                               max(rate, 1) * 2)) if rate else None
+
+    return current_app.extensions['rate_limiter']
@@ -1,7 +1,16 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import importlib
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, \
+    create_engine, inspect, text
+from sqlalchemy import event, orm, func, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
+import logging
+import threading
+import time
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -14,20 +23,408 @@ DB_NAME = os.getenv('DB_NAME')
 database_path = 'postgresql://{}:{}@{}/{}'.format(
     DB_USER, DB_PASSWORD, DB_HOST, DB_NAME)
 
-db = SQLAlchemy()
+logger = logging.getLogger(__name__)
 
 """
-setup_db(app)
-    binds a flask application and a SQLAlchemy service
+engine_options(config, database_path)
+    builds the SQLAlchemy engine options from the app config, falling back
+    to the environment:
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds),
+    DB_POOL_RECYCLE (seconds), DB_POOL_PRE_PING and
+    DB_STATEMENT_TIMEOUT (milliseconds, Postgres only)
 """
 
 
-def setup_db(app, database_path=database_path):
+def config_value(config, name, type=int, default=None):
+    value = config.get(name, os.getenv(name))
+
+    if value is None or value == '':
+        return default
+
+    if type is bool:
+        return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+    return type(value)
+
+
+def engine_options(config, database_path):
+    # SQLite does not use a connection pool worth tuning
+    if database_path.startswith('sqlite'):
+        return {}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': config_value(config, 'DB_POOL_SIZE', default=5),
+        'max_overflow': config_value(config, 'DB_MAX_OVERFLOW', default=10),
+        'pool_timeout': config_value(config, 'DB_POOL_TIMEOUT', default=30),
+        'pool_recycle': config_value(config, 'DB_POOL_RECYCLE', default=-1),
+        'pool_pre_ping': config_value(config, 'DB_POOL_PRE_PING', bool, True),
+    }
+
+    statement_timeout = config_value(config, 'DB_STATEMENT_TIMEOUT')
+    if statement_timeout and database_path.startswith('postgres'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(statement_timeout)
+        }
+
+    return options
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long checkouts wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self.stats_lock:
+                self.checkouts += 1
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+
+
+"""
+pool_stats()
+    returns the state of the connection pool of the current app
+"""
+
+
+def pool_stats():
+    pool = db.engine.pool
+    stats = {'pool': type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+
+    if isinstance(pool, TimedQueuePool):
+        with pool.stats_lock:
+            stats.update({
+                'checkouts': pool.checkouts,
+                'total_wait_ms': round(pool.wait_time * 1000, 3),
+                'max_wait_ms': round(pool.max_wait_time * 1000, 3),
+            })
+
+    replicas = db.get_app().extensions.get('db_replicas')
+    if replicas is not None:
+        stats['replicas'] = replicas.stats()
+
+    return stats
+
+
+"""
+ReplicaSet(engines, check_interval)
+    hands out read replica engines round-robin. A replica is health checked
+    with SELECT 1 at most every check_interval seconds, and is left out of
+    the rotation while its last check (or a lost connection) failed
+"""
+
+
+class ReplicaSet:
+    def __init__(self, engines, check_interval=30):
+        self.engines = engines
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.position = 0
+        self.healthy = {engine: True for engine in engines}
+        self.checked_at = {engine: None for engine in engines}
+
+        for engine in engines:
+            event.listen(engine, 'handle_error', self.on_error)
+
+    def check(self, engine):
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except SQLAlchemyError as error:
+            logger.warning('Read replica %s failed its health check: %s',
+                           engine.url, error)
+            return False
+
+        return True
+
+    def choose(self):
+        """Returns the next healthy replica, or None if there is none"""
+        for _ in range(len(self.engines)):
+            with self.lock:
+                engine = self.engines[self.position % len(self.engines)]
+                self.position += 1
+                checked_at = self.checked_at[engine]
+                due = checked_at is None or \
+                    time.monotonic() - checked_at >= self.check_interval
+                if due:
+                    # Claim the check so concurrent requests do not repeat it
+                    self.checked_at[engine] = time.monotonic()
+
+            if due:
+                self.healthy[engine] = self.check(engine)
+            if self.healthy[engine]:
+                return engine
+
+        return None
+
+    def on_error(self, context):
+        # A failed connect has no connection, a dropped one is a disconnect
+        if context.connection is None or context.is_disconnect:
+            engine = context.engine
+            with self.lock:
+                self.healthy[engine] = False
+                self.checked_at[engine] = time.monotonic()
+
+    def stats(self):
+        return [{'url': engine.url.render_as_string(hide_password=True),
+                 'healthy': self.healthy[engine]}
+                for engine in self.engines]
+
+
+def replica_urls(config):
+    urls = config.get('DB_REPLICA_URLS', os.getenv('DB_REPLICA_URLS')) or []
+
+    if isinstance(urls, str):
+        urls = urls.split(',')
+
+    return [url.strip() for url in urls if url.strip()]
+
+
+"""
+RoutingSession
+    sends the SELECTs of requests marked read only (g.db_read_only) to a
+    read replica. Flushes and INSERT/UPDATE/DELETE statements always go to
+    the primary, and once a session has written, its reads follow it there
+"""
+
+
+class RoutingSession(SignallingSession):
+    wrote = False
+    replica = None
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or getattr(clause, 'is_dml', False):
+            self.wrote = True
+        elif getattr(clause, 'is_select', False) and not self.wrote and \
+                has_request_context() and g.get('db_read_only', False):
+            # Stay on one replica for the session, so the reads of a
+            # request (a page and its total) see the same data
+            if self.replica is None:
+                replicas = self.app.extensions.get('db_replicas')
+                self.replica = replicas.choose() \
+                    if replicas is not None else None
+            if self.replica is not None:
+                return self.replica
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+"""
+setup_db(app, database_path, replicas)
+    binds a flask application and a SQLAlchemy service. replicas is a list
+    of read replica urls, by default taken from DB_REPLICA_URLS (comma
+    separated). Nothing connects to the database here: the engines are
+    created on first use, and when DB_CREATE_ALL is set the schema is
+    created on the first request. Otherwise run `flask init-db`
+"""
+
+
+def setup_db(app, database_path=database_path, replicas=None):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS",
+                          engine_options(app.config, database_path))
     db.app = app
     db.init_app(app)
+
+    if replicas is None:
+        replicas = replica_urls(app.config)
+
+    app.extensions.pop('db_replicas', None)
+    if replicas:
+        app.extensions['db_replicas'] = ReplicaSet(
+            [create_engine(url, **engine_options(app.config, url))
+             for url in replicas],
+            check_interval=config_value(
+                app.config, 'DB_REPLICA_CHECK_INTERVAL', default=30))
+
+    if config_value(app.config, 'DB_CREATE_ALL', bool, False):
+        init_db_on_first_request(app)
+
+
+"""
+init_db_on_first_request(app)
+    runs init_db() once, before the first request the app serves, so that
+    starting a worker does not wait on the database
+"""
+
+
+def init_db_on_first_request(app):
+    if 'db_init' in app.extensions:
+        return
+
+    state = app.extensions['db_init'] = {'done': False,
+                                         'lock': threading.Lock()}
+
+    @app.before_request
+    def create_schema():
+        if state['done']:
+            return
+
+        with state['lock']:
+            if not state['done']:
+                init_db()
+                state['done'] = True
+
+
+"""
+init_db()
+    creates the tables and indexes that do not exist yet, and upgrades the
+    schema of an existing database
+"""
+
+
+def init_db():
     db.create_all()
+    upgrade_schema()
+    create_search_index()
+
+
+"""
+upgrade_schema()
+    brings a database restored from trivia.psql or created by an older
+    version of the models up to date: converts questions.category to an
+    integer, adds its foreign key to categories and creates the missing
+    indexes. Safe to run more than once
+"""
+
+
+def upgrade_schema():
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            upgrade_question_category(connection)
+
+        for index in Question.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+        if connection.dialect.name == 'postgresql':
+            # Refresh the planner statistics for the new column and indexes
+            connection.execute(text('ANALYZE questions'))
+
+    # Recount in case questions were written around the app
+    rebuild_question_stats()
+    db.session.commit()
+
+
+def upgrade_question_category(connection):
+    inspector = inspect(connection)
+    column = next(column for column in inspector.get_columns('questions')
+                  if column['name'] == 'category')
+
+    if not isinstance(column['type'], Integer):
+        connection.execute(text(
+            'ALTER TABLE questions ALTER COLUMN category TYPE integer '
+            'USING nullif(trim(category), \'\')::integer'))
+
+    foreign_keys = inspector.get_foreign_keys('questions')
+    if any(key['constrained_columns'] == ['category']
+           for key in foreign_keys):
+        return
+
+    # Questions pointing at a missing category would make the constraint
+    # fail, detach them like ON DELETE SET NULL would have
+    orphans = connection.execute(text(
+        'UPDATE questions SET category = NULL WHERE category IS NOT NULL '
+        'AND category NOT IN (SELECT id FROM categories)')).rowcount
+    if orphans:
+        logger.warning('Detached %d questions from unknown categories',
+                       orphans)
+
+    connection.execute(text(
+        'ALTER TABLE questions ADD CONSTRAINT category '
+        'FOREIGN KEY (category) REFERENCES categories (id) '
+        'ON UPDATE CASCADE ON DELETE SET NULL'))
+
+
+"""
+create_search_index()
+    creates a trigram index on the question text on Postgres, so searches
+    with ILIKE '%term%' do not need a sequential scan. Returns whether the
+    index is available
+"""
+
+
+def create_search_index():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            connection.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_questions_question_trgm '
+                'ON questions USING gin (question gin_trgm_ops)'))
+    except SQLAlchemyError as error:
+        logger.warning('Could not create the question search index: %s', error)
+        return False
+
+    return True
+
+
+"""
+on_question_change(listener)
+    registers a callable that is run as listener(action, question) after a
+    question change has been committed. action is one of 'insert', 'update',
+    'delete' or 'reload' (many questions changed at once, question is None)
+"""
+
+question_listeners = []
+
+
+def on_question_change(listener):
+    question_listeners.append(listener)
+    return listener
+
+
+def notify_question_change(action, question=None):
+    for listener in question_listeners:
+        listener(action, question)
+
+
+"""
+on_category_change(listener)
+    same as on_question_change, for categories
+"""
+
+category_listeners = []
+
+
+def on_category_change(listener):
+    category_listeners.append(listener)
+    return listener
+
+
+def notify_category_change(action, category=None):
+    for listener in category_listeners:
+        listener(action, category)
 
 
 """
@@ -38,11 +435,18 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # Serves both category lookups and keyset paging within a category
+        # (WHERE category = ? AND id > ? ORDER BY id)
+        Index('ix_questions_category_id', 'category', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey(
+        'categories.id', name='category', onupdate='CASCADE',
+        ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -53,14 +457,26 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        adjust_question_stats({
+            question_stats_key(self.category, self.difficulty): 1})
         db.session.commit()
+        notify_question_change('insert', self)
 
     def update(self):
+        old_key = question_stats_key(committed_value(self, 'category'),
+                                     committed_value(self, 'difficulty'))
+        new_key = question_stats_key(self.category, self.difficulty)
+        if old_key != new_key:
+            adjust_question_stats({old_key: -1, new_key: 1})
         db.session.commit()
+        notify_question_change('update', self)
 
     def delete(self):
         db.session.delete(self)
+        adjust_question_stats({
+            question_stats_key(self.category, self.difficulty): -1})
         db.session.commit()
+        notify_question_change('delete', self)
 
     def format(self):
         return {
@@ -72,6 +488,30 @@ class Question(db.Model):
         }
 
 
+"""
+QUESTION_COLUMNS / format_question_row(row)
+    the columns returned by Question.format(), for queries that only need
+    the values and not full Question objects, and the formatter for the
+    resulting rows. The keys are built in sorted order, the order in which
+    they are serialized
+"""
+
+QUESTION_COLUMNS = (Question.id, Question.question, Question.answer,
+                    Question.category, Question.difficulty)
+
+
+def format_question_row(row):
+    question_id, question, answer, category, difficulty = row
+
+    return {
+        'answer': answer,
+        'category': category,
+        'difficulty': difficulty,
+        'id': question_id,
+        'question': question
+    }
+
+
 """
 Category
 
@@ -87,8 +527,127 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        notify_category_change('insert', self)
+
+    def update(self):
+        db.session.commit()
+        notify_category_change('update', self)
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.flush()
+        # Its questions lost their category (ON DELETE SET NULL)
+        rebuild_question_stats()
+        db.session.commit()
+        notify_category_change('delete', self)
+
     def format(self):
         return {
             'id': self.id,
             'type': self.type
         }
+
+
+"""
+QuestionStat
+    the number of questions per category and difficulty, kept up to date
+    in the same transaction as the question writes so listings and
+    GET /categories/stats never count rows. Questions without a category
+    or difficulty are counted under 0
+"""
+
+
+class QuestionStat(db.Model):
+    __tablename__ = 'question_stats'
+
+    category = Column(Integer, primary_key=True, autoincrement=False)
+    difficulty = Column(Integer, primary_key=True, autoincrement=False)
+    count = Column(Integer, nullable=False, default=0)
+
+
+def question_stats_key(category, difficulty):
+    return (int(category) if category not in (None, '') else 0,
+            int(difficulty) if difficulty not in (None, '') else 0)
+
+
+def committed_value(instance, name):
+    # The value of an attribute before its pending change, if any
+    history = inspect(instance).attrs[name].history
+
+    return history.deleted[0] if history.deleted else getattr(instance, name)
+
+
+"""
+adjust_question_stats(deltas)
+    adds {(category, difficulty): delta} to the question counts within the
+    current session transaction. The counts are changed with a single
+    upsert per key, so concurrent writers do not lose updates
+"""
+
+# Dialects with INSERT ... ON CONFLICT. Their insert() is looked up when
+# needed, so that importing the models does not load both dialects
+UPSERT_DIALECTS = ('postgresql', 'sqlite')
+
+
+def adjust_question_stats(deltas):
+    table = QuestionStat.__table__
+    dialect = db.engine.dialect.name
+    upsert = importlib.import_module('sqlalchemy.dialects.' + dialect).insert \
+        if dialect in UPSERT_DIALECTS else None
+
+    for (category, difficulty), delta in sorted(deltas.items()):
+        if delta == 0:
+            continue
+
+        if upsert is not None:
+            statement = upsert(table).values(
+                category=category, difficulty=difficulty, count=delta)
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=[table.c.category, table.c.difficulty],
+                set_={'count': table.c.count + delta}))
+            continue
+
+        updated = db.session.execute(table.update().where(
+            table.c.category == category,
+            table.c.difficulty == difficulty
+        ).values(count=table.c.count + delta)).rowcount
+        if not updated:
+            db.session.execute(table.insert().values(
+                category=category, difficulty=difficulty, count=delta))
+
+
+"""
+rebuild_question_stats()
+    recounts every question within the current session transaction
+"""
+
+
+def rebuild_question_stats():
+    table = QuestionStat.__table__
+    category = func.coalesce(Question.category, 0)
+    difficulty = func.coalesce(Question.difficulty, 0)
+
+    db.session.execute(table.delete())
+    db.session.execute(table.insert().from_select(
+        ['category', 'difficulty', 'count'],
+        select(category, difficulty, func.count())
+        .group_by(category, difficulty)))
+
+
+"""
+question_total(category_id)
+    the statement selecting the number of questions, in one category or
+    in all of them, from the maintained counts
+"""
+
+
+def question_total(category_id=None):
+    selection = select(func.coalesce(func.sum(QuestionStat.count), 0))
+
+    if category_id is not None:
+        selection = selection.where(QuestionStat.category == category_id)
+
+    return selection
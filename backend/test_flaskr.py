@@ -1,18 +1,60 @@
 import os
+import asyncio
+import gzip
+import tempfile
+import threading
+import importlib.util
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import http.client
+from unittest import mock
+from flask import jsonify
+from sqlalchemy import create_engine, event, func, insert, select
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import upgrade_schema, rebuild_question_stats, db, \
+    Question, Category, QUESTION_COLUMNS
+from flaskr.sessions import KeyValueSessionStore, InMemoryKeyValue
+from flaskr.serialize import json_response
+from flaskr.compress import brotli
+from flaskr.cache import PageCache
+from flaskr.bulk import import_questions
+from flaskr.store import get_question_store, QuestionStore, QuestionRow
+from flaskr.jobs import get_job_queue
+from flaskr.writes import get_write_coalescer
+from flaskr.asgi import create_asgi_app
 
+from werkzeug.serving import make_server
 from dotenv import load_dotenv
 load_dotenv()
 
 
+def get_database_path():
+    return 'postgresql://{}:{}@{}/{}'.format(
+        os.getenv('DB_USER'), os.getenv('DB_PASSWORD'),
+        os.getenv('DB_HOST'), os.getenv('DB_TEST_NAME'))
+
+
+def create_test_schema():
+    """
+    Creates the tables trivia.psql does not have, and the question counts
+    of the fixture questions
+    """
+    app = create_app({'SQLALCHEMY_DATABASE_URI': get_database_path()})
+    with app.app_context():
+        db.create_all()
+        rebuild_question_stats()
+        db.session.commit()
+        db.engine.dispose()
+
+
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    @classmethod
+    def setUpClass(cls):
+        create_test_schema()
+
     def setUp(self):
         """Define test variables and initialize app."""
 
@@ -21,19 +63,10 @@ class TriviaTestCase(unittest.TestCase):
         self.DB_PASSWORD = os.getenv('DB_PASSWORD')
         self.DB_TEST_NAME = os.getenv('DB_TEST_NAME')
 
-        self.app = create_app()
-        self.client = self.app.test_client
         self.database_name = self.DB_TEST_NAME
-        self.database_path = 'postgresql://{}:{}@{}/{}'.format(
-            self.DB_USER, self.DB_PASSWORD, self.DB_HOST, self.DB_TEST_NAME)
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+        self.database_path = get_database_path()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+        self.client = self.app.test_client
 
         self.new_question = {
             "answer": "Gen. Muhammad Buhari",
@@ -60,7 +93,9 @@ class TriviaTestCase(unittest.TestCase):
 
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        # close the connections of this test's app
+        with self.app.app_context():
+            db.engine.dispose()
 
     """
     TODO
@@ -74,6 +109,32 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['categories'])
 
+    def test_get_categories_not_modified(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+
+        res = self.client().get('/categories',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers['ETag'], etag)
+        self.assertEqual(res.data, b'')
+
+    def test_get_categories_after_category_change(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+
+        with self.app.app_context():
+            Category('Music').insert()
+
+        res = self.client().get('/categories',
+                                headers={'If-None-Match': etag})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertIn('Music', data['categories'].values())
+
     def test_404_get_categories(self):
         res = self.client().get('/categories/1')
         data = json.loads(res.data)
@@ -91,6 +152,47 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertTrue(data['categories'])
 
+    def test_get_questions_not_modified(self):
+        res = self.client().get('/questions')
+        etag = res.headers['ETag']
+
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_get_questions_matches_orm_serialization(self):
+        res = self.client().get('/questions?page=2')
+
+        with self.app.test_request_context():
+            questions = Question.query.order_by(Question.id) \
+                .offset(10).limit(10).all()
+            expected = jsonify({
+                'questions': [question.format() for question in questions],
+                'total_questions': Question.query.count(),
+                'categories': {category.id: category.type
+                               for category in Category.query.all()},
+            })
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, expected.data)
+
+    def test_json_response_matches_jsonify(self):
+        payload = {
+            'question': {'b': 'caf\u00e9 \u2013 \U0001f600 \x7f',
+                         'a': None},
+            'categories': {10: 'Music', 2: 'Art', 1: 'Science'},
+            'total_questions': 3,
+            'status': True
+        }
+
+        with self.app.test_request_context():
+            self.assertEqual(json_response(payload).data,
+                             jsonify(payload).data)
+            # DEL is ASCII, but escaped all the same
+            self.assertEqual(json_response({'answer': 'a\x7fb'}).data,
+                             jsonify({'answer': 'a\x7fb'}).data)
+
     def test_404_get_beyond_valid_pages(self):
         res = self.client().get('/questions?page=1000')
         data = json.loads(res.data)
@@ -99,6 +201,205 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['status'], False)
         self.assertEqual(data['message'], 'Not found')
 
+    def test_get_questions_with_fields(self):
+        res = self.client().get('/questions?fields=question,difficulty')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(set(data['questions'][0]),
+                         {'id', 'question', 'difficulty'})
+        self.assertNotIn('categories', data)
+        self.assertTrue(data['total_questions'])
+
+    def test_get_questions_with_fields_and_categories(self):
+        res = self.client().get('/questions?fields=question,categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(set(data['questions'][0]), {'id', 'question'})
+        self.assertTrue(data['categories'])
+
+    def test_get_questions_without_known_categories(self):
+        etag = self.client().get('/categories').headers['ETag'].strip('"')
+
+        res = self.client().get('/questions?categories_etag=' + etag)
+        self.assertNotIn('categories', json.loads(res.data))
+
+        res = self.client().get('/questions?categories_etag=outdated')
+        self.assertIn('categories', json.loads(res.data))
+
+    def test_400_get_questions_with_unknown_field(self):
+        res = self.client().get('/questions?fields=question,secret')
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_search_and_category_listings_with_fields(self):
+        res = self.client().post('/questions/search?fields=question',
+                                 json={'searchTerm': 'title'})
+        self.assertEqual(set(json.loads(res.data)['questions'][0]),
+                         {'id', 'question'})
+
+        res = self.client().get('/categories/1/questions?fields=answer')
+        self.assertEqual(set(json.loads(res.data)['questions'][0]),
+                         {'id', 'answer'})
+
+    def test_get_questions_compressed_with_gzip(self):
+        plain = self.client().get('/questions')
+        res = self.client().get('/questions',
+                                headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertLess(len(res.data), len(plain.data))
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+
+    @unittest.skipUnless(brotli, 'brotli is not installed')
+    def test_get_questions_compressed_with_brotli(self):
+        plain = self.client().get('/questions')
+        res = self.client().get('/questions',
+                                headers={'Accept-Encoding': 'gzip, br'})
+
+        self.assertEqual(res.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(res.data), plain.data)
+
+    def test_compressed_questions_not_modified(self):
+        res = self.client().get('/questions',
+                                headers={'Accept-Encoding': 'gzip'})
+        etag = res.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        res = self.client().get('/questions', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_small_responses_are_not_compressed(self):
+        res = self.client().get('/categories',
+                                headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('Content-Encoding', res.headers)
+
+    def cache_stats(self, client):
+        return json.loads(client.get('/stats/cache').data)
+
+    def test_question_pages_are_cached(self):
+        client = self.client()
+        first = client.get('/questions?page=2')
+        second = client.get('/questions?page=2')
+
+        self.assertEqual(first.data, second.data)
+        stats = self.cache_stats(client)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['local_hits'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertEqual(stats['bytes'], len(first.data))
+
+    def test_adding_a_question_invalidates_its_pages_only(self):
+        client = self.client()
+        total = json.loads(client.get('/questions').data)['total_questions']
+        client.get('/categories/4/questions')
+        client.get('/categories/1/questions')
+
+        # Posted from another client, that the primary cookie keeps off
+        # the cache
+        self.client().post('/questions', json=self.new_question)
+
+        data = json.loads(client.get('/questions').data)
+        self.assertEqual(data['total_questions'], total + 1)
+        data = json.loads(client.get('/categories/4/questions').data)
+        self.assertIn(self.new_question['question'],
+                      [question['question'] for question in data['questions']])
+
+        client.get('/categories/1/questions')
+        stats = self.cache_stats(client)
+        self.assertEqual(stats['local_hits'], 1)
+        self.assertEqual(stats['misses'], 5)
+
+    def test_deleting_a_question_invalidates_its_pages(self):
+        client = self.client()
+        data = json.loads(client.get('/categories/1/questions').data)
+        question_id = data['questions'][0]['id']
+
+        client.delete('/questions/{}'.format(question_id))
+
+        data = json.loads(client.get('/categories/1/questions').data)
+        self.assertNotIn(question_id,
+                         [question['id'] for question in data['questions']])
+
+    def test_writes_skip_the_page_cache_of_every_worker(self):
+        config = {'SQLALCHEMY_DATABASE_URI': self.database_path}
+        writer, other = create_app(config), create_app(config)
+        client = other.test_client()
+        total = json.loads(client.get('/questions').data)['total_questions']
+
+        # The write lands on another worker, whose cache is not invalidated
+        res = writer.test_client().post('/questions', json=self.new_question)
+        self.assertIn('trivia_primary=', res.headers['Set-Cookie'])
+        client.set_cookie('localhost', 'trivia_primary', '1')
+        data = json.loads(client.get('/questions').data)
+
+        self.assertEqual(data['total_questions'], total + 1)
+
+    def test_no_primary_cookie_with_a_shared_page_cache(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'PAGE_CACHE_BACKEND': InMemoryKeyValue()})
+        res = app.test_client().post('/questions', json=self.new_question)
+
+        self.assertNotIn('Set-Cookie', res.headers)
+
+    def test_question_pages_in_shared_cache(self):
+        backend = InMemoryKeyValue()
+        config = {'SQLALCHEMY_DATABASE_URI': self.database_path,
+                  'PAGE_CACHE_BACKEND': backend}
+        first, second = create_app(config), create_app(config)
+
+        page = first.test_client().get('/questions')
+        self.assertEqual(second.test_client().get('/questions').data,
+                         page.data)
+        self.assertEqual(self.cache_stats(second.test_client())['shared_hits'], 1)
+
+        # A write through one worker invalidates the pages of the others
+        second.test_client().post('/questions', json=self.new_question)
+        data = json.loads(first.test_client().get('/questions').data)
+
+        self.assertEqual(data['total_questions'],
+                         json.loads(page.data)['total_questions'] + 1)
+
+    def test_page_cache_evicts_least_recently_used(self):
+        cache = PageCache(max_bytes=10)
+        for page in ('1', '2', '1', '3'):
+            cache.get('questions', page, lambda: b'abcd')
+
+        stats = cache.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(cache.get('questions', '1', lambda: None), b'abcd')
+        self.assertIsNone(cache.get('questions', '2', lambda: None))
+
+    def test_page_cache_turned_off(self):
+        self.app.config['PAGE_CACHE_MAX_BYTES'] = 0
+
+        self.assertEqual(self.client().get('/questions').status_code, 200)
+        self.assertEqual(self.cache_stats(self.client()), {'enabled': False})
+
+    def test_get_questions_after_id(self):
+        res = self.client().get('/questions?after_id=10')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(len(data['questions']))
+        self.assertTrue(all(q['id'] > 10 for q in data['questions']))
+        self.assertEqual(data['total_questions'],
+                         Question.query.count())
+
+    def test_404_get_questions_after_last_id(self):
+        res = self.client().get('/questions?after_id=100000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['status'], False)
+        self.assertEqual(data['message'], 'Not found')
+
     def test_delete_question(self):
         res = self.client().delete('/questions/24')
         data = json.loads(res.data)
@@ -112,6 +413,145 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['question_id'], 24)
         self.assertEqual(question, None)
 
+    def get_category_stats(self):
+        res = self.client().get('/categories/stats')
+        self.assertEqual(res.status_code, 200)
+
+        return json.loads(res.data)
+
+    def reset_question_stats(self):
+        """Recounts the questions after a test that changed them in bulk"""
+        with self.app.app_context():
+            rebuild_question_stats()
+            db.session.commit()
+
+    def run_job(self, res):
+        """Waits for the job queued by the response and returns its status"""
+        self.assertEqual(res.status_code, 202)
+        job_id = json.loads(res.data)['job']['id']
+        self.assertEqual(res.headers['Location'], '/jobs/' + job_id)
+        self.assertTrue(self.app.extensions['job_queue'].get(job_id).wait(5))
+
+        res = self.client().get('/jobs/' + job_id)
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data)
+
+    def test_delete_questions_by_category(self):
+        self.addCleanup(self.reset_question_stats)
+        self.app.config.update(JOB_BATCH_SIZE=2, JOB_BATCH_PAUSE_MS=0)
+        self.assertEqual(
+            self.client().get('/categories/1/questions').status_code, 200)
+        self.client().post('/quizzes', json=self.valid_quiz_data)
+
+        job = self.run_job(self.client().delete('/categories/1/questions'))
+
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['kind'], 'delete_category_questions')
+        self.assertEqual(job['progress'], {'done': 3, 'total': 3})
+        self.assertEqual(job['result'], {'deleted': 3})
+        with self.app.app_context():
+            self.assertEqual(Question.query.filter_by(category=1).count(), 0)
+
+        # The cached page, the counts and the quiz index follow
+        self.assertEqual(
+            self.client().get('/categories/1/questions').status_code, 404)
+        self.assertEqual(self.get_category_stats()['categories']['1']
+                         ['total_questions'], 0)
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': 1, 'type': 'Science'}})
+        self.assertEqual(json.loads(res.data)['status'], False)
+
+    def test_400_delete_questions_of_unknown_category(self):
+        res = self.client().delete('/categories/200/questions')
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_maintenance_jobs(self):
+        self.client().post('/quizzes', json=self.valid_quiz_data)
+
+        job = self.run_job(self.client().post('/jobs',
+                                              json={'kind': 'reindex'}))
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['result'], {'rebuilt': ['quiz_index']})
+
+        job = self.run_job(self.client().post('/jobs',
+                                              json={'kind': 'recount'}))
+        with self.app.app_context():
+            self.assertEqual(job['result'],
+                             {'total_questions': Question.query.count()})
+
+    def test_jobs_wait_for_a_free_worker(self):
+        release = threading.Event()
+        with self.app.app_context():
+            jobs = get_job_queue()
+            first = jobs.submit('test', lambda job: release.wait(5))
+            second = jobs.submit('test', lambda job: 'done')
+
+        self.assertEqual(second.status, 'queued')
+        release.set()
+        self.assertTrue(second.wait(5))
+        self.assertEqual((first.status, second.result), ('succeeded', 'done'))
+
+    def test_400_create_job_of_unknown_kind(self):
+        res = self.client().post('/jobs', json={'kind': 'rm -rf'})
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_404_unknown_job(self):
+        res = self.client().get('/jobs/unknown')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_get_category_stats(self):
+        data = self.get_category_stats()
+
+        with self.app.app_context():
+            total_questions = Question.query.count()
+            science_questions = Question.query.filter_by(category=1).count()
+
+        self.assertEqual(data['total_questions'], total_questions)
+        self.assertEqual(sum(data['difficulties'].values()), total_questions)
+        self.assertEqual(data['categories']['1']['type'], 'Science')
+        self.assertEqual(data['categories']['1']['total_questions'],
+                         science_questions)
+
+    def test_category_stats_follow_question_changes(self):
+        before = self.get_category_stats()['categories']['4']
+
+        self.client().post('/questions', json=self.new_question)
+        after_insert = self.get_category_stats()['categories']['4']
+
+        with self.app.app_context():
+            question = Question.query.order_by(Question.id.desc()).first()
+            question.difficulty = 5
+            question.update()
+        after_update = self.get_category_stats()['categories']['4']
+
+        with self.app.app_context():
+            question = Question.query.order_by(Question.id.desc()).first()
+            question.delete()
+        after_delete = self.get_category_stats()['categories']['4']
+
+        self.assertEqual(after_insert['total_questions'],
+                         before['total_questions'] + 1)
+        self.assertEqual(after_insert['difficulties']['1'],
+                         before['difficulties'].get('1', 0) + 1)
+        self.assertEqual(after_update['difficulties']['5'],
+                         before['difficulties'].get('5', 0) + 1)
+        self.assertEqual(after_delete, before)
+
+    def test_listing_totals_come_from_category_stats(self):
+        stats = self.get_category_stats()
+
+        res = self.client().get('/questions')
+        self.assertEqual(json.loads(res.data)['total_questions'],
+                         stats['total_questions'])
+
+        res = self.client().get('/categories/1/questions')
+        self.assertEqual(json.loads(res.data)['total_questions'],
+                         stats['categories']['1']['total_questions'])
+
     def test_404_delete_an_invalid_question(self):
         res = self.client().delete('/books/1000')
         data = json.loads(res.data)
@@ -127,6 +567,220 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 201)
         self.assertEqual(data['status'], True)
         self.assertEqual(data['message'], 'Question added successfully.')
+        self.assertEqual(Question.query.get(data['question_id']).question,
+                         self.new_question['question'])
+
+    def count_new_questions(self):
+        return Question.query.filter_by(
+            question=self.new_question['question']).count()
+
+    def test_add_question_with_idempotency_key(self):
+        count = self.count_new_questions()
+        headers = {'Idempotency-Key': 'add-question-1'}
+        first = self.client().post('/questions', json=self.new_question,
+                                   headers=headers)
+        retry = self.client().post('/questions', json=self.new_question,
+                                   headers=headers)
+
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.count_new_questions(), count + 1)
+
+    def test_422_idempotency_key_reused_with_another_body(self):
+        count = self.count_new_questions()
+        headers = {'Idempotency-Key': 'add-question-2'}
+        self.client().post('/questions', json=self.new_question,
+                           headers=headers)
+        res = self.client().post('/questions', headers=headers,
+                                 json={**self.new_question, 'difficulty': 2})
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(self.count_new_questions(), count + 1)
+
+    def test_concurrent_questions_are_committed_together(self):
+        self.app.config['WRITE_BATCH_WINDOW_MS'] = 100
+        count = self.count_new_questions()
+        responses = []
+
+        def post():
+            responses.append(self.app.test_client().post(
+                '/questions', json=self.new_question))
+
+        threads = [threading.Thread(target=post) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        question_ids = {json.loads(res.data)['question_id']
+                        for res in responses}
+        self.assertEqual([res.status_code for res in responses], [201] * 5)
+        self.assertEqual(len(question_ids), 5)
+        self.assertEqual(self.count_new_questions(), count + 5)
+        coalescer = self.app.extensions['write_coalescer']
+        self.assertEqual(coalescer.writes, 5)
+        self.assertLess(coalescer.batches, 5)
+
+    def test_bad_question_does_not_fail_its_batch(self):
+        self.app.config['WRITE_BATCH_WINDOW_MS'] = 100
+        count = self.count_new_questions()
+        results = {}
+
+        def insert(difficulty):
+            with self.app.app_context():
+                try:
+                    results[difficulty] = get_write_coalescer().insert(
+                        Question(**{**self.new_question,
+                                    'difficulty': difficulty}))
+                except Exception as error:
+                    results[difficulty] = error
+
+        threads = [threading.Thread(target=insert, args=(difficulty,))
+                   for difficulty in (1, 2, 'hard', 3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIsInstance(results.pop('hard'), ValueError)
+        self.assertTrue(all(isinstance(question_id, int)
+                            for question_id in results.values()))
+        self.assertEqual(self.count_new_questions(), count + 3)
+
+    def test_400_add_question_with_invalid_category(self):
+        res = self.client().post('/questions',
+                                 json={**self.new_question, 'category': 'abc'})
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(json.loads(res.data)['message'], 'Bad request')
+
+    def test_400_add_question_with_unknown_category(self):
+        count = self.count_new_questions()
+        res = self.client().post('/questions',
+                                 json={**self.new_question, 'category': 1000})
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(json.loads(res.data)['message'],
+                         'Unknown category selected')
+        self.assertEqual(self.count_new_questions(), count)
+
+    def test_429_writes_over_the_rate_limit(self):
+        self.app.config.update(WRITE_RATE_LIMIT=1, WRITE_RATE_BURST=2)
+        client = self.client()
+
+        for _ in range(2):
+            self.assertEqual(client.delete('/questions/10000').status_code,
+                             404)
+        res = client.delete('/questions/10000')
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertEqual(json.loads(res.data)['message'], 'Too many requests')
+
+    def test_bulk_add_questions_from_json_lines(self):
+        self.addCleanup(self.reset_question_stats)
+        lines = [
+            json.dumps(self.new_question),
+            json.dumps({**self.new_question, 'difficulty': 9}),
+            'not json',
+            json.dumps({**self.new_question, 'category': 2}),
+        ]
+        res = self.client().post('/questions/bulk', data='\n'.join(lines),
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['status'], False)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['error_count'], 2)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+
+    def test_bulk_add_questions_from_csv(self):
+        self.addCleanup(self.reset_question_stats)
+        body = 'question,answer,difficulty,category\n' \
+            'What is 2 + 2?,4,1,1\n' \
+            'What is the capital of France?,Paris,1,3\n'
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['status'], True)
+        self.assertEqual(data['inserted'], 2)
+
+    def test_bulk_add_questions_updates_category_stats(self):
+        self.addCleanup(self.reset_question_stats)
+        before = self.get_category_stats()['categories']['4']
+        body = '\n'.join(json.dumps(self.new_question) for _ in range(3))
+
+        self.client().post('/questions/bulk', data=body,
+                           content_type='application/x-ndjson')
+        after = self.get_category_stats()['categories']['4']
+
+        self.assertEqual(after['total_questions'],
+                         before['total_questions'] + 3)
+
+    def test_bulk_add_questions_with_undecodable_rows(self):
+        self.addCleanup(self.reset_question_stats)
+        line = json.dumps(self.new_question).encode('utf-8')
+        res = self.client().post('/questions/bulk',
+                                 data=line + b'\n\xff\xfe\n' + line,
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['errors'], [{'line': 2,
+                                           'message': 'Invalid row'}])
+
+        body = b'question,answer,difficulty,category\n' \
+            b'"' + b'x' * 200000 + b'",Long,1,1\n' \
+            b'What is 2 + 2?,4,1,1\n' \
+            b'What is 3 + 3?,\xff,1,1\n'
+        res = self.client().post('/questions/bulk', data=body,
+                                 content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 4])
+
+    def test_bulk_add_questions_reloads_after_a_failed_import(self):
+        self.addCleanup(self.reset_question_stats)
+        client = self.client()
+        total = json.loads(client.get('/questions').data)['total_questions']
+
+        def rows():
+            yield 1, self.new_question
+            raise IOError('client went away')
+
+        with self.app.app_context():
+            with self.assertRaises(IOError):
+                import_questions(rows(), {4: 'Geography'}, batch_size=1)
+
+        data = json.loads(client.get('/questions').data)
+        self.assertEqual(data['total_questions'], total + 1)
+
+    def test_400_bulk_add_questions_with_no_valid_rows(self):
+        res = self.client().post('/questions/bulk',
+                                 data=json.dumps({'question': 'Why?'}),
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['inserted'], 0)
+        self.assertEqual(data['error_count'], 1)
+
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        questions = [json.loads(line) for line in res.data.splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(questions), Question.query.count())
+        self.assertEqual(set(questions[0].keys()),
+                         {'id', 'question', 'answer', 'category', 'difficulty'})
 
     def test_400_add_question_with_no_data(self):
         res = self.client().post('/questions')
@@ -162,6 +816,186 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(len(data['questions']), 0)
         self.assertEqual(data['total_questions'], 0)
 
+    def test_search_for_question_with_index(self):
+        self.app.config['SEARCH_MODE'] = 'index'
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([q['id'] for q in data['questions']], [6, 5])
+        self.assertEqual(data['total_questions'], 2)
+
+    def test_search_index_picks_up_new_question(self):
+        self.app.config['SEARCH_MODE'] = 'index'
+        self.client().post('/questions/search', json={'searchTerm': 'title'})
+        self.client().post('/questions', json={
+            **self.new_question, 'question': 'Which title is the longest?'})
+
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], 3)
+
+    def test_search_for_question_second_page(self):
+        res = self.client().post('/questions/search?page=2',
+                                 json={'searchTerm': 'a'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['total_questions'] > 10)
+        self.assertEqual(len(data['questions']),
+                         min(data['total_questions'] - 10, 10))
+
+    def create_app_with_store(self, **config):
+        return create_app(dict(config, QUESTION_STORE=True,
+                               PAGE_CACHE_MAX_BYTES=0,
+                               SQLALCHEMY_DATABASE_URI=self.database_path))
+
+    def assert_same_reads(self, client):
+        """Checks the reads of client against a fresh app on the database"""
+        expected = create_app({
+            'SQLALCHEMY_DATABASE_URI': self.database_path,
+            'SEARCH_MODE': 'index', 'PAGE_CACHE_MAX_BYTES': 0}).test_client()
+
+        for url in ('/questions', '/questions?page=2', '/questions?after_id=12',
+                    '/questions?page=100', '/categories/1/questions',
+                    '/categories/4/questions?fields=question'):
+            res = client.get(url)
+            self.assertEqual(res.status_code, expected.get(url).status_code)
+            self.assertEqual(res.data, expected.get(url).data, url)
+
+        for term in ('title', 'a', 'zzz'):
+            self.assertEqual(
+                client.post('/questions/search', json={'searchTerm': term})
+                .data,
+                expected.post('/questions/search', json={'searchTerm': term})
+                .data)
+
+    def test_question_store_serves_the_same_reads(self):
+        self.assert_same_reads(self.create_app_with_store().test_client())
+
+    def test_question_store_reads_without_queries(self):
+        app = self.create_app_with_store()
+        client = app.test_client()
+        client.get('/categories/1/questions')
+        client.post('/quizzes', json=self.valid_quiz_data)
+
+        queries = []
+
+        def record(connection, cursor, statement, *args):
+            queries.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, engine, 'before_cursor_execute', record)
+
+        for url in ('/questions?page=2', '/categories/1/questions'):
+            self.assertEqual(client.get(url).status_code, 200)
+        client.post('/questions/search', json={'searchTerm': 'title'})
+        client.post('/quizzes', json=self.valid_quiz_data)
+
+        self.assertEqual(queries, [])
+
+    def test_question_store_applies_changes(self):
+        client = self.create_app_with_store().test_client()
+        total = json.loads(client.get('/questions').data)['total_questions']
+
+        res = client.post('/questions', json={
+            **self.new_question, 'question': 'Which title is the longest?'})
+        question_id = json.loads(res.data)['question_id']
+        client.delete('/questions/2')
+
+        data = json.loads(client.get('/categories/4/questions').data)
+        self.assertIn(question_id, [q['id'] for q in data['questions']])
+        data = json.loads(client.post('/questions/search',
+                                      json={'searchTerm': 'title'}).data)
+        self.assertIn(question_id, [q['id'] for q in data['questions']])
+        data = json.loads(client.get('/questions').data)
+        self.assertEqual(data['total_questions'], total)
+        self.assertNotIn(2, [q['id'] for q in data['questions']])
+
+    def test_question_store_rejects_values_it_cannot_hold(self):
+        store = QuestionStore.from_rows([
+            QuestionRow(1, 'First?', 'One', 1, 200),
+            QuestionRow(3, 'Third?', 'Three', 2, 1)])
+
+        with self.assertRaises(OverflowError):
+            store.add(2, 'Second?', 'Two', 1, 2 ** 64)
+
+        self.assertEqual(store.count(), 2)
+        self.assertEqual([row.difficulty for row in store.page()], [200, 1])
+        store.add(2, 'Second?', 'Two', 1, 2)
+        self.assertEqual([row.id for row in store.page()], [1, 2, 3])
+
+    def test_400_add_question_with_difficulty_out_of_range(self):
+        client = self.create_app_with_store().test_client()
+        client.get('/questions')
+
+        for difficulty in (0, 6, 200):
+            res = client.post('/questions', json={**self.new_question,
+                                                  'difficulty': difficulty})
+            self.assertEqual(res.status_code, 400)
+        self.assertEqual(client.get('/questions').status_code, 200)
+
+    def test_question_store_is_reloaded_behind_readers(self):
+        app = self.create_app_with_store(QUESTION_STORE_TTL=0)
+        app.test_client().get('/questions')
+        old_store = app.extensions['question_bank'].store
+        building, resume = threading.Event(), threading.Event()
+
+        def pause(connection, cursor, statement, *args):
+            if threading.current_thread().name == 'reload':
+                building.set()
+                resume.wait(5)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', pause)
+        self.addCleanup(event.remove, engine, 'before_cursor_execute', pause)
+
+        def reload():
+            with app.app_context():
+                get_question_store()
+
+        thread = threading.Thread(target=reload, name='reload')
+        thread.start()
+        self.assertTrue(building.wait(5))
+
+        # Requests keep using the old store while the new one is built
+        res = app.test_client().post('/questions', json=self.new_question)
+        question_id = json.loads(res.data)['question_id']
+        with app.app_context():
+            self.assertIs(get_question_store(), old_store)
+        resume.set()
+        thread.join()
+
+        store = app.extensions['question_bank'].store
+        self.assertIsNot(store, old_store)
+        self.assertEqual(store.get(question_id).question,
+                         self.new_question['question'])
+
+    def test_question_store_from_snapshot(self):
+        path = os.path.join(tempfile.mkdtemp(), 'questions.snapshot')
+        result = self.app.test_cli_runner().invoke(
+            args=['snapshot-questions', path])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        app = self.create_app_with_store(QUESTION_STORE_SNAPSHOT=path,
+                                         QUESTION_STORE_CHECK_INTERVAL=0)
+        self.assertTrue(app.extensions['question_bank'].store.mapping)
+        self.assert_same_reads(app.test_client())
+
+        # Questions added by other workers show up with the next snapshot
+        app.test_client().delete('/questions/2')
+        self.client().post('/questions', json=self.new_question)
+        self.app.test_cli_runner().invoke(args=['snapshot-questions', path])
+
+        self.assert_same_reads(app.test_client())
+
     def test_search_for_question_with_no_search_term(self):
         res = self.client().post('/questions/search', json={'searchTerm': ''})
         data = json.loads(res.data)
@@ -206,6 +1040,60 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['status'], False)
         self.assertEqual(data['message'], 'Not found')
 
+    def read_stream(self, method, url, body=None):
+        """Follows the next cursors of a streamed listing to its end"""
+        pages = []
+        after_id = 0
+        while after_id is not None:
+            res = self.client().open('{}&after_id={}'.format(url, after_id),
+                                     method=method, json=body)
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(res.is_streamed)
+            pages.append(json.loads(res.data))
+            after_id = pages[-1]['next']
+
+        return pages
+
+    def test_stream_questions_by_category(self):
+        pages = self.read_stream(
+            'GET', '/categories/1/questions?stream=true&per_page=2')
+
+        self.assertEqual([len(page['questions']) for page in pages], [2, 1])
+        self.assertEqual(pages[0]['next'], pages[0]['questions'][-1]['id'])
+        self.assertEqual(pages[0]['current_category'], 'Science')
+        self.assertEqual(pages[0]['total_questions'], 3)
+        self.assertEqual(
+            [q['id'] for page in pages for q in page['questions']],
+            [q.id for q in Question.query.filter(Question.category == 1)
+             .order_by(Question.id)])
+
+    def test_stream_search_results(self):
+        pages = self.read_stream('POST',
+                                 '/questions/search?stream=true&per_page=1',
+                                 {'searchTerm': 'title'})
+        res = self.client().post('/questions/search',
+                                 json={'searchTerm': 'title'})
+
+        self.assertEqual(
+            [q['id'] for page in pages for q in page['questions']],
+            sorted(q['id'] for q in json.loads(res.data)['questions']))
+        self.assertEqual(pages[-1]['next'], None)
+
+    def test_streamed_page_size_is_capped(self):
+        self.app.config['STREAM_MAX_PAGE_SIZE'] = 1
+        res = self.client().get(
+            '/categories/1/questions?stream=true&per_page=50&fields=id')
+        data = json.loads(res.data)
+
+        self.assertEqual(data['questions'], [{'id': 20}])
+        self.assertEqual(data['next'], 20)
+
+    def test_400_stream_with_invalid_page_size(self):
+        res = self.client().get(
+            '/categories/1/questions?stream=true&per_page=0')
+
+        self.assertEqual(res.status_code, 400)
+
     def test_get_quiz_question(self):
         res = self.client().post('/quizzes', json=self.valid_quiz_data)
         data = json.loads(res.data)
@@ -213,6 +1101,40 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertTrue(data['question'])
 
+    def test_get_last_quiz_question_in_category(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [20, 21],
+            'quiz_category': {'id': 1, 'type': 'Science'}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['question']['id'], 22)
+
+    def test_get_quiz_question_when_category_is_exhausted(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [20, 21, 22],
+            'quiz_category': {'id': 1, 'type': 'Science'}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['status'], False)
+        self.assertEqual(data['message'], 'No questions available')
+
+    def test_get_quiz_question_skips_deleted_question(self):
+        self.client().post('/quizzes', json=self.valid_quiz_data)
+        self.client().delete('/questions/22')
+
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [20, 21],
+            'quiz_category': {'id': 1, 'type': 'Science'}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['status'], False)
+
     def test_get_quiz_question_on_invalid_data(self):
         res = self.client().post('/quizzes', json=self.invalid_quiz_data)
         data = json.loads(res.data)
@@ -221,6 +1143,653 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['status'], False)
         self.assertEqual(data['message'], 'Bad request')
 
+    def test_get_quiz_questions_batch(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': 2, 'type': 'Art'},
+            'count': 3
+        })
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(set(ids)), 3)
+        self.assertTrue(all(question['category'] == 2
+                            for question in data['questions']))
+
+    def test_get_quiz_questions_batch_skips_previous_questions(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [20],
+            'quiz_category': {'id': 1, 'type': 'Science'},
+            'count': 5
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(sorted(question['id']
+                                for question in data['questions']), [21, 22])
+
+    def test_get_quiz_questions_batch_with_invalid_count(self):
+        for count in (0, 51, 'many'):
+            res = self.client().post('/quizzes', json={
+                'previous_questions': [],
+                'quiz_category': {'id': 1, 'type': 'Science'},
+                'count': count
+            })
+
+            self.assertEqual(res.status_code, 400)
+
+    def play_adaptive_quiz(self, previous_questions, recent_results,
+                           category_id=0):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': previous_questions,
+            'quiz_category': {'id': category_id, 'type': ''},
+            'adaptive': True,
+            'recent_results': recent_results
+        })
+        self.assertEqual(res.status_code, 200)
+
+        return json.loads(res.data)
+
+    def test_adaptive_quiz_starts_at_medium_difficulty(self):
+        data = self.play_adaptive_quiz([], [])
+
+        self.assertEqual(data['target_difficulty'], 3)
+        self.assertEqual(data['question']['difficulty'], 3)
+
+    def test_adaptive_quiz_steps_up_after_right_answers(self):
+        # Question 21 is a difficulty 3 question
+        data = self.play_adaptive_quiz([21], [True])
+
+        self.assertEqual(data['target_difficulty'], 4)
+        self.assertEqual(data['question']['difficulty'], 4)
+        self.assertNotEqual(data['question']['id'], 21)
+
+    def test_adaptive_quiz_steps_down_after_wrong_answers(self):
+        # Questions 20 and 22 are difficulty 4 questions
+        data = self.play_adaptive_quiz([20, 22], [False, False])
+
+        self.assertEqual(data['target_difficulty'], 3)
+        self.assertEqual(data['question']['difficulty'], 3)
+
+    def test_adaptive_quiz_falls_back_to_nearest_difficulty(self):
+        # Science has no difficulty 5 question and both of its difficulty 4
+        # questions were played, leaving question 21 (difficulty 3)
+        data = self.play_adaptive_quiz([20, 22], [True, True], category_id=1)
+
+        self.assertEqual(data['target_difficulty'], 5)
+        self.assertEqual(data['question']['id'], 21)
+
+    def test_adaptive_quiz_with_more_results_than_questions(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [21],
+            'quiz_category': {'id': 1, 'type': 'Science'},
+            'adaptive': True,
+            'recent_results': [True, False]
+        })
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_adaptive_quiz_picks_up_new_question(self):
+        self.client().get('/questions')
+        self.client().post('/quizzes', json=self.valid_quiz_data)
+        self.client().post('/questions', json={
+            **self.new_question, 'category': 1, 'difficulty': 5})
+
+        data = self.play_adaptive_quiz([20, 22], [True, True], category_id=1)
+
+        self.assertEqual(data['question']['difficulty'], 5)
+
+    def play_quiz_session(self):
+        res = self.client().post('/quizzes/sessions', json={
+            'quiz_category': {'id': 1, 'type': 'Science'}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['status'], True)
+        self.assertEqual(data['total_questions'], 3)
+
+        url = '/quizzes/sessions/{}/next'.format(data['session_id'])
+        played = []
+        for _ in range(3):
+            res = self.client().post(url)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            played.append(data['question']['id'])
+
+        self.assertEqual(sorted(played), [20, 21, 22])
+        self.assertEqual(data['remaining_questions'], 0)
+
+        res = self.client().post(url)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['status'], False)
+        self.assertEqual(data['message'], 'No questions available')
+
+    def score_answers(self, *scorecards):
+        res = self.client().post('/quizzes/answers', json={
+            'submissions': [{'answers': [
+                {'question_id': question_id, 'answer': answer}
+                for question_id, answer in scorecard]}
+                for scorecard in scorecards]})
+        self.assertEqual(res.status_code, 200)
+
+        return json.loads(res.data)['submissions']
+
+    def test_score_quiz_answers(self):
+        res = self.client().post('/quizzes/answers', json={'submissions': [
+            {'id': 'team-1', 'answers': [
+                {'question_id': 5, 'answer': 'maya angelou!'},
+                {'question_id': 14, 'answer': 'Palace of Versailes'},
+                {'question_id': 20, 'answer': 'liver'},
+                {'question_id': 18, 'answer': 'two'},
+                {'question_id': 15, 'answer': 'Agar'},
+                {'question_id': 1000, 'answer': 'Nobody'},
+            ]},
+            {'answers': [{'question_id': 21, 'answer': 'Fleming'}]},
+        ]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['submissions'][0], {
+            'id': 'team-1',
+            'results': [True, True, True, False, False, None],
+            'score': 3,
+            'total': 5,
+        })
+        self.assertEqual(data['submissions'][1],
+                         {'results': [False], 'score': 0, 'total': 1})
+
+    def test_score_quiz_answers_on_process_pool(self):
+        scorecards = [[(5, 'Maya Angelou'), (9, 'Muhamad Ali')],
+                      [(10, 'Brasil'), (11, 'Paraguay')]]
+        expected = self.score_answers(*scorecards)
+
+        self.app.config.update(SCORING_POOL_THRESHOLD=1, SCORING_WORKERS=2)
+        self.assertEqual(self.score_answers(*scorecards), expected)
+        self.assertIn('scoring_pool', self.app.extensions)
+        self.app.extensions['scoring_pool'].shutdown()
+
+    def test_scored_answers_follow_question_changes(self):
+        res = self.client().post('/questions', json=self.new_question)
+        question_id = json.loads(res.data)['question_id']
+        scorecard = [(question_id, 'Muhammad Buhari')]
+        self.assertEqual(self.score_answers(scorecard)[0]['score'], 0)
+
+        with self.app.app_context():
+            question = Question.query.get(question_id)
+            question.answer = 'Muhammadu Buhari'
+            question.update()
+
+        self.assertEqual(self.score_answers(scorecard)[0]['score'], 1)
+
+    def test_400_score_quiz_answers_with_invalid_data(self):
+        for body in ({}, {'submissions': []},
+                     {'submissions': [{'answers': [{'answer': 'One'}]}]},
+                     {'submissions': [{'answers': [
+                         {'question_id': '18', 'answer': 'One'}]}]}):
+            res = self.client().post('/quizzes/answers', json=body)
+            self.assertEqual(res.status_code, 400)
+
+    def test_play_quiz_session(self):
+        self.play_quiz_session()
+
+    def test_play_quiz_session_with_key_value_store(self):
+        self.app.config['QUIZ_SESSION_STORE'] = KeyValueSessionStore(
+            InMemoryKeyValue())
+        self.play_quiz_session()
+
+    def serve(self, app):
+        """Serves app from a local server in a background thread"""
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        return server.server_port
+
+    def join_room(self, port, room_id):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+        connection.request('GET', '/quizzes/rooms/{}/events'.format(room_id))
+        self.addCleanup(connection.close)
+        res = connection.getresponse()
+        self.assertEqual(res.headers.get_content_type(), 'text/event-stream')
+
+        return res
+
+    def read_event(self, stream):
+        """Returns the next event of the stream as raw bytes"""
+        lines = []
+        while True:
+            line = stream.readline()
+            if line == b'':
+                return None
+            if line == b'\n':
+                if any(l.startswith(b'event:') for l in lines):
+                    return b''.join(lines)
+                lines = []
+            else:
+                lines.append(line)
+
+    def event_data(self, event):
+        name, data = event.decode('utf-8').splitlines()
+        return name[len('event: '):], json.loads(data[len('data: '):])
+
+    def test_play_quiz_room(self):
+        res = self.client().post('/quizzes/rooms', json={
+            'quiz_category': {'id': 1, 'type': 'Science'}, 'rounds': 2})
+        room_id = json.loads(res.data)['room_id']
+        self.assertEqual(res.status_code, 201)
+
+        port = self.serve(self.app)
+        players = [self.join_room(port, room_id) for _ in range(2)]
+
+        data = json.loads(self.client().post(
+            '/quizzes/rooms/{}/next'.format(room_id)).data)
+        self.assertEqual(data['round'], 1)
+        self.assertNotIn('answer', data['question'])
+
+        # Every player gets the same bytes
+        events = [self.read_event(player) for player in players]
+        self.assertEqual(events[0], events[1])
+        name, payload = self.event_data(events[0])
+        self.assertEqual(name, 'question')
+        self.assertEqual(payload['question'], data['question'])
+
+        answer = Question.query.get(data['question']['id']).answer
+        for player, given in (('ada', answer.upper()), ('bob', 'no idea')):
+            res = self.client().post(
+                '/quizzes/rooms/{}/answers'.format(room_id),
+                json={'player': player, 'round': 1, 'answer': given})
+            self.assertEqual(res.status_code, 202)
+
+        self.client().post('/quizzes/rooms/{}/next'.format(room_id))
+        name, payload = self.event_data(self.read_event(players[0]))
+        self.assertEqual(name, 'results')
+        self.assertEqual(payload['results'], {'ada': True, 'bob': False})
+        self.assertEqual(payload['answer'], answer)
+        self.assertEqual(self.event_data(self.read_event(players[0]))[0],
+                         'question')
+
+        data = json.loads(self.client().post(
+            '/quizzes/rooms/{}/next'.format(room_id)).data)
+        self.assertEqual(data['status'], False)
+        self.assertEqual(data['scores'], {'ada': 1, 'bob': 0})
+
+        # The streams end with the final scores
+        for player in players:
+            events = list(iter(lambda: self.read_event(player), None))
+            self.assertEqual(self.event_data(events[-1]),
+                             ('end', {'scores': {'ada': 1, 'bob': 0}}))
+
+    def test_409_late_answer_to_quiz_room(self):
+        room_id = json.loads(self.client().post(
+            '/quizzes/rooms', json={'rounds': 3}).data)['room_id']
+        self.client().post('/quizzes/rooms/{}/next'.format(room_id))
+        self.client().post('/quizzes/rooms/{}/next'.format(room_id))
+
+        res = self.client().post('/quizzes/rooms/{}/answers'.format(room_id),
+                                 json={'player': 'ada', 'round': 1,
+                                       'answer': 'Late'})
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(json.loads(res.data)['status'], False)
+
+    def test_404_unknown_quiz_room(self):
+        res = self.client().get('/quizzes/rooms/unknown/events')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_create_quiz_session_with_limited_size(self):
+        res = self.client().post('/quizzes/sessions', json={'size': 5})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(data['total_questions'], 5)
+
+    def test_404_draw_from_unknown_quiz_session(self):
+        res = self.client().post('/quizzes/sessions/unknown/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['status'], False)
+        self.assertEqual(data['message'], 'Not found')
+
+    def test_400_create_quiz_session_with_invalid_size(self):
+        res = self.client().post('/quizzes/sessions', json={'size': 'all'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['status'], False)
+        self.assertEqual(data['message'], 'Bad request')
+
+    def test_get_pool_stats(self):
+        self.client().get('/categories')
+        res = self.client().get('/stats/pool')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['pool'])
+
+    def test_init_db_command(self):
+        result = self.app.test_cli_runner().invoke(args=['init-db'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('Initialized the database.', result.output)
+
+    def test_schema_is_created_on_first_request(self):
+        path = os.path.join(tempfile.mkdtemp(), 'trivia.db')
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+                          'DB_CREATE_ALL': True})
+
+        # Creating the app does not connect to the database
+        self.assertFalse(os.path.exists(path))
+
+        res = app.test_client().get('/categories/stats')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['total_questions'], 0)
+
+    def create_app_with_metrics(self, **config):
+        return create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                           'METRICS_ENABLED': True, **config})
+
+    def test_get_metrics(self):
+        client = self.create_app_with_metrics().test_client()
+        client.get('/questions')
+        res = client.get('/metrics')
+        metrics = res.data.decode('utf-8')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_requests_total{endpoint="/questions",'
+                      'method="GET",status="200"} 1', metrics)
+        self.assertIn('trivia_request_duration_seconds_count{'
+                      'endpoint="/questions",method="GET"} 1', metrics)
+        self.assertIn('trivia_request_db_queries_count{'
+                      'endpoint="/questions",method="GET"} 1', metrics)
+
+    def test_metrics_log_n_plus_one_suspects(self):
+        app = self.create_app_with_metrics(METRICS_QUERY_THRESHOLD=0)
+
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            app.test_client().get('/questions')
+
+        self.assertIn('Possible N+1 queries', logs.output[0])
+
+    def test_metrics_query_threshold_from_the_environment(self):
+        with mock.patch.dict(os.environ, {'METRICS_QUERY_THRESHOLD': '0'}):
+            app = self.create_app_with_metrics()
+
+        with self.assertLogs(app.logger, 'WARNING') as logs:
+            app.test_client().get('/questions')
+
+        self.assertIn('Possible N+1 queries', logs.output[0])
+
+    def test_404_metrics_when_disabled(self):
+        res = self.client().get('/metrics')
+
+        self.assertEqual(res.status_code, 404)
+
+    def explain(self, statement):
+        """Returns the query plan of statement, using the upgraded schema"""
+        with self.app.app_context():
+            upgrade_schema()
+            sql = str(statement.compile(
+                dialect=db.engine.dialect,
+                compile_kwargs={'literal_binds': True}))
+
+            with db.engine.connect() as connection:
+                if connection.dialect.name == 'postgresql':
+                    # The test tables are too small for the planner to
+                    # prefer an index on its own
+                    connection.exec_driver_sql('SET enable_seqscan = off')
+                    rows = connection.exec_driver_sql('EXPLAIN ' + sql)
+                else:
+                    rows = connection.exec_driver_sql(
+                        'EXPLAIN QUERY PLAN ' + sql)
+
+                return '\n'.join(str(row[-1]) for row in rows)
+
+    def test_category_page_uses_category_index(self):
+        plan = self.explain(select(*QUESTION_COLUMNS).where(
+            Question.category == 1).order_by(Question.id).limit(10))
+
+        self.assertIn('ix_questions_category_id', plan)
+
+    def test_category_keyset_page_uses_category_index(self):
+        plan = self.explain(select(*QUESTION_COLUMNS).where(
+            Question.category == 1, Question.id > 5
+        ).order_by(Question.id).limit(10))
+
+        self.assertIn('ix_questions_category_id', plan)
+
+    def test_category_count_uses_category_index(self):
+        plan = self.explain(select(func.count()).select_from(
+            Question).where(Question.category == 1))
+
+        self.assertIn('ix_questions_category_id', plan)
+
+    def test_upgrade_schema_is_idempotent(self):
+        with self.app.app_context():
+            upgrade_schema()
+            upgrade_schema()
+
+        res = self.client().get('/categories/1/questions')
+
+        self.assertEqual(res.status_code, 200)
+
+    def create_replica(self, question):
+        """Creates a SQLite stand-in replica holding a single question"""
+        directory = tempfile.mkdtemp()
+        url = 'sqlite:///' + os.path.join(directory, 'replica.db')
+        engine = create_engine(url)
+        db.metadata.create_all(engine)
+
+        with engine.begin() as connection:
+            connection.execute(insert(Category.__table__), {
+                'id': 1, 'type': 'Science'})
+            connection.execute(insert(Question.__table__), {
+                'question': question, 'answer': 'Replica', 'difficulty': 1,
+                'category': 1})
+        engine.dispose()
+
+        return url
+
+    def create_app_with_replicas(self, replicas, **config):
+        app = create_app(dict(config, DB_REPLICA_URLS=replicas,
+                              SQLALCHEMY_DATABASE_URI=self.database_path))
+
+        return app.test_client()
+
+    def test_reads_are_spread_over_replicas(self):
+        client = self.create_app_with_replicas([
+            self.create_replica('From replica a'),
+            self.create_replica('From replica b')], PAGE_CACHE_MAX_BYTES=0)
+
+        served = set()
+        for _ in range(4):
+            data = json.loads(client.get('/questions').data)
+            served.add(data['questions'][0]['question'])
+
+        self.assertEqual(served, {'From replica a', 'From replica b'})
+
+    def test_reads_after_a_write_stay_on_primary(self):
+        client = self.create_app_with_replicas([
+            self.create_replica('From replica a')])
+
+        res = client.post('/questions', json=self.new_question)
+        self.assertIn('trivia_primary=', res.headers['Set-Cookie'])
+
+        data = json.loads(client.get('/questions').data)
+
+        self.assertGreater(data['total_questions'], 1)
+
+    def test_reads_after_a_write_skip_pages_cached_from_replicas(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'DB_REPLICA_URLS': [
+                              self.create_replica('From replica a')]})
+        writer, reader = app.test_client(), app.test_client()
+
+        writer.post('/questions', json=self.new_question)
+        # A replica that has not caught up yet fills the page cache
+        data = json.loads(reader.get('/questions').data)
+        self.assertEqual(data['questions'][0]['question'], 'From replica a')
+        data = json.loads(writer.get('/questions').data)
+
+        self.assertNotEqual(data['questions'][0]['question'],
+                            'From replica a')
+
+    def test_failed_replica_is_taken_out_of_rotation(self):
+        client = self.create_app_with_replicas([
+            'sqlite:////nonexistent/replica.db',
+            self.create_replica('From replica a')])
+
+        for _ in range(2):
+            data = json.loads(client.get('/questions').data)
+            self.assertEqual(data['questions'][0]['question'],
+                             'From replica a')
+
+        replicas = json.loads(client.get('/stats/pool').data)['replicas']
+        self.assertEqual([replica['healthy'] for replica in replicas],
+                         [False, True])
+
+
+@unittest.skipUnless(importlib.util.find_spec('asyncpg'),
+                     'the async serving mode needs asyncpg')
+class AsyncTriviaTestCase(unittest.TestCase):
+    """This class represents the async (ASGI) serving mode test case"""
+
+    @classmethod
+    def setUpClass(cls):
+        create_test_schema()
+
+    def setUp(self):
+        self.database_path = get_database_path()
+        self.app = create_asgi_app(self.database_path)
+
+        # The Flask app the responses are compared with
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path})
+        self.client = app.test_client
+
+    def request(self, method, path, body=None):
+        path, _, query_string = path.partition('?')
+        scope = {'type': 'http', 'method': method, 'path': path,
+                 'query_string': query_string.encode('utf-8')}
+        messages = [{'type': 'http.request',
+                     'body': json.dumps(body).encode('utf-8')
+                     if body is not None else b''}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        async def call():
+            await self.app(scope, receive, send)
+            await self.app.engine.dispose()
+
+        asyncio.run(call())
+
+        # Streamed responses come in several body messages
+        return sent[0]['status'], b''.join(
+            message.get('body', b'') for message in sent[1:])
+
+    def assertSameResponse(self, method, path, body=None):
+        status, data = self.request(method, path, body)
+        res = self.client().open(path, method=method, json=body)
+
+        self.assertEqual(status, res.status_code)
+        self.assertEqual(data, res.data)
+
+    def test_get_categories(self):
+        self.assertSameResponse('GET', '/categories')
+
+    def test_get_questions(self):
+        self.assertSameResponse('GET', '/questions?page=2')
+
+    def test_404_get_beyond_valid_pages(self):
+        self.assertSameResponse('GET', '/questions?page=1000')
+
+    def test_get_questions_by_category(self):
+        self.assertSameResponse('GET', '/categories/2/questions')
+
+    def test_get_questions_by_invalid_category(self):
+        self.assertSameResponse('GET', '/categories/200/questions')
+
+    def test_search_questions(self):
+        self.assertSameResponse('POST', '/questions/search',
+                                {'searchTerm': 'title'})
+
+    def test_stream_questions_by_category(self):
+        self.assertSameResponse(
+            'GET', '/categories/1/questions?stream=true&per_page=2')
+
+    def test_stream_search_results(self):
+        self.assertSameResponse(
+            'POST', '/questions/search?stream=true&per_page=1&after_id=5',
+            {'searchTerm': 'title'})
+
+    def test_search_for_question_with_no_search_term(self):
+        self.assertSameResponse('POST', '/questions/search',
+                                {'searchTerm': ''})
+
+    def test_get_quiz_question(self):
+        status, data = self.request('POST', '/quizzes', {
+            'previous_questions': [20, 21],
+            'quiz_category': {'id': 1, 'type': 'Science'}
+        })
+
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(data)['question']['id'], 22)
+
+    def test_get_quiz_question_on_invalid_data(self):
+        self.assertSameResponse('POST', '/quizzes', {
+            'quiz_category': {'id': 5, 'type': 'Science'}
+        })
+
+    def test_adaptive_quiz_falls_back_to_nearest_difficulty(self):
+        self.assertSameResponse('POST', '/quizzes', {
+            'previous_questions': [20, 22],
+            'quiz_category': {'id': 1, 'type': 'Science'},
+            'adaptive': True,
+            'recent_results': [True, True]
+        })
+
+    def test_get_quiz_questions_batch(self):
+        status, data = self.request('POST', '/quizzes', {
+            'previous_questions': [20],
+            'quiz_category': {'id': 1, 'type': 'Science'},
+            'count': 5
+        })
+
+        self.assertEqual(status, 200)
+        self.assertEqual(sorted(question['id'] for question
+                                in json.loads(data)['questions']), [21, 22])
+
+    def test_get_quiz_questions_batch_with_invalid_count(self):
+        self.assertSameResponse('POST', '/quizzes', {
+            'previous_questions': [],
+            'quiz_category': {'id': 1, 'type': 'Science'},
+            'count': 0
+        })
+
+    def test_adaptive_quiz_with_invalid_results(self):
+        self.assertSameResponse('POST', '/quizzes', {
+            'previous_questions': [21],
+            'quiz_category': {'id': 1, 'type': 'Science'},
+            'adaptive': True,
+            'recent_results': ['yes']
+        })
+
+    def test_405_delete_through_async_app(self):
+        status, data = self.request('DELETE', '/questions')
+
+        self.assertEqual(status, 405)
+        self.assertEqual(json.loads(data)['message'], 'Method not allowed')
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -14,6 +14,7 @@ class QuizView extends Component {
       categories: {},
       numCorrect: 0,
       currentQuestion: {},
+      upcomingQuestions: [],
       guess: '',
       forceEnd: false,
     };
@@ -48,6 +49,25 @@ class QuizView extends Component {
       previousQuestions.push(this.state.currentQuestion.id);
     }
 
+    // The rest of the game is fetched with the first question
+    const [nextQuestion, ...upcomingQuestions] = this.state.upcomingQuestions;
+    if (nextQuestion) {
+      this.setState({
+        showAnswer: false,
+        previousQuestions: previousQuestions,
+        currentQuestion: nextQuestion,
+        upcomingQuestions: upcomingQuestions,
+        guess: '',
+      });
+      return;
+    }
+
+    // The game is over, there is nothing left to fetch
+    if (previousQuestions.length >= questionsPerPlay) {
+      this.setState({ previousQuestions: previousQuestions });
+      return;
+    }
+
     $.ajax({
       url: '/quizzes', //TODO: update request URL
       type: 'POST',
@@ -56,18 +76,21 @@ class QuizView extends Component {
       data: JSON.stringify({
         previous_questions: previousQuestions,
         quiz_category: this.state.quizCategory,
+        count: questionsPerPlay - previousQuestions.length,
       }),
       xhrFields: {
         withCredentials: true,
       },
       crossDomain: true,
       success: (result) => {
+        const [question, ...upcoming] = result.questions || [];
         this.setState({
           showAnswer: false,
           previousQuestions: previousQuestions,
-          currentQuestion: result.question,
+          currentQuestion: question,
+          upcomingQuestions: upcoming,
           guess: '',
-          forceEnd: result.question ? false : true,
+          forceEnd: question ? false : true,
         });
         return;
       },
@@ -94,6 +117,7 @@ class QuizView extends Component {
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
+      upcomingQuestions: [],
       guess: '',
       forceEnd: false,
     });